@@ -0,0 +1,441 @@
+"""
+asyncio-native serving mode.
+
+HTTP, progress streams (SSE and chunked), downloads and the /live WebSocket
+are served from one event loop, so a waiting client is a coroutine rather
+than a WSGI thread. Jobs queue on the loop with the same admission and
+fairness rules as scheduler.JobScheduler, then run the same
+MediaTranscriptionFacade pipeline as app.py (result cache, time ranges,
+parallel and streamed transcription) on JOB_WORKERS threads. Blocking file
+and sqlite work stays off the loop. Run with `python aio_server.py`; the
+API matches app.py.
+
+Subprocess output is not read on the loop with asyncio.create_subprocess_exec.
+Whisper runs as a pool of warm HTTP workers rather than a CLI whose stdout is
+parsed, and ffmpeg/yt-dlp are driven by the facade shared with app.py, so
+reading them on the loop would mean a second copy of the pipeline. What the
+loop buys is unchanged: an idle or streaming client costs a coroutine, and
+only the JOB_WORKERS running jobs hold a thread.
+"""
+import asyncio
+import itertools
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import aiofiles
+from aiohttp import WSCloseCode, WSMsgType, web
+
+from config import *
+from fetcher import url_media_info
+from live import LiveSession
+from media_processor import FileMediaSource, MediaTranscriptionFacade, URLMediaSource
+from metrics import QUEUE_DEPTH
+from metrics import render as render_metrics
+from probe import probe
+from scheduler import FairSemaphore, FairShare, Job, QueueFullError, job_cost, job_rank, sse_event
+from search_index import get_search_index
+from segment_store import SegmentStore, format_segments
+from speaker_diff import get_diarization_engine
+from storage import get_storage
+from utils import logger, parse_time_range, window_duration
+from whisper_pool import get_pool
+
+routes = web.RouteTableDef()
+
+# segment rows read per thread hop when streaming a time range
+SEGMENT_BATCH = 1000
+
+
+class AsyncFairSemaphore:
+    """Event-loop counterpart of scheduler.FairSemaphore: freed slots go to the best-ranked waiting job."""
+
+    def __init__(self, value):
+        self.value = value
+        self.waiters = []
+
+    async def acquire(self, job):
+        if self.value:
+            self.value -= 1
+            return
+        waiter = (job, asyncio.get_running_loop().create_future())
+        self.waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            else:
+                # granted just as the waiter was cancelled; pass the slot on
+                self.release()
+            raise
+
+    def release(self):
+        if not self.waiters:
+            self.value += 1
+            return
+        now = time.time()
+        waiter = min(self.waiters, key=lambda w: job_rank(w[0], now))
+        self.waiters.remove(waiter)
+        waiter[1].set_result(None)
+
+
+class AsyncJobScheduler:
+    """
+    Same admission and ordering rules as scheduler.JobScheduler (JOB_WORKERS
+    running, JOB_QUEUE_SIZE waiting, STAGE_LIMITS per stage, priority classes
+    and per-client fair share). Waiting jobs are tasks on the loop; running
+    ones hold one of `workers` threads, where their stage slots are taken.
+    """
+
+    def __init__(self, max_queue=JOB_QUEUE_SIZE, workers=JOB_WORKERS, stage_limits=None):
+        self.max_queue = max_queue
+        self.share = FairShare()
+        self.running = AsyncFairSemaphore(workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job-worker")
+        self.waiting = 0
+        self.jobs = {}
+        limits = STAGE_LIMITS if stage_limits is None else stage_limits
+        self.stage_semaphores = {name: FairSemaphore(limit) for name, limit in limits.items()}
+        QUEUE_DEPTH.getter = lambda: self.waiting
+        self.tasks = set()
+
+    def submit(self, runner, description="", duration=None, client=None, priority=None):
+        """Queue `runner(job)`, run on a worker thread, like JobScheduler.submit."""
+        if self.waiting >= self.max_queue:
+            raise QueueFullError(f"job queue is full ({self.max_queue} jobs waiting)")
+        self._prune()
+        job = Job(runner, description, self.stage_semaphores, duration, client, priority)
+        job.share = self.share
+        job.tag = self.share.tag(client, job_cost(duration))
+        self.jobs[job.id] = job
+        self.waiting += 1
+        task = asyncio.create_task(self._run(job))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        logger.info("Queued %s job %s for %s: %s", job.priority, job.id, client, description)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def backlog_seconds(self):
+        return sum(job.duration or 0 for job in self.jobs.values() if not job.done)
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        for job_id in [j.id for j in self.jobs.values() if j.done and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    async def _run(self, job):
+        await self.running.acquire(job)
+        try:
+            self.waiting -= 1
+            await asyncio.get_running_loop().run_in_executor(self.executor, job.run)
+        finally:
+            self.running.release()
+            self.share.finished(job.tag)
+
+
+def transcribe_job(media_source, start=None, end=None, diarize=True):
+    """The job runner app.py uses: the full MediaTranscriptionFacade pipeline."""
+    def run(job):
+        facade = MediaTranscriptionFacade(media_source, job=job, start=start, end=end)
+        streaming = STREAM_URL_SOURCES and isinstance(media_source, URLMediaSource)
+        yield from facade.transcribe_media(diarize=diarize, streaming=streaming)
+        yield "<br> Transcription completed!"
+
+    return run
+
+
+def client_id(request):
+    """Who a job is charged to for fair sharing, like app.py."""
+    return (JOB_CLIENT_HEADER and request.headers.get(JOB_CLIENT_HEADER)) or request.remote
+
+
+def submit_job(request, runner, description, duration=None, priority=None):
+    try:
+        job = request.app['scheduler'].submit(runner, description, duration, client_id(request), priority)
+    except QueueFullError as e:
+        logger.warning("Rejecting job %s: %s", description, e)
+        return web.json_response({"error": str(e)}, status=429)
+    return web.json_response(
+        {
+            "job_id": job.id,
+            "status": f"/jobs/{job.id}",
+            "stream": f"/jobs/{job.id}/stream",
+            "backlog_seconds": request.app['scheduler'].backlog_seconds(),
+        },
+        status=202,
+    )
+
+
+@routes.get('/')
+async def index(request):
+    return web.FileResponse(os.path.join(BASE_PATH, 'templates', 'index.html'))
+
+
+@routes.get('/static/styles.css')
+async def styles(request):
+    return web.FileResponse(os.path.join(BASE_PATH, 'templates', 'styles.css'))
+
+
+def requested_range(values):
+    """The optional `start`/`end` values (seconds or [hh:]mm:ss), like app.requested_range."""
+    return parse_time_range(values.get('start'), values.get('end'))
+
+
+@routes.post('/t')
+async def upload_file(request):
+    values = dict(request.query)
+    file_path = filename = None
+    reader = await request.multipart()
+    while (field := await reader.next()) is not None:
+        if field.name != 'file':
+            values[field.name] = await field.text()
+            continue
+        filename = field.filename
+        # spool the upload to tmpfs when enabled; the job decodes it and removes it
+        file_path = os.path.join(SCRATCH_PATH if IN_MEMORY_AUDIO else MEDIA_PATH, str(uuid.uuid4()))
+        async with aiofiles.open(file_path, 'wb') as f:
+            while chunk := await field.read_chunk():
+                await f.write(chunk)
+    if file_path is None:
+        return web.json_response({"error": "missing file"}, status=400)
+    try:
+        start, end = requested_range(values)
+    except ValueError as e:
+        await asyncio.to_thread(os.remove, file_path)
+        return web.json_response({"error": str(e)}, status=400)
+    info = await asyncio.to_thread(probe, file_path)
+    duration = window_duration(info and info.duration, start, end)
+    if duration == 0:
+        await asyncio.to_thread(os.remove, file_path)
+        return web.json_response(
+            {"error": f"start ({start}) is past the end of the media ({info.duration})"}, status=400
+        )
+    response = submit_job(
+        request,
+        transcribe_job(FileMediaSource(file_path, temporary=True, audio_info=info), start, end),
+        filename,
+        duration=duration,
+        priority=values.get('priority'),
+    )
+    if response.status == 429:
+        await asyncio.to_thread(os.remove, file_path)
+    return response
+
+
+@routes.post('/url')
+async def tr_url(request):
+    values = {**request.query, **await request.post()}
+    try:
+        start, end = requested_range(values)
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    source_url = values.get('url')
+    duration = window_duration(None, start, end)
+    if duration is None and source_url:
+        # cached for the job itself; a lookup that times out leaves the job batch until it starts
+        _, media_duration = await asyncio.to_thread(url_media_info, source_url, JOB_URL_PROBE_TIMEOUT_SECONDS)
+        duration = window_duration(media_duration, start, end)
+    return submit_job(
+        request,
+        transcribe_job(URLMediaSource(source_url), start, end),
+        source_url,
+        duration=duration,
+        priority=values.get('priority'),
+    )
+
+
+@routes.get('/jobs/{job_id}')
+async def job_status(request):
+    job = request.app['scheduler'].get(request.match_info['job_id'])
+    if job is None:
+        return web.json_response({"error": "unknown job"}, status=404)
+    return web.json_response(job.to_dict())
+
+
+@routes.get('/jobs/{job_id}/stream')
+async def job_stream(request):
+    job = request.app['scheduler'].get(request.match_info['job_id'])
+    if job is None:
+        return web.json_response({"error": "unknown job"}, status=404)
+    try:
+        after = int(request.query.get('after', 0))
+    except ValueError:
+        return web.json_response({"error": "after must be an integer"}, status=400)
+    response = web.StreamResponse(headers={'Content-Type': 'text/html; charset=utf-8'})
+    await response.prepare(request)
+    async for _, message in job.events.aiter_since(after):
+        await response.write(message.encode())
+    await response.write_eof()
+    return response
+
+
+@routes.get('/jobs/{job_id}/events')
+async def job_events(request):
+    job = request.app['scheduler'].get(request.match_info['job_id'])
+    if job is None:
+        return web.json_response({"error": "unknown job"}, status=404)
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID') or request.query.get('last_event_id', 0))
+    except ValueError:
+        return web.json_response({"error": "last event id must be an integer"}, status=400)
+    response = web.StreamResponse(
+        headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    await response.prepare(request)
+    async for event in job.events.aiter_since(last_event_id, heartbeat=15):
+        if event is None:
+            await response.write(b": keep-alive\n\n")
+        else:
+            await response.write(sse_event(*event).encode())
+    await response.write(sse_event(job.events.last_id, job.status, event="done").encode())
+    await response.write_eof()
+    return response
+
+
+@routes.get('/search')
+async def search(request):
+    """Transcript segments matching ?q=, like app.py."""
+    if not SEARCH_INDEX_ENABLED:
+        return web.json_response({"error": "search is disabled"}, status=404)
+    query = request.query.get('q', '')
+    try:
+        limit = max(1, min(int(request.query.get('limit', 50)), SEARCH_MAX_RESULTS))
+        hits = await asyncio.to_thread(
+            get_search_index().search, query, limit, request.query.get('job'), request.query.get('order') == 'rank'
+        )
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    for hit in hits:
+        hit["segment"] = f"/download/s/{hit['job_id']}?start={hit['start'] / 1000:.3f}&end={hit['end'] / 1000:.3f}"
+    return web.json_response({"query": query, "hits": hits})
+
+
+@routes.get('/live')
+async def live(request):
+    """
+    Live transcription over a WebSocket: the client sends 16 kHz mono s16le
+    PCM as binary messages and the text message "end" when done, and gets
+    the session's events back as JSON (see live.LiveSession).
+    """
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    sessions = request.app['live_sessions']
+    if sessions.locked():
+        await ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b"too many live sessions")
+        return ws
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    async def send():
+        while (event := await events.get()) is not None:
+            await ws.send_json(event)
+
+    async with sessions:
+        session = await asyncio.to_thread(
+            LiveSession,
+            lambda event: loop.call_soon_threadsafe(events.put_nowait, event),
+            diarize=request.query.get('diarize', '1') != '0',
+        )
+        logger.info("Live session %s started", session.id)
+        sender = asyncio.create_task(send())
+        try:
+            async for message in ws:
+                if message.type == WSMsgType.BINARY:
+                    session.feed(message.data)
+                elif message.type == WSMsgType.TEXT and message.data == "end":
+                    await asyncio.to_thread(session.finish)
+                    break
+        finally:
+            session.close()
+            events.put_nowait(None)
+            await sender
+            await ws.close()
+            logger.info("Live session %s closed", session.id)
+    return ws
+
+
+@routes.get('/metrics')
+async def metrics(request):
+    return web.Response(text=render_metrics(), content_type='text/plain', headers={'X-Content-Type-Options': 'nosniff'})
+
+
+@routes.get('/download/{transcription_type}/{uuid_str}')
+async def download_file(request):
+    uuid_str = os.path.basename(request.match_info['uuid_str'])
+    if request.match_info['transcription_type'] == "s":
+        return await download_segments(request, uuid_str)
+    await asyncio.to_thread(get_storage().touch, uuid_str)
+    paths = {
+        "f": f"transcript_{uuid_str}.txt",
+        "x": f"{uuid_str}.fo.txt",
+        "r": f"{uuid_str}.rttm",
+        "c": f"{uuid_str}.csv",
+    }
+    name = paths.get(request.match_info['transcription_type'])
+    if name is None or not os.path.exists(os.path.join(MEDIA_PATH, name)):
+        raise web.HTTPNotFound()
+    return web.FileResponse(
+        os.path.join(MEDIA_PATH, name), headers={'Content-Disposition': f'attachment; filename="{name}"'}
+    )
+
+
+async def download_segments(request, uuid_str):
+    """Segments overlapping ?start=&end= as JSON lines or ?format=csv, like app.py."""
+    base_file_name = os.path.join(MEDIA_PATH, uuid_str)
+    if not SegmentStore.exists(base_file_name):
+        raise web.HTTPNotFound()
+    try:
+        start, end = parse_time_range(request.query.get('start'), request.query.get('end'))
+    except ValueError as e:
+        return web.json_response({"error": str(e)}, status=400)
+    await asyncio.to_thread(get_storage().touch, uuid_str)
+    as_csv = request.query.get('format') == 'csv'
+    response = web.StreamResponse(
+        headers={'Content-Type': 'text/csv' if as_csv else 'application/x-ndjson'}
+    )
+    await response.prepare(request)
+    store = await asyncio.to_thread(SegmentStore, base_file_name)
+    try:
+        segments = store.iter_range(
+            None if start is None else round(start * 1000), None if end is None else round(end * 1000)
+        )
+        rows = format_segments(segments, as_csv)
+        # the store reads from disk, so pull rows in batches off the loop
+        while batch := await asyncio.to_thread(lambda: list(itertools.islice(rows, SEGMENT_BATCH))):
+            await response.write("".join(batch).encode())
+    finally:
+        await asyncio.to_thread(store.close)
+    await response.write_eof()
+    return response
+
+
+async def on_startup(app):
+    app['scheduler'] = AsyncJobScheduler()
+    app['live_sessions'] = asyncio.Semaphore(LIVE_MAX_SESSIONS)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, get_storage)
+    # both load models, keep them off the event loop
+    await loop.run_in_executor(None, get_pool)
+    await loop.run_in_executor(None, get_diarization_engine().warm_up)
+
+
+def create_app():
+    app = web.Application()
+    app.add_routes(routes)
+    app.on_startup.append(on_startup)
+    return app
+
+
+def main():
+    logger.info('Starting asyncio server...')
+    port = int(os.environ.get('PORT') if os.environ.get('PORT') is not None else 8833)
+    web.run_app(create_app(), port=port)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,22 @@ import os
 import sys
 import uuid
 
-from flask import Flask, Response, render_template, request, send_file, stream_with_context
+from flask import Flask, Response, jsonify, render_template, request, send_file, stream_with_context
 from flask_cors import CORS
 
 from config import *
+from batch import get_batch, parse_manifest, start_batch
+from fetcher import url_media_info
 from media_processor import FileMediaSource, MediaSource, MediaTranscriptionFacade, URLMediaSource
-from utils import logger
+from metrics import render as render_metrics
+from probe import probe
+from scheduler import QueueFullError, get_scheduler
+from search_index import get_search_index
+from segment_store import SegmentStore, format_segments
+from speaker_diff import get_diarization_engine
+from storage import get_storage
+from utils import logger, parse_time_range, window_duration
+from whisper_pool import get_pool
 
 app = Flask("PODV2T")
 app.config['SESSION_TYPE'] = SESSION_TYPE
@@ -15,17 +25,38 @@ app.config['PERMANENT_SESSION_LIFETIME'] = PERMANENT_SESSION_LIFETIME
 CORS(app, send_wildcard=True, resources={r"/": {"origins": ""}})
 
 
-def gen(url_media_source: MediaSource):
-    transcription_facade = MediaTranscriptionFacade(url_media_source)
+def gen(url_media_source: MediaSource, start=None, end=None):
+    def run(job):
+        transcription_facade = MediaTranscriptionFacade(url_media_source, job=job, start=start, end=end)
+        streaming = STREAM_URL_SOURCES and isinstance(url_media_source, URLMediaSource)
+        yield from transcription_facade.transcribe_media(diarize=True, streaming=streaming)
+        yield "<br> Transcription completed!"
+
+    return run
+
+
+def client_id():
+    """Who a job is charged to for fair sharing: the remote address, or JOB_CLIENT_HEADER when configured."""
+    return (JOB_CLIENT_HEADER and request.headers.get(JOB_CLIENT_HEADER)) or request.remote_addr
+
 
+def submit_job(runner, description, spooled_file=None, duration=None):
     try:
-        for line in transcription_facade.transcribe_media():
-            yield line
-    except Exception as e:
-        logger.error(f"An error occurred while extracting audio {e}")
-        yield f"An error occurred while extracting audio {e}"
-    finally:
-        yield "<br> Transcription completed!"
+        job = get_scheduler().submit(runner, description, duration, client_id(), request.values.get('priority'))
+    except QueueFullError as e:
+        logger.warning("Rejecting job %s: %s", description, e)
+        if spooled_file:
+            os.remove(spooled_file)
+        return jsonify(error=str(e)), 429
+    return (
+        jsonify(
+            job_id=job.id,
+            status=f"/jobs/{job.id}",
+            stream=f"/jobs/{job.id}/stream",
+            backlog_seconds=get_scheduler().backlog_seconds(),
+        ),
+        202,
+    )
 
 
 @app.route('/', methods=["GET"])
@@ -34,36 +65,215 @@ def index():
         return render_template('index.html')
 
 
+def requested_range():
+    """The optional `start`/`end` form or query values (seconds or [hh:]mm:ss)."""
+    return parse_time_range(request.values.get('start'), request.values.get('end'))
+
+
 @app.route('/t', methods=['GET', 'POST'])
 def upload_file():
+    try:
+        start, end = requested_range()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
     file = request.files['file']
     file_new = f"{str(uuid.uuid4())}"
-    file.save(os.path.join('media', file_new))
+    # spool the upload to tmpfs when enabled; the job decodes it and removes it
+    file_path = os.path.join(SCRATCH_PATH if IN_MEMORY_AUDIO else MEDIA_PATH, file_new)
+    file.save(file_path)
+    info = probe(file_path)
+    duration = window_duration(info and info.duration, start, end)
+    if duration == 0:
+        os.remove(file_path)
+        return jsonify(error=f"start ({start}) is past the end of the media ({info.duration})"), 400
 
-    return Response(stream_with_context(gen(FileMediaSource(os.path.join('media', file_new)))))
+    return submit_job(
+        gen(FileMediaSource(file_path, temporary=True, audio_info=info), start, end),
+        file.filename,
+        spooled_file=file_path,
+        duration=duration,
+    )
 
 
 @app.route('/url', methods=["GET", "POST"])
 def tr_url():
+    try:
+        start, end = requested_range()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
     source_url = request.form.get('url')
     url_media_source = URLMediaSource(source_url)
+    duration = window_duration(None, start, end)
+    if duration is None and source_url:
+        # cached for the job itself; a lookup that times out leaves the job batch until it starts
+        duration = window_duration(url_media_info(source_url, JOB_URL_PROBE_TIMEOUT_SECONDS)[1], start, end)
+
+    return submit_job(gen(url_media_source, start, end), source_url, duration=duration)
+
+
+@app.route('/jobs/<job_id>', methods=["GET"])
+def job_status(job_id):
+    job = get_scheduler().get(job_id)
+    if job is None:
+        return jsonify(error="unknown job"), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/jobs/<job_id>/stream', methods=["GET"])
+def job_stream(job_id):
+    job = get_scheduler().get(job_id)
+    if job is None:
+        return jsonify(error="unknown job"), 404
+    return Response(stream_with_context(job.iter_events(request.args.get('after', 0, type=int))))
+
 
-    return Response(stream_with_context(gen(url_media_source)))
+@app.route('/jobs/<job_id>/events', methods=["GET"])
+def job_events(job_id):
+    job = get_scheduler().get(job_id)
+    if job is None:
+        return jsonify(error="unknown job"), 404
+    last_event_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('last_event_id', 0, type=int)
+    return Response(
+        stream_with_context(job.iter_sse(last_event_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
+@app.route('/batch', methods=["POST"])
+def submit_batch():
+    """
+    Start a batch from a manifest of URLs: a `manifest` file or form field,
+    or a JSON body {"sources": [...], "diarize": bool}. Files uploaded as
+    `files` join the batch too.
+    """
+    body = request.get_json(silent=True) or {}
+    if 'manifest' in request.files:
+        lines = request.files['manifest'].read().decode('utf-8').splitlines()
+    else:
+        lines = body.get('sources') or request.form.get('manifest', '').splitlines()
+    diarize = body.get('diarize', request.form.get('diarize', '1') not in ('0', 'false'))
+    uploads = []
+    try:
+        sources = list(parse_manifest(lines))
+        for file in request.files.getlist('files'):
+            file_path = os.path.join(SCRATCH_PATH if IN_MEMORY_AUDIO else MEDIA_PATH, str(uuid.uuid4()))
+            file.save(file_path)
+            uploads.append((file.filename, file_path))
+        if not sources and not uploads:
+            raise ValueError("empty manifest")
+        # only URLs from the network, never paths on this machine
+        batch = start_batch(sources, allow_files=False, uploads=uploads, diarize=bool(diarize), client=client_id())
+    except ValueError as e:
+        for _, file_path in uploads:
+            os.remove(file_path)
+        return jsonify(error=str(e)), 400
+    return (
+        jsonify(
+            batch_id=batch.id,
+            sources=len(batch.entries),
+            duplicates=batch.duplicates,
+            status=f"/batches/{batch.id}",
+            results=f"/batches/{batch.id}/results",
+        ),
+        202,
+    )
+
+
+@app.route('/batches/<batch_id>', methods=["GET"])
+def batch_status(batch_id):
+    batch = get_batch(batch_id)
+    if batch is None:
+        return jsonify(error="unknown batch"), 404
+    return jsonify(batch.to_dict())
+
+
+@app.route('/batches/<batch_id>/results', methods=["GET"])
+def batch_results(batch_id):
+    """Consolidated results so far, as JSONL (default) or ?format=csv."""
+    batch = get_batch(batch_id)
+    if batch is None:
+        return jsonify(error="unknown batch"), 404
+    if request.args.get('format') == 'csv':
+        path, mimetype = batch.csv_path, 'text/csv'
+    else:
+        path, mimetype = batch.jsonl_path, 'application/x-ndjson'
+    # results are evicted with the rest of media/ once they exceed the quota or expire
+    if not os.path.exists(path):
+        return jsonify(error="not found"), 404
+    get_storage().touch(batch.id)
+    return send_file(path, mimetype=mimetype, as_attachment=True)
+
+
+@app.route('/search', methods=["GET"])
+def search():
+    """
+    Transcript segments matching ?q=, newest first or by relevance with
+    ?order=rank. Every word and "quoted phrase" must appear; ?job= limits the
+    search to one job.
+    """
+    if not SEARCH_INDEX_ENABLED:
+        return jsonify(error="search is disabled"), 404
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 50, type=int), SEARCH_MAX_RESULTS))
+    try:
+        hits = get_search_index().search(
+            query, limit, request.args.get('job'), ranked=request.args.get('order') == 'rank'
+        )
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    for hit in hits:
+        hit["segment"] = f"/download/s/{hit['job_id']}?start={hit['start'] / 1000:.3f}&end={hit['end'] / 1000:.3f}"
+    return jsonify(query=query, hits=hits)
+
+
+@app.route('/metrics', methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain')
 
 
 @app.route('/download/<transcription_type>/<uuid_str>', methods=["GET"])
 def download_file(uuid_str, transcription_type):
     temp_dir = os.path.join(os.getcwd(), 'media')
-    if transcription_type == "w":
-        return send_file(f"{temp_dir}/{uuid_str}.wav", as_attachment=True)
-    if transcription_type == "f":
-        return send_file(f"{temp_dir}/transcript_{uuid_str}.txt", as_attachment=True)
-    if transcription_type == "x":
-        return send_file(f"{temp_dir}/{uuid_str}.fo.txt", as_attachment=True)
-    if transcription_type == "r":
-        return send_file(f"{temp_dir}/{uuid_str}.rttm", as_attachment=True)
-    if transcription_type == "c":
-        return send_file(f"{temp_dir}/{uuid_str}.csv", as_attachment=True)
+    if transcription_type == "s":
+        return download_segments(uuid_str)
+    paths = {
+        "f": f"{temp_dir}/transcript_{uuid_str}.txt",
+        "x": f"{temp_dir}/{uuid_str}.fo.txt",
+        "r": f"{temp_dir}/{uuid_str}.rttm",
+        "c": f"{temp_dir}/{uuid_str}.csv",
+    }
+    path = paths.get(transcription_type)
+    # outputs are evicted once they exceed the media quota or expire
+    if path is None or not os.path.exists(path):
+        return jsonify(error="not found"), 404
+    get_storage().touch(uuid_str)
+    return send_file(path, as_attachment=True)
+
+
+def download_segments(uuid_str):
+    """
+    Segments overlapping ?start=&end= (seconds or [hh:]mm:ss) as JSON lines, or
+    CSV with ?format=csv, read from the memory-mapped segment store.
+    """
+    base_file_name = os.path.join(MEDIA_PATH, os.path.basename(uuid_str))
+    if not SegmentStore.exists(base_file_name):
+        return jsonify(error="not found"), 404
+    try:
+        start, end = requested_range()
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    get_storage().touch(uuid_str)
+    start_ms = None if start is None else round(start * 1000)
+    end_ms = None if end is None else round(end * 1000)
+    as_csv = request.args.get('format') == 'csv'
+
+    def generate():
+        with SegmentStore(base_file_name) as store:
+            yield from format_segments(store.iter_range(start_ms, end_ms), as_csv)
+
+    mimetype = 'text/csv' if as_csv else 'application/x-ndjson'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
 
 
 @app.route('/static/styles.css', methods=["GET"])
@@ -74,6 +284,9 @@ def styles():
 def main():
     logger.info('Starting server...')
     try:
+        get_storage()
+        get_pool()
+        get_diarization_engine().warm_up()
         port = int(os.environ.get('PORT') if os.environ.get('PORT') is not None else 8833)
         app.run(debug=False, port=port)
     except Exception as e:
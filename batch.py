@@ -0,0 +1,293 @@
+"""
+Bulk transcription of a manifest of files and URLs.
+
+A manifest has one source per line (blank lines and `#` comments are
+skipped); a line may also be a JSON object with a "url" or "file" key.
+Sources are deduplicated, fed to the job scheduler with at most `parallel`
+jobs in flight, and every finished source is appended to one consolidated
+JSONL file and one CSV of segments.
+
+    python batch.py back-catalogue.txt --parallel 4 --jsonl out.jsonl --csv out.csv
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urldefrag
+
+from config import *
+from media_processor import FileMediaSource, MediaTranscriptionFacade, URLMediaSource
+from probe import probe
+from scheduler import QueueFullError, get_scheduler
+from segment_store import csv_text, iter_csv_rows
+from speaker_index import merge_speakers, sorted_rttm_turns
+from storage import get_storage
+from utils import logger
+
+CSV_FIELDS = ["source", "start", "end", "speaker", "text"]
+
+
+def is_url(source):
+    return source.startswith(("http://", "https://"))
+
+
+def parse_manifest(lines):
+    """Yield the sources listed in a manifest, in order, duplicates included."""
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            entry = json.loads(line)
+            line = entry.get("url") or entry.get("file")
+            if not line:
+                raise ValueError(f"manifest entry has no url or file: {entry}")
+        yield line
+
+
+def normalize_source(source):
+    """Key used for deduplication: URLs without fragment, files by real path."""
+    if is_url(source):
+        return urldefrag(source.strip())[0]
+    return os.path.realpath(source)
+
+
+class BatchEntry:
+    def __init__(self, source, media_source):
+        self.source = source
+        self.media_source = media_source
+        self.status = "pending"
+        self.job = None
+        self.processor = None
+        self.error = None
+
+
+class Batch:
+    """
+    One manifest's worth of jobs. `run` blocks until every entry has finished;
+    `start` runs it on a background thread.
+    """
+
+    def __init__(self, entries, diarize=True, parallel=BATCH_PARALLELISM, jsonl_path=None, csv_path=None,
+                 duplicates=0, client=None):
+        self.id = str(uuid.uuid4())
+        self.entries = entries
+        # the submitter the jobs are charged to; a batch of its own when run from the command line
+        self.client = client or f"batch-{self.id}"
+        self.diarize = diarize
+        self.parallel = max(1, parallel)
+        self.duplicates = duplicates
+        self.jsonl_path = jsonl_path or os.path.join(MEDIA_PATH, f"batch_{self.id}.jsonl")
+        self.csv_path = csv_path or os.path.join(MEDIA_PATH, f"batch_{self.id}.csv")
+        self.output_lock = threading.Lock()
+        self.created_at = time.time()
+        self.finished_at = None
+        open(self.jsonl_path, 'w').close()
+        with open(self.csv_path, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(CSV_FIELDS)
+
+    @classmethod
+    def from_sources(cls, sources, allow_files=True, uploads=(), **kwargs):
+        """
+        Build a batch from manifest `sources`, dropping duplicates. `uploads` are
+        (name, spooled path) pairs of files uploaded with the request, removed
+        by their jobs once transcribed.
+        """
+        entries = {}
+        duplicates = 0
+        if len(sources) + len(uploads) > BATCH_MAX_SOURCES:
+            raise ValueError(f"a batch takes at most {BATCH_MAX_SOURCES} sources")
+        for name, file_path in uploads:
+            entries[file_path] = BatchEntry(name, FileMediaSource(file_path, temporary=True))
+        for source in sources:
+            key = normalize_source(source)
+            if key in entries:
+                duplicates += 1
+                continue
+            if is_url(source):
+                media_source = URLMediaSource(key)
+            elif allow_files:
+                media_source = FileMediaSource(key)
+            else:
+                raise ValueError(f"not a URL: {source}")
+            entries[key] = BatchEntry(source, media_source)
+        return cls(list(entries.values()), duplicates=duplicates, **kwargs)
+
+    @property
+    def done(self):
+        return self.finished_at is not None
+
+    def start(self):
+        threading.Thread(target=self.run, name=f"batch-{self.id}", daemon=True).start()
+        return self
+
+    def run(self):
+        logger.info("Batch %s: %d sources (%d duplicates dropped)", self.id, len(self.entries), self.duplicates)
+        get_storage().open(self.id)
+        try:
+            with ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix=f"batch-{self.id[:8]}") as executor:
+                list(executor.map(self._run_entry, self.entries))
+        finally:
+            # consolidated outputs written elsewhere (batch.py --jsonl/--csv) are the caller's to keep
+            outputs = [p for p in (self.jsonl_path, self.csv_path) if os.path.dirname(os.path.abspath(p)) == MEDIA_PATH]
+            get_storage().close(self.id, outputs)
+        self.finished_at = time.time()
+        logger.info("Batch %s finished: %s", self.id, self.counts())
+        return self
+
+    def _runner(self, entry):
+        def run(job):
+            facade = MediaTranscriptionFacade(entry.media_source, job=job)
+            entry.processor = facade.media_processor
+            # keep the outputs from eviction until _write_result has read them
+            get_storage().open(entry.processor.uuid_str)
+            streaming = STREAM_URL_SOURCES and isinstance(entry.media_source, URLMediaSource)
+            yield from facade.transcribe_media(diarize=self.diarize, streaming=streaming)
+
+        return run
+
+    def _submit(self, entry):
+        """Submit the entry's job, waiting out a full scheduler queue."""
+        duration = None
+        if isinstance(entry.media_source, FileMediaSource):
+            info = probe(entry.media_source.get_media())
+            duration = info and info.duration
+        delay = 0.5
+        while True:
+            try:
+                return get_scheduler().submit(self._runner(entry), entry.source, duration, self.client, "batch")
+            except QueueFullError:
+                time.sleep(delay)
+                delay = min(delay * 2, 10)
+
+    def _run_entry(self, entry):
+        entry.status = "queued"
+        try:
+            entry.job = self._submit(entry)
+            entry.status = "running"
+            for _ in entry.job.iter_events():
+                pass
+            entry.status = entry.job.status
+            entry.error = entry.job.error
+        except Exception as e:
+            logger.error("Batch %s: %s failed: %s", self.id, entry.source, e)
+            entry.status, entry.error = "failed", str(e)
+        try:
+            self._write_result(entry)
+        finally:
+            if entry.processor is not None:
+                get_storage().close(entry.processor.uuid_str)
+
+    def segments(self, entry):
+        """Transcript segments of a finished entry, with speakers when diarized."""
+        if entry.processor is None or entry.status != "done":
+            return []
+        with open(f"{entry.processor.base_file_name}.csv", newline='', encoding='utf-8') as f:
+            rows = ((start, end, csv_text(raw)) for start, end, raw in iter_csv_rows(f))
+            rttm_file_path = f"{entry.processor.base_file_name}.rttm"
+            if self.diarize and os.path.exists(rttm_file_path):
+                merged = merge_speakers(rows, sorted_rttm_turns(rttm_file_path))
+            else:
+                merged = ((start, end, None, text) for start, end, text in rows)
+            return [
+                {"start": start, "end": end, "speaker": speaker, "text": text.strip()}
+                for start, end, speaker, text in merged
+            ]
+
+    def _write_result(self, entry):
+        try:
+            segments = self.segments(entry)
+        except (OSError, ValueError) as e:
+            entry.status, entry.error, segments = "failed", f"could not read results: {e}", []
+        record = {
+            "source": entry.source,
+            "status": entry.status,
+            "job_id": entry.job.id if entry.job else None,
+            "id": entry.processor.uuid_str if entry.processor else None,
+            "duration": entry.job.duration if entry.job else None,
+            "error": entry.error,
+            "segments": segments,
+        }
+        with self.output_lock:
+            with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + "\n")
+            with open(self.csv_path, 'a', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                for segment in segments:
+                    writer.writerow([entry.source, *(segment[field] for field in CSV_FIELDS[1:])])
+
+    def counts(self):
+        counts = {}
+        for entry in self.entries:
+            counts[entry.status] = counts.get(entry.status, 0) + 1
+        return counts
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "sources": len(self.entries),
+            "duplicates": self.duplicates,
+            "counts": self.counts(),
+            "done": self.done,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "entries": [
+                {"source": e.source, "status": e.status, "job_id": e.job.id if e.job else None, "error": e.error}
+                for e in self.entries
+            ],
+        }
+
+
+_batches = {}
+_batches_lock = threading.Lock()
+
+
+def start_batch(sources, **kwargs):
+    """Register and start a batch over `sources`; returns the Batch."""
+    batch = Batch.from_sources(sources, **kwargs)
+    get_storage().on_evict(_forget_batch)
+    with _batches_lock:
+        _batches[batch.id] = batch
+    return batch.start()
+
+
+def get_batch(batch_id):
+    with _batches_lock:
+        return _batches.get(batch_id)
+
+
+def _forget_batch(batch_id):
+    """Drop a batch once storage has evicted its results; other job ids are ignored."""
+    with _batches_lock:
+        _batches.pop(batch_id, None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('manifest', help="file with one path or URL per line, '-' for stdin")
+    parser.add_argument('--parallel', type=int, default=BATCH_PARALLELISM, help="jobs in flight at once")
+    parser.add_argument('--no-diarize', action='store_true')
+    parser.add_argument('--jsonl', help="where to write the consolidated JSONL (default media/batch_<id>.jsonl)")
+    parser.add_argument('--csv', help="where to write the consolidated CSV (default media/batch_<id>.csv)")
+    args = parser.parse_args()
+
+    if args.manifest == '-':
+        sources = list(parse_manifest(sys.stdin))
+    else:
+        with open(args.manifest, encoding='utf-8') as f:
+            sources = list(parse_manifest(f))
+    batch = Batch.from_sources(
+        sources, diarize=not args.no_diarize, parallel=args.parallel, jsonl_path=args.jsonl, csv_path=args.csv
+    )
+    batch.run()
+    print(json.dumps({"counts": batch.counts(), "jsonl": batch.jsonl_path, "csv": batch.csv_path}))
+    return 0 if batch.counts().get("failed", 0) == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""
+Compare offline (batched) and realtime diarization on the same WAV.
+
+Reports wall-clock seconds spent per hour of audio for each mode. Needs diart
+and its models; pass a real 16 kHz mono recording for meaningful numbers.
+
+    python benchmarks/bench_diarization.py media/episode.wav --repeat 3
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from speaker_diff import get_diarization_engine  # noqa: E402
+
+
+def audio_seconds(wav_file_path):
+    with wave.open(wav_file_path) as w:
+        return w.getnframes() / w.getframerate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('wav', help="16 kHz mono WAV to diarize")
+    parser.add_argument('--modes', nargs='+', default=['offline', 'realtime'])
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    hours = audio_seconds(args.wav) / 3600
+    engine = get_diarization_engine()
+    engine.warm_up()
+
+    print(f"{'mode':>10} {'run':>4} {'wall (s)':>10} {'s / audio hour':>15}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in args.modes:
+            for run in range(args.repeat):
+                rttm = os.path.join(tmp, f"{mode}-{run}.rttm")
+                started = time.perf_counter()
+                engine.diarize(args.wav, rttm, mode)
+                wall = time.perf_counter() - started
+                print(f"{mode:>10} {run:>4} {wall:>10.2f} {wall / hours:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Per-line logging overhead in a streaming loop like utils.run_subprocess.
+
+"before" reproduces the old setup: synchronous FileHandler and stdout
+StreamHandler, both with ColoredFormatter, and two INFO f-string records per
+whisper line. "sync" and "queued" log one lazy DEBUG record per line through
+setup_logger without and with the QueueListener; "sampled" also keeps only
+one in --sample debug records. Stdout is sent to /dev/null so the terminal
+doesn't dominate.
+
+    python benchmarks/bench_logging.py --lines 100000
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from whisperlog import ColoredFormatter, setup_logger  # noqa: E402
+
+LINE = b"[00:01:02.000 --> 00:01:05.000]  and that is roughly where the conversation went next\n"
+
+
+def old_logger(name, log_file):
+    logger = logging.getLogger(name)
+    logger.setLevel(logging.DEBUG)
+    formatter = ColoredFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    for handler in (logging.FileHandler(log_file), logging.StreamHandler(sys.stdout)):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+    return logger
+
+
+def run_before(logger, lines):
+    for _ in range(lines):
+        logger.info(f"Line: {LINE}")
+        text = LINE.decode("utf8").strip().split("]")[1].strip()
+        logger.info(f"{text}")
+
+
+def run_after(logger, lines):
+    for _ in range(lines):
+        text = LINE.decode("utf8").strip().split("]")[1].strip()
+        logger.debug("%s", text)
+
+
+def drain(logger):
+    """Wait until a queued logger's listener has written everything."""
+    for handler in logger.handlers:
+        log_queue = getattr(handler, 'queue', None)
+        while log_queue is not None and not log_queue.empty():
+            time.sleep(0.001)
+        handler.flush()
+
+
+def bench(label, logger, run, lines):
+    start = time.perf_counter()
+    run(logger, lines)
+    loop = time.perf_counter() - start
+    drain(logger)
+    total = time.perf_counter() - start
+    print(f"{label:>8}: {loop / lines * 1e6:7.2f} us/line in the loop, {total / lines * 1e6:7.2f} us/line until written")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, default=100000)
+    parser.add_argument('--sample', type=int, default=100)
+    args = parser.parse_args()
+
+    # the stdout handlers bind sys.stdout when they are created
+    real_stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            runs = [
+                ("before", old_logger('bench.before', os.path.join(tmp, 'before.log')), run_before),
+                ("sync", setup_logger('bench.sync', os.path.join(tmp, 'sync.log')), run_after),
+                ("queued", setup_logger('bench.queued', os.path.join(tmp, 'queued.log'), queued=True), run_after),
+                (
+                    "sampled",
+                    setup_logger(
+                        'bench.sampled', os.path.join(tmp, 'sampled.log'), queued=True, debug_sample=args.sample
+                    ),
+                    run_after,
+                ),
+            ]
+        finally:
+            devnull, sys.stdout = sys.stdout, real_stdout
+        for label, logger, run in runs:
+            bench(label, logger, run, args.lines)
+        logging.shutdown()
+        devnull.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+"""
+End-to-end pipeline benchmark that needs neither GPUs nor the real models.
+
+Whisper is replaced by benchmarks/fake_whisper.py (answering at
+--whisper-rtf seconds per audio second) and diarization by an engine that
+writes a synthetic RTTM after sleeping --diarize-rtf per audio second.
+Everything else -- probing, resampling, chunking, the worker pool, the
+scheduler, the CSV/RTTM merge -- is the real code.
+
+Targets:
+  facade       MediaTranscriptionFacade.transcribe_media on synthetic WAVs
+  standardize  StandardizeOutput over a synthetic CSV and RTTM
+  flask        POST /t on app.py's test client, then follow /jobs/<id>/stream
+
+Reports throughput (audio seconds per wall second), p50/p99 job latency,
+p50/p99 time to the first transcript line and peak RSS.
+
+    python benchmarks/bench_pipeline.py facade --seconds 600 --jobs 8 --concurrency 4
+    python benchmarks/bench_pipeline.py standardize --seconds 36000
+"""
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+SAMPLE_RATE = 16000
+
+
+def synthetic_wav(path, seconds, seed=0):
+    """16 kHz mono s16le WAV of tone bursts separated by pauses, so VAD finds cuts."""
+    rng = np.random.default_rng(seed)
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        written = 0
+        total = int(seconds * SAMPLE_RATE)
+        while written < total:
+            talk = min(int(rng.uniform(2, 6) * SAMPLE_RATE), total - written)
+            t = np.arange(talk) / SAMPLE_RATE
+            burst = 6000 * np.sin(2 * np.pi * rng.uniform(120, 300) * t) + rng.normal(0, 300, talk)
+            w.writeframes(burst.astype('<i2').tobytes())
+            written += talk
+            pause = min(int(rng.uniform(0.3, 1.5) * SAMPLE_RATE), total - written)
+            w.writeframes(np.zeros(pause, dtype='<i2').tobytes())
+            written += pause
+
+
+def synthetic_rttm(path, seconds, speakers=3, seed=1, uri="bench"):
+    rng = np.random.default_rng(seed)
+    t = 0.0
+    with open(path, 'w') as f:
+        while t < seconds:
+            length = float(rng.uniform(1.5, 20))
+            f.write(f"SPEAKER {uri} 1 {t:.3f} {length:.3f} <NA> <NA> speaker{rng.integers(speakers)} <NA> <NA>\n")
+            # diart turns often overlap by a few hundred ms
+            t += length - float(rng.uniform(0, 0.4))
+
+
+def synthetic_csv(path, seconds, segment_ms=3000):
+    with open(path, 'w', encoding='utf-8') as f:
+        for start in range(0, int(seconds * 1000), segment_ms):
+            f.write(f'{start},{start + segment_ms},"and that is roughly where the conversation went"\n')
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and of its largest finished child, in MB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return own, children
+
+
+def install_fake_diarization(rtf):
+    """Swap the process-wide diart engine for one that writes synthetic RTTMs."""
+    import speaker_diff
+    import speaker_index
+
+    class SyntheticDiarizationEngine(speaker_diff.DiarizationEngine):
+        def acquire(self):
+            return None
+
+        def diarize(self, wav_file_path, rttm_file_path, mode=None, offset=0.0):
+            with wave.open(wav_file_path) as w:
+                seconds = w.getnframes() / w.getframerate()
+            time.sleep(seconds * rtf)
+            synthetic_rttm(rttm_file_path, seconds)
+            if offset:
+                speaker_index.shift_rttm(rttm_file_path, offset)
+
+    speaker_diff._engine = SyntheticDiarizationEngine()
+
+
+def is_transcript_line(message):
+    return message.startswith("<br>[")
+
+
+def time_job(messages):
+    """Consume a job's messages; returns (latency, time to first transcript line)."""
+    start = time.perf_counter()
+    first = None
+    for message in messages:
+        if first is None and is_transcript_line(message):
+            first = time.perf_counter() - start
+    return time.perf_counter() - start, first
+
+
+def run_jobs(run_one, jobs, concurrency):
+    results = []
+    lock = threading.Lock()
+
+    def run(i):
+        result = run_one(i)
+        with lock:
+            results.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run, range(jobs)))
+    return time.perf_counter() - start, results
+
+
+def bench_facade(args, wav_file_path):
+    from media_processor import FileMediaSource, MediaTranscriptionFacade
+
+    def run_one(_):
+        facade = MediaTranscriptionFacade(FileMediaSource(wav_file_path))
+        return time_job(facade.transcribe_media(diarize=not args.no_diarize))
+
+    return run_jobs(run_one, args.jobs, args.concurrency)
+
+
+def bench_flask(args, wav_file_path):
+    import app
+
+    client = app.app.test_client()
+
+    def run_one(_):
+        start = time.perf_counter()
+        with open(wav_file_path, 'rb') as f:
+            response = client.post('/t', data={'file': (f, 'bench.wav')})
+        if response.status_code != 202:
+            raise RuntimeError(f"POST /t returned {response.status_code}: {response.get_data(as_text=True)}")
+        stream = client.get(response.json['stream'], buffered=False)
+        first = None
+        for chunk in stream.response:
+            if first is None and b"<br>[" in chunk:
+                first = time.perf_counter() - start
+        return time.perf_counter() - start, first
+
+    return run_jobs(run_one, args.jobs, args.concurrency)
+
+
+def bench_standardize(args, tmp):
+    from speaker_diff import StandardizeOutput
+
+    csv_file_path = os.path.join(tmp, "bench.csv")
+    synthetic_csv(csv_file_path, args.seconds)
+    synthetic_rttm(os.path.join(tmp, "bench.rttm"), args.seconds)
+
+    def run_one(_):
+        merge = StandardizeOutput(csv_file_path=csv_file_path, wav_file_path=os.path.join(tmp, "bench.wav"))
+        return time_job(f"<br>[{line}" for line in merge.iter_standardized_output())
+
+    return run_jobs(run_one, args.jobs, args.concurrency)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('target', choices=['facade', 'standardize', 'flask'])
+    parser.add_argument('--seconds', type=float, default=300, help="length of the synthetic audio")
+    parser.add_argument('--jobs', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=2)
+    parser.add_argument('--whisper-rtf', type=float, default=0.02)
+    parser.add_argument('--diarize-rtf', type=float, default=0.01)
+    parser.add_argument('--workers', type=int, default=2, help="fake whisper workers in the pool")
+    parser.add_argument('--no-diarize', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # config reads the environment and cwd at import time, so set both first
+        os.environ.setdefault('WHISPER_SERVER_BINARY', os.path.join(BENCH_DIR, 'fake_whisper.py'))
+        os.environ.setdefault('WHISPER_BINARY', os.path.join(BENCH_DIR, 'fake_whisper.py'))
+        os.environ['FAKE_WHISPER_RTF'] = str(args.whisper_rtf)
+        os.environ['WHISPER_WORKERS'] = str(args.workers)
+        os.environ['RESULT_CACHE_ENABLED'] = '0'
+        os.environ['JOB_QUEUE_SIZE'] = str(max(args.jobs, 16))
+        os.environ.setdefault('SCRATCH_PATH', os.path.join(tmp, 'scratch'))
+        os.chdir(tmp)
+        os.makedirs('media', exist_ok=True)
+
+        if args.target != 'standardize':
+            install_fake_diarization(args.diarize_rtf)
+            wav_file_path = os.path.join(tmp, 'input.wav')
+            synthetic_wav(wav_file_path, args.seconds)
+            from whisper_pool import get_pool
+
+            get_pool()
+            wall, results = (bench_facade if args.target == 'facade' else bench_flask)(args, wav_file_path)
+        else:
+            wall, results = bench_standardize(args, tmp)
+
+    latencies = [latency for latency, _ in results]
+    firsts = [first for _, first in results if first is not None]
+    own, children = peak_rss_mb()
+    print(f"target          {args.target}")
+    print(f"jobs            {args.jobs} x {args.seconds:.0f} s audio, concurrency {args.concurrency}")
+    print(f"wall            {wall:.2f} s")
+    print(f"throughput      {args.jobs * args.seconds / wall:.1f} audio s / s")
+    print(f"latency         p50 {percentile(latencies, 50):.3f} s   p99 {percentile(latencies, 99):.3f} s")
+    print(f"first line      p50 {percentile(firsts, 50):.3f} s   p99 {percentile(firsts, 99):.3f} s")
+    print(f"peak RSS        {own:.1f} MB (children {children:.1f} MB)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Search index build rate and query latency at archive scale.
+
+Fills a fresh index with --hours of synthetic transcript (one segment per
+--segment-seconds, words drawn from a Zipf-like vocabulary so common words
+are very common and rare ones rare), then times word, multi-word and
+phrase queries.
+
+    python benchmarks/bench_search.py --hours 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+JOB_HOURS = 1.0
+
+
+def vocabulary(size, rng):
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    return ["".join(rng.choice(letters, rng.integers(3, 10))) for _ in range(size)]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hours', type=float, default=1000)
+    parser.add_argument('--segment-seconds', type=float, default=4)
+    parser.add_argument('--words', type=int, default=12, help="words per segment")
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    words = vocabulary(args.vocabulary, rng)
+    weights = 1 / np.arange(1, args.vocabulary + 1)
+    weights /= weights.sum()
+    segments_per_job = int(JOB_HOURS * 3600 / args.segment_seconds)
+    jobs = max(1, int(args.hours / JOB_HOURS))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['SEARCH_INDEX_PATH'] = os.path.join(tmp, 'search.db')
+        from search_index import SearchIndex
+
+        index = SearchIndex(os.environ['SEARCH_INDEX_PATH'])
+        start = time.perf_counter()
+        for job in range(jobs):
+            picks = rng.choice(args.vocabulary, (segments_per_job, args.words), p=weights)
+            with index.writer(f"job-{job}") as writer:
+                for i, row in enumerate(picks):
+                    ms = int(i * args.segment_seconds * 1000)
+                    text = " ".join(words[w] for w in row)
+                    writer.append(ms, ms + int(args.segment_seconds * 1000), f"speaker{i % 3}", text)
+        build = time.perf_counter() - start
+        size = os.path.getsize(os.environ['SEARCH_INDEX_PATH'])
+        hours = jobs * JOB_HOURS
+        print(f"indexed {jobs * segments_per_job} segments ({hours:.0f} h) in {build:.1f} s, {size / 1e6:.0f} MB")
+
+        kinds = {
+            "common word": lambda: words[rng.integers(0, 20)],
+            "rare word": lambda: words[rng.integers(1000, args.vocabulary)],
+            "two words": lambda: f"{words[rng.integers(0, 200)]} {words[rng.integers(200, 5000)]}",
+            "phrase": lambda: f'"{words[rng.integers(0, 50)]} {words[rng.integers(0, 50)]}"',
+        }
+        for ranked in (False, True):
+            print("ranked by bm25" if ranked else "newest first")
+            for label, make_query in kinds.items():
+                latencies = []
+                for _ in range(args.queries):
+                    query = make_query()
+                    start = time.perf_counter()
+                    index.search(query, limit=50, ranked=ranked)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                print(f"{label:>12}: p50 {percentile(latencies, 50):7.2f} ms   p99 {percentile(latencies, 99):7.2f} ms")
+        index.db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Micro-benchmark for speaker assignment in StandardizeOutput.
+
+Compares the old nearest-start linear scan over every RTTM turn with the
+bisect-backed SpeakerIndex for growing numbers of whisper segments.
+
+    python benchmarks/bench_speaker_index.py --segments 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from speaker_index import SpeakerIndex  # noqa: E402
+
+
+def synthetic_turns(duration_ms, speakers=4, seed=0):
+    rng = random.Random(seed)
+    turns = []
+    t = 0
+    while t < duration_ms:
+        length = rng.randint(1500, 20000)
+        turns.append((t, t + length, f"speaker{rng.randrange(speakers)}"))
+        # diart turns frequently overlap by a few hundred ms
+        t += length - rng.randint(0, 400)
+    return turns
+
+
+def synthetic_segments(count, seed=1):
+    rng = random.Random(seed)
+    segments = []
+    t = 0
+    for _ in range(count):
+        length = rng.randint(800, 6000)
+        segments.append((t, t + length))
+        t += length
+    return segments
+
+
+def linear_scan(turns, segments):
+    speakers = []
+    for st_csv, _ in segments:
+        min_diff = float('inf')
+        speaker_name = None
+        for st_rttm, _, name in turns:
+            diff = abs(st_csv - st_rttm)
+            if diff < min_diff:
+                min_diff = diff
+                speaker_name = name
+        speakers.append(speaker_name)
+    return speakers
+
+
+def indexed(turns, segments):
+    index = SpeakerIndex(turns)
+    return [index.speaker_at(start, end) for start, end in segments]
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--segments', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument(
+        '--linear-limit', type=int, default=10000, help="skip the linear scan above this many segments"
+    )
+    args = parser.parse_args()
+
+    print(f"{'segments':>10} {'turns':>8} {'linear (s)':>12} {'indexed (s)':>12} {'speedup':>9}")
+    for count in args.segments:
+        segments = synthetic_segments(count)
+        turns = synthetic_turns(segments[-1][1])
+        index_s = timed(indexed, turns, segments)
+        if count <= args.linear_limit:
+            linear_s = timed(linear_scan, turns, segments)
+            print(f"{count:>10} {len(turns):>8} {linear_s:>12.3f} {index_s:>12.3f} {linear_s / index_s:>8.1f}x")
+        else:
+            print(f"{count:>10} {len(turns):>8} {'skipped':>12} {index_s:>12.3f} {'-':>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Stand-in for the whisper.cpp server and main binaries.
+
+As a server it accepts the same flags the worker pool passes (-m, -t, --host,
+--port) and answers POST /inference with SRT segments sized from the uploaded
+WAV, so the pool can be exercised without the real model:
+
+    WHISPER_SERVER_BINARY=benchmarks/fake_whisper.py python app.py
+
+Given -f it behaves like main instead: prints `[hh:mm:ss.mmm --> ...]` lines
+for the WAV as they are "decoded" and, with -ocsv, writes <-of>.csv:
+
+    WHISPER_BINARY=benchmarks/fake_whisper.py ...
+
+FAKE_WHISPER_LOAD_SECONDS simulates model load time and FAKE_WHISPER_RTF the
+real-time factor (processing seconds per second of audio).
+"""
+import argparse
+import io
+import os
+import time
+import wave
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = "so I think the main thing we keep coming back to on this show is how people actually work".split()
+SEGMENT_MS = 3000
+
+
+def ms_to_srt(ms):
+    hours, ms = divmod(int(ms), 3600000)
+    minutes, ms = divmod(ms, 60000)
+    seconds, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{ms:03d}"
+
+
+def wav_duration_ms(data):
+    with wave.open(io.BytesIO(data)) as w:
+        return int(w.getnframes() * 1000 / w.getframerate())
+
+
+def ms_to_timestamp(ms):
+    return ms_to_srt(ms).replace(',', '.')
+
+
+def fake_segments(duration_ms):
+    segments = []
+    for i, start in enumerate(range(0, duration_ms, SEGMENT_MS)):
+        end = min(start + SEGMENT_MS, duration_ms)
+        text = ' '.join(WORDS[(i + j) % len(WORDS)] for j in range(8))
+        segments.append((start, end, text))
+    return segments
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    rtf = 0.0
+
+    def do_POST(self):
+        if self.path != '/inference':
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        message = BytesParser(policy=policy.default).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+        )
+        audio = next(part for part in message.iter_parts() if part.get_param('name', header='content-disposition') == 'file')
+        duration_ms = wav_duration_ms(audio.get_payload(decode=True))
+        time.sleep(duration_ms / 1000 * self.rtf)
+        srt = ''.join(
+            f"{i + 1}\n{ms_to_srt(start)} --> {ms_to_srt(end)}\n {text}\n\n"
+            for i, (start, end, text) in enumerate(fake_segments(duration_ms))
+        )
+        body = srt.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_cli(wav_file_path, output_csv, output_file, rtf):
+    """Emit segments at `rtf` seconds per audio second, like whisper.cpp main."""
+    with open(wav_file_path, 'rb') as f:
+        duration_ms = wav_duration_ms(f.read())
+    segments = fake_segments(duration_ms)
+    for start, end, text in segments:
+        time.sleep((end - start) / 1000 * rtf)
+        print(f"[{ms_to_timestamp(start)} --> {ms_to_timestamp(end)}]  {text}", flush=True)
+    if output_csv:
+        csv_file_path = f"{output_file or wav_file_path}.csv"
+        with open(csv_file_path, 'w', encoding='utf-8') as f:
+            for start, end, text in segments:
+                f.write(f'{start},{end},"{text}"\n')
+        print(f"output_csv: saving output to '{csv_file_path}'", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--model')
+    parser.add_argument('-t', '--threads', type=int, default=4)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('-f', '--file', help="transcribe this WAV and exit, like whisper.cpp main")
+    parser.add_argument('-ocsv', '--output-csv', action='store_true')
+    parser.add_argument('-of', '--output-file')
+    args = parser.parse_args()
+
+    time.sleep(float(os.environ.get('FAKE_WHISPER_LOAD_SECONDS', 0)))
+    rtf = float(os.environ.get('FAKE_WHISPER_RTF', 0))
+    if args.file:
+        run_cli(args.file, args.output_csv, args.output_file, rtf)
+        return
+    InferenceHandler.rtf = rtf
+    ThreadingHTTPServer((args.host, args.port), InferenceHandler).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Replay an audio file into the live endpoint at real-time pace.
+
+Sends the file as 16 kHz mono s16le frames of --frame-ms over a WebSocket
+to aio_server's /live, prints the events that come back and, at the end,
+the latency of partial and final segments: how long after the audio at a
+segment's end was sent the segment arrived.
+
+    python aio_server.py &
+    python benchmarks/replay_live.py talk.wav --speed 1
+"""
+import argparse
+import asyncio
+import subprocess
+import time
+import wave
+
+import aiohttp
+
+SAMPLE_RATE = 16000
+
+
+def read_pcm(path):
+    """16 kHz mono s16le PCM of `path`, decoded with ffmpeg unless it already is a WAV in that format."""
+    try:
+        with wave.open(path, 'rb') as wav:
+            if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) == (SAMPLE_RATE, 1, 2):
+                return wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        pass
+    return subprocess.run(
+        [
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", path,
+            "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "pipe:1",
+        ],
+        check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+async def replay(args):
+    pcm = read_pcm(args.file)
+    frame_bytes = SAMPLE_RATE * 2 * args.frame_ms // 1000
+    # audio position (ms) -> monotonic time it was sent
+    sent_at = {}
+    latencies = {"partial": [], "final": []}
+
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(f"{args.url}?diarize={int(not args.no_diarize)}") as ws:
+
+            async def send():
+                started = time.monotonic()
+                for offset in range(0, len(pcm), frame_bytes):
+                    position = offset * 1000 // (SAMPLE_RATE * 2)
+                    # pace by the audio clock so slow sends don't accumulate drift
+                    await asyncio.sleep(max(0.0, started + position / 1000 / args.speed - time.monotonic()))
+                    await ws.send_bytes(pcm[offset:offset + frame_bytes])
+                    sent_at[position + args.frame_ms] = time.monotonic()
+                await ws.send_str("end")
+
+            def latency(end_ms):
+                # the first frame that carried audio up to end_ms
+                covering = [position for position in sent_at if position >= end_ms]
+                return time.monotonic() - sent_at[min(covering)] if covering else None
+
+            sender = asyncio.create_task(send())
+            async for message in ws:
+                if message.type != aiohttp.WSMsgType.TEXT:
+                    break
+                event = message.json()
+                if event["type"] in latencies and (delay := latency(event["end"])) is not None:
+                    latencies[event["type"]].append(delay * 1000)
+                if not args.quiet or event["type"] in ("final", "error", "done"):
+                    print(event)
+                if event["type"] == "done":
+                    break
+            if not sender.done():
+                # refused (too many sessions) or dropped by the server
+                sender.cancel()
+                print(f"server closed the connection with code {ws.close_code}")
+                return
+            await sender
+
+    print(f"replayed {len(pcm) / SAMPLE_RATE / 2:.1f} s of audio at {args.speed}x")
+    for kind, values in latencies.items():
+        if values:
+            print(f"{kind:>8}: {len(values)} events, p50 {percentile(values, 50):7.0f} ms   p99 {percentile(values, 99):7.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('file')
+    parser.add_argument('--url', default="http://localhost:8833/live")
+    parser.add_argument('--speed', type=float, default=1.0, help="playback rate relative to real time")
+    parser.add_argument('--frame-ms', type=int, default=100)
+    parser.add_argument('--no-diarize', action='store_true')
+    parser.add_argument('--quiet', action='store_true', help="print only final segments")
+    asyncio.run(replay(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,111 @@ SESSION_TYPE = 'filesystem'
 PERMANENT_SESSION_LIFETIME = timedelta(minutes=60)
 BASE_PATH = os.getcwd()
 MODELS_PATH = os.path.join(BASE_PATH, 'models')
-MODEL_PATH = os.path.join(MODELS_PATH, 'ggml-model-whisper-base.en.bin')
-WHISPER_BINARY = os.path.join(BASE_PATH, 'bin', 'main')
+MODEL_PATH = os.environ.get('MODEL_PATH', os.path.join(MODELS_PATH, 'ggml-model-whisper-base.en.bin'))
+WHISPER_BINARY = os.environ.get('WHISPER_BINARY', os.path.join(BASE_PATH, 'bin', 'main'))
 MEDIA_PATH = os.path.join(BASE_PATH, 'media')
-LOG_FILE = os.path.join(os.getcwd(), 'app.log')
\ No newline at end of file
+LOG_FILE = os.path.join(os.getcwd(), 'app.log')
+# one JSON line per finished job, with per-stage timings
+JOB_LOG_FILE = os.environ.get('JOB_LOG_FILE', os.path.join(os.getcwd(), 'jobs.log'))
+# hand log records to a background thread that writes the file in batches
+LOG_QUEUED = os.environ.get('LOG_QUEUED', '1') == '1'
+LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', 1.0))
+# keep one in N debug records, e.g. per-line whisper output; 1 keeps them all
+LOG_DEBUG_SAMPLE = int(os.environ.get('LOG_DEBUG_SAMPLE', 1))
+
+# Warm whisper.cpp server workers, each keeps MODEL_PATH loaded between jobs
+WHISPER_SERVER_BINARY = os.environ.get('WHISPER_SERVER_BINARY', os.path.join(BASE_PATH, 'bin', 'server'))
+WHISPER_WORKERS = int(os.environ.get('WHISPER_WORKERS', 2))
+WHISPER_THREADS_PER_WORKER = int(os.environ.get('WHISPER_THREADS_PER_WORKER', 4))
+WHISPER_WORKER_STARTUP_TIMEOUT = float(os.environ.get('WHISPER_WORKER_STARTUP_TIMEOUT', 120))
+
+# Warm diart pipelines shared by every request in the process
+DIARIZATION_WORKERS = int(os.environ.get('DIARIZATION_WORKERS', 1))
+# 'offline' runs whole files in batches of DIARIZATION_BATCH_SIZE chunks, 'realtime' one chunk at a time
+DIARIZATION_MODE = os.environ.get('DIARIZATION_MODE', 'offline')
+DIARIZATION_BATCH_SIZE = int(os.environ.get('DIARIZATION_BATCH_SIZE', 32))
+
+# Job scheduler: bounded admission queue and per-stage concurrency limits
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 16))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 4))
+JOB_RETENTION_SECONDS = int(os.environ.get('JOB_RETENTION_SECONDS', 3600))
+# progress events kept per job for clients that reconnect
+JOB_EVENT_BUFFER = int(os.environ.get('JOB_EVENT_BUFFER', 2000))
+# batch ingestion: jobs a single batch keeps in flight, and its size limit
+BATCH_PARALLELISM = int(os.environ.get('BATCH_PARALLELISM', JOB_WORKERS))
+BATCH_MAX_SOURCES = int(os.environ.get('BATCH_MAX_SOURCES', 5000))
+STAGE_LIMITS = {
+    'download': int(os.environ.get('STAGE_LIMIT_DOWNLOAD', 4)),
+    'resample': int(os.environ.get('STAGE_LIMIT_RESAMPLE', 2)),
+    'transcribe': int(os.environ.get('STAGE_LIMIT_TRANSCRIBE', WHISPER_WORKERS)),
+    'diarize': int(os.environ.get('STAGE_LIMIT_DIARIZE', DIARIZATION_WORKERS)),
+}
+# Fair queueing: jobs of at most JOB_INTERACTIVE_SECONDS of audio go ahead of batch jobs (manifests, and
+# URLs of unknown length costed at JOB_UNKNOWN_COST_SECONDS); batch jobs waiting JOB_BATCH_AGING_SECONDS
+# compete as interactive. Within a class clients share workers by seconds of audio, identified by
+# remote address. JOB_CLIENT_HEADER (e.g. X-Client-Id) names a header to identify them by instead;
+# only set it behind a trusted proxy that sets or strips it, any client can send it otherwise.
+# URL jobs without an end are classed by a yt-dlp duration lookup given JOB_URL_PROBE_TIMEOUT_SECONDS.
+JOB_INTERACTIVE_SECONDS = float(os.environ.get('JOB_INTERACTIVE_SECONDS', 600))
+JOB_UNKNOWN_COST_SECONDS = float(os.environ.get('JOB_UNKNOWN_COST_SECONDS', 3600))
+JOB_BATCH_AGING_SECONDS = float(os.environ.get('JOB_BATCH_AGING_SECONDS', 900))
+JOB_CLIENT_HEADER = os.environ.get('JOB_CLIENT_HEADER', '')
+JOB_URL_PROBE_TIMEOUT_SECONDS = float(os.environ.get('JOB_URL_PROBE_TIMEOUT_SECONDS', 10))
+
+# URL fetching: download pool, per-host limits and a cache of downloads by media ID
+FETCH_WORKERS = int(os.environ.get('FETCH_WORKERS', 4))
+FETCH_HOST_CONCURRENCY = int(os.environ.get('FETCH_HOST_CONCURRENCY', 2))
+FETCH_HOST_MIN_INTERVAL = float(os.environ.get('FETCH_HOST_MIN_INTERVAL', 1.0))
+FETCH_RETRIES = int(os.environ.get('FETCH_RETRIES', 3))
+FETCH_TIMEOUT = float(os.environ.get('FETCH_TIMEOUT', 1800))
+# smallest audio-only stream that still carries 16 kHz speech, falling back to anything
+FETCH_FORMAT = os.environ.get('FETCH_FORMAT', 'ba[asr>=16000][abr>=32]/ba/b')
+FETCH_FORMAT_SORT = os.environ.get('FETCH_FORMAT_SORT', '+abr,+size')
+FETCH_CACHE_PATH = os.environ.get('FETCH_CACHE_PATH', os.path.join(MEDIA_PATH, 'downloads'))
+FETCH_CACHE_MAX_BYTES = int(os.environ.get('FETCH_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+
+# Streaming pipeline: yt-dlp | ffmpeg | chunked transcription
+SAMPLE_RATE = 16000
+STREAM_CHUNK_SECONDS = int(os.environ.get('STREAM_CHUNK_SECONDS', 30))
+STREAM_URL_SOURCES = os.environ.get('STREAM_URL_SOURCES', '1') == '1'
+
+# Split long WAVs at silences and transcribe the pieces in parallel on the pool
+PARALLEL_TRANSCRIPTION = os.environ.get('PARALLEL_TRANSCRIPTION', '1') == '1'
+PARALLEL_CHUNK_SECONDS = int(os.environ.get('PARALLEL_CHUNK_SECONDS', 120))
+if PARALLEL_CHUNK_SECONDS <= 0:
+    raise ValueError(f"PARALLEL_CHUNK_SECONDS must be positive, got {PARALLEL_CHUNK_SECONDS}")
+
+# Content-addressed cache of finished results
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', '1') == '1'
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', os.path.join(MEDIA_PATH, 'cache'))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+# Opt-in: intermediate audio (uploads, downloads, decoded WAVs) lives in scratch space,
+# on tmpfs it never touches the SSD and is removed once the job has finished with it.
+# A decoded hour is ~115 MB and Docker gives /dev/shm 64 MB unless --shm-size is
+# raised, so only enable it with SCRATCH_PATH on a tmpfs sized for the concurrent jobs
+IN_MEMORY_AUDIO = os.environ.get('IN_MEMORY_AUDIO', '0') == '1'
+SCRATCH_PATH = os.environ.get(
+    'SCRATCH_PATH', '/dev/shm/podv2t' if os.path.isdir('/dev/shm') else os.path.join(MEDIA_PATH, 'scratch')
+)
+
+# Job outputs under media/ are indexed per job and evicted least recently used
+# first once they exceed the quota, or when not downloaded for the TTL (0 = never)
+MEDIA_MAX_BYTES = int(os.environ.get('MEDIA_MAX_BYTES', 20 * 1024 ** 3))
+MEDIA_TTL_SECONDS = int(os.environ.get('MEDIA_TTL_SECONDS', 7 * 24 * 3600))
+STORAGE_INDEX_PATH = os.environ.get('STORAGE_INDEX_PATH', os.path.join(MEDIA_PATH, 'storage.db'))
+
+# Full-text index of finished transcripts, searched by GET /search
+SEARCH_INDEX_ENABLED = os.environ.get('SEARCH_INDEX_ENABLED', '1') == '1'
+SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH', os.path.join(MEDIA_PATH, 'search.db'))
+SEARCH_INDEX_BATCH = int(os.environ.get('SEARCH_INDEX_BATCH', 500))
+SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS', 200))
+
+# Live transcription over WebSocket (aio_server /live): the uncommitted tail is
+# re-transcribed every LIVE_STEP_SECONDS and committed once it spans LIVE_WINDOW_SECONDS.
+# Sessions diarize on their own pool of LIVE_MAX_SESSIONS diart pipelines, apart from file
+# jobs; one falling more than LIVE_DIARIZATION_BACKLOG_SECONDS behind carries on without speakers
+LIVE_MAX_SESSIONS = int(os.environ.get('LIVE_MAX_SESSIONS', 2))
+LIVE_STEP_SECONDS = float(os.environ.get('LIVE_STEP_SECONDS', 2.0))
+LIVE_WINDOW_SECONDS = float(os.environ.get('LIVE_WINDOW_SECONDS', 12.0))
+LIVE_DIARIZATION_BACKLOG_SECONDS = float(os.environ.get('LIVE_DIARIZATION_BACKLOG_SECONDS', 10.0))
@@ -0,0 +1,210 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from config import (FETCH_CACHE_MAX_BYTES, FETCH_CACHE_PATH, FETCH_FORMAT, FETCH_FORMAT_SORT, FETCH_HOST_CONCURRENCY,
+                    FETCH_HOST_MIN_INTERVAL, FETCH_RETRIES, FETCH_TIMEOUT, FETCH_WORKERS)
+from result_cache import DiskLRUCache
+from utils import logger
+
+
+class FetchError(Exception):
+    pass
+
+
+def format_args():
+    """yt-dlp arguments selecting the smallest audio-only stream good enough for 16 kHz speech."""
+    args = ["-f", FETCH_FORMAT]
+    if FETCH_FORMAT_SORT:
+        args += ["-S", FETCH_FORMAT_SORT]
+    return args
+
+
+class HostRateLimiter:
+    """
+    Per-host limits for outgoing fetches: at most `concurrency` at once and
+    starts spaced at least `min_interval` seconds apart.
+    """
+
+    def __init__(self, concurrency=FETCH_HOST_CONCURRENCY, min_interval=FETCH_HOST_MIN_INTERVAL):
+        self.concurrency = concurrency
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.semaphores = {}
+        self.next_start = {}
+
+    @contextmanager
+    def slot(self, url):
+        host = urlsplit(url).hostname or ""
+        with self.lock:
+            semaphore = self.semaphores.setdefault(host, threading.BoundedSemaphore(self.concurrency))
+        with semaphore:
+            with self.lock:
+                now = time.monotonic()
+                start = max(now, self.next_start.get(host, now))
+                self.next_start[host] = start + self.min_interval
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+
+class DownloadCache(DiskLRUCache):
+    """Downloaded media keyed by the extractor's media ID, so any URL of an episode hits."""
+
+    def __init__(self, root=FETCH_CACHE_PATH, max_bytes=FETCH_CACHE_MAX_BYTES):
+        super().__init__(root, max_bytes)
+
+    @staticmethod
+    def key(media_id):
+        return hashlib.sha256(media_id.encode()).hexdigest()
+
+    def media_path(self, media_id):
+        entry = self.get(self.key(media_id))
+        if entry is None or not os.path.exists(os.path.join(entry, "media")):
+            return None
+        return os.path.join(entry, "media")
+
+
+def place(src, dst):
+    """Hard-link `src` to `dst` when they share a filesystem, otherwise copy it."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+_media_ids = {}
+_media_ids_lock = threading.Lock()
+
+
+class Fetcher:
+    """
+    Downloads URL media on a pool of `workers` threads with per-host rate
+    limits, retries with backoff, a timeout per attempt, and a download cache
+    keyed by media ID.
+    """
+
+    def __init__(self, workers=FETCH_WORKERS, cache=None, limiter=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="fetch")
+        self.cache = cache or DownloadCache()
+        self.limiter = limiter or HostRateLimiter()
+
+    def media_info(self, url, timeout=30):
+        """
+        Ask yt-dlp for the extractor and media ID of `url` and its duration in
+        seconds, without downloading, within the host's rate limits. Returns
+        (media_id, duration), None for what is unknown. Successful lookups
+        are remembered for the life of the process.
+        """
+        with _media_ids_lock:
+            if url in _media_ids:
+                return _media_ids[url]
+        try:
+            with self.limiter.slot(url):
+                result = subprocess.run(
+                    [
+                        "yt-dlp", "--skip-download", "--no-playlist",
+                        "--print", "%(extractor)s:%(id)s", "--print", "%(duration)s", url,
+                    ],
+                    capture_output=True, text=True, timeout=timeout,
+                )
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.warning("Could not resolve media id for %s: %s", url, e)
+            return None, None
+        lines = result.stdout.strip().splitlines()
+        if result.returncode != 0 or not lines:
+            return None, None
+        try:
+            # "NA" for live streams and extractors that don't report it
+            duration = float(lines[1])
+        except (IndexError, ValueError):
+            duration = None
+        with _media_ids_lock:
+            _media_ids[url] = (f"url:{lines[0]}", duration)
+        return _media_ids[url]
+
+    def media_id(self, url):
+        """Media ID of `url` for cache keys, or None (see `media_info`)."""
+        return self.media_info(url)[0]
+
+    def cached_path(self, url):
+        """Path of the cached download for `url`, or None."""
+        media_id = self.media_id(url)
+        return self.cache.media_path(media_id) if media_id else None
+
+    def submit(self, url, dst):
+        """Fetch `url` to `dst` on the pool; returns a Future."""
+        return self.executor.submit(self.fetch, url, dst)
+
+    def store(self, url, path):
+        """Add a complete download of `url` at `path`, e.g. teed off a stream, to the download cache."""
+        media_id = self.media_id(url)
+        if media_id:
+            self.cache.put(self.cache.key(media_id), {"media": path})
+
+    def fetch(self, url, dst):
+        media_id = self.media_id(url)
+        cached = self.cache.media_path(media_id) if media_id else None
+        if cached:
+            logger.info("Download cache hit for %s (%s)", url, media_id)
+            place(cached, dst)
+            return dst
+        self._download(url, dst)
+        if media_id:
+            self.cache.put(self.cache.key(media_id), {"media": dst})
+        return dst
+
+    def _download(self, url, dst):
+        args = [
+            "yt-dlp", *format_args(), "--no-playlist", "--quiet", "--socket-timeout", "30",
+            "--print", "after_move:filepath", "-o", dst, url,
+        ]
+        delay = 1.0
+        for attempt in range(1, FETCH_RETRIES + 1):
+            with self.limiter.slot(url):
+                try:
+                    result = subprocess.run(args, capture_output=True, text=True, timeout=FETCH_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    error = f"timed out after {FETCH_TIMEOUT} s"
+                else:
+                    if result.returncode == 0:
+                        # yt-dlp may add an extension when it remuxes, keep the name we asked for
+                        produced = result.stdout.strip().splitlines()
+                        if produced and produced[-1] != dst and os.path.exists(produced[-1]):
+                            os.replace(produced[-1], dst)
+                        if os.path.exists(dst):
+                            return
+                    lines = result.stderr.strip().splitlines()
+                    error = lines[-1] if lines else f"exit status {result.returncode}"
+                    # a failed attempt may leave a partial file behind, never take it for the download
+                    for partial in (dst, f"{dst}.part"):
+                        if os.path.exists(partial):
+                            os.remove(partial)
+            logger.warning("Fetching %s failed (attempt %d/%d): %s", url, attempt, FETCH_RETRIES, error)
+            if attempt < FETCH_RETRIES:
+                time.sleep(delay)
+                delay *= 2
+        raise FetchError(f"could not download {url}: {error}")
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher():
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = Fetcher()
+        return _fetcher
+
+
+def url_media_info(url, timeout=30):
+    """(media ID, duration) of `url`, looked up through the shared fetcher's rate limits."""
+    return get_fetcher().media_info(url, timeout)
@@ -0,0 +1,256 @@
+"""
+Live transcription and diarization of a PCM stream.
+
+A LiveSession is fed raw 16 kHz mono s16le PCM as it arrives. The same
+frames go to a diart pipeline, which labels speakers a step at a time as a
+live source, and to a sliding-window transcriber: the not yet committed
+tail of the stream is re-sent to the whisper pool every `step_seconds`,
+its segments come back as partial results, and once the tail spans
+`window_seconds` all but its last segment are committed as final. At most
+one whisper request per session is in flight, so a slow pool delays
+updates instead of queueing them up. Diarization gets the same treatment:
+a session that can't get a pipeline, or whose pipeline falls more than
+LIVE_DIARIZATION_BACKLOG_SECONDS behind, carries on without speakers.
+"""
+import queue
+import threading
+import uuid
+
+import numpy as np
+from diart.inference import RealTimeInference
+from diart.sources import AudioSource
+
+from config import LIVE_DIARIZATION_BACKLOG_SECONDS, LIVE_STEP_SECONDS, LIVE_WINDOW_SECONDS, SAMPLE_RATE
+from speaker_diff import get_live_diarization_engine
+from speaker_index import SpeakerIndex
+from streaming import BYTES_PER_SECOND, wav_bytes
+from utils import logger
+from whisper_pool import get_pool
+
+# speaker turns kept behind the committed position, for labelling late segments
+TURN_HISTORY_MS = 60000
+
+
+class QueueAudioSource(AudioSource):
+    """
+    diart audio source fed from other threads with `push`; `close` ends the
+    stream. At most `max_seconds` of audio wait to be diarized: `push`
+    refuses more and returns False.
+    """
+
+    def __init__(self, uri, sample_rate=SAMPLE_RATE, max_seconds=LIVE_DIARIZATION_BACKLOG_SECONDS):
+        super().__init__(uri, sample_rate)
+        self.queue = queue.Queue()
+        self.max_samples = int(max_seconds * sample_rate)
+        self.pending = 0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def push(self, pcm):
+        samples = np.frombuffer(pcm, dtype='<i2').astype(np.float32) / 32768
+        with self.lock:
+            if self.closed or self.pending + len(samples) > self.max_samples:
+                return False
+            self.pending += len(samples)
+        self.queue.put(samples.reshape(1, -1))
+        return True
+
+    def read(self):
+        while (samples := self.queue.get()) is not None:
+            self.stream.on_next(samples)
+            with self.lock:
+                self.pending -= samples.shape[1]
+        self.stream.on_completed()
+
+    def drain(self):
+        """Discard what is queued, e.g. after the pipeline failed; call after `close`."""
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        self.queue.put(None)
+
+
+class TurnObserver:
+    """Observer of diart predictions calling `on_turn(start_ms, end_ms, speaker)` for each labelled region."""
+
+    def __init__(self, on_turn):
+        self.on_turn = on_turn
+
+    def on_next(self, value):
+        annotation = value[0] if isinstance(value, tuple) else value
+        for segment, _, speaker in annotation.itertracks(yield_label=True):
+            self.on_turn(round(segment.start * 1000), round(segment.end * 1000), speaker)
+
+    def on_error(self, error):
+        logger.error("Live diarization failed: %s", error)
+
+    def on_completed(self):
+        pass
+
+
+class LiveSession:
+    """
+    One live stream. `feed` takes PCM bytes of any length; `finish` flushes
+    and blocks until everything has been emitted; `close` abandons the
+    stream. `emit` is called from worker threads with one event dict at a
+    time, in order:
+
+        {"type": "partial" | "final", "start": ms, "end": ms, "speaker": ..., "text": ...}
+        {"type": "speaker", "start": ms, "end": ms, "speaker": ...}
+        {"type": "error", "error": ...}
+        {"type": "done"}
+
+    Partial segments may be revised by later events; final ones are not.
+    """
+
+    def __init__(self, emit, diarize=True, pool=None, step_seconds=LIVE_STEP_SECONDS, window_seconds=LIVE_WINDOW_SECONDS,
+                 diarization_engine=None):
+        self.id = str(uuid.uuid4())
+        self.emit = emit
+        self.pool = pool or get_pool()
+        self.diarization_engine = diarization_engine or get_live_diarization_engine()
+        self.step_bytes = int(step_seconds * SAMPLE_RATE) * 2
+        self.window_bytes = int(window_seconds * SAMPLE_RATE) * 2
+        # re-entrant: a future that is already done runs its callback inside _submit
+        self.lock = threading.RLock()
+        # PCM from `committed_ms` on, not final yet
+        self.buffer = bytearray()
+        self.committed_ms = 0
+        self.carry = b""
+        self.since_step = 0
+        self.in_flight = False
+        self.flushing = False
+        self.closed = False
+        self.flushed = threading.Event()
+        self.turns = []
+        self.source = None
+        self.diarization = None
+        pipeline = self.diarization_engine.acquire(blocking=False) if diarize else None
+        if diarize and pipeline is None:
+            self.emit({"type": "error", "error": "no diarization pipeline free, continuing without speakers"})
+        if pipeline is not None:
+            self.source = QueueAudioSource(self.id)
+            self.diarization = threading.Thread(
+                target=self._diarize, args=(pipeline,), name=f"live-{self.id[:8]}", daemon=True
+            )
+            self.diarization.start()
+
+    def feed(self, pcm):
+        pcm = self.carry + pcm
+        # a frame may end in the middle of a sample
+        whole = len(pcm) - len(pcm) % 2
+        pcm, self.carry = pcm[:whole], pcm[whole:]
+        if not pcm:
+            return
+        if self.source is not None and not self.source.closed and not self.source.push(pcm):
+            logger.warning("Live diarization of %s fell behind, continuing without speakers", self.id)
+            self.source.close()
+            self.emit({"type": "error", "error": "diarization fell behind, continuing without speakers"})
+        with self.lock:
+            self.buffer += pcm
+            self.since_step += len(pcm)
+            if self.since_step >= self.step_bytes and not self.in_flight:
+                self._submit()
+
+    def finish(self):
+        """Flush the stream: wait for diarization to catch up, commit the tail and emit "done"."""
+        if self.source is not None:
+            self.source.close()
+            self.diarization.join()
+        with self.lock:
+            self.flushing = True
+            if not self.in_flight:
+                self._submit()
+        self.flushed.wait()
+        self.emit({"type": "done"})
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        if self.source is not None:
+            self.source.close()
+
+    def _submit(self):
+        # with self.lock held
+        self.since_step = 0
+        self.in_flight = True
+        offset, size, final = self.committed_ms, len(self.buffer), self.flushing
+        future = self.pool.submit(wav_bytes(bytes(self.buffer)), offset=offset)
+        future.add_done_callback(lambda f: self._transcribed(f, offset, size, final))
+
+    def _transcribed(self, future, offset, size, final):
+        try:
+            segments = future.result()
+        except Exception as e:
+            logger.error("Live transcription of %s failed: %s", self.id, e)
+            self.emit({"type": "error", "error": str(e)})
+            segments = []
+        with self.lock:
+            self.in_flight = False
+            if self.closed:
+                self.flushed.set()
+                return
+            if final:
+                finals, partials = segments, []
+            elif size >= self.window_bytes:
+                finals, partials = segments[:-1] or segments, segments[-1:] if len(segments) > 1 else []
+            else:
+                finals, partials = [], segments
+            if final:
+                commit = size
+            elif finals:
+                commit = min(size, (finals[-1].end - offset) * BYTES_PER_SECOND // 1000 // 2 * 2)
+            elif size >= self.window_bytes:
+                # a whole window without speech
+                commit = size
+            else:
+                commit = 0
+            if commit:
+                del self.buffer[:commit]
+                self.committed_ms = offset + commit * 1000 // BYTES_PER_SECOND
+                self.turns = [turn for turn in self.turns if turn[1] >= self.committed_ms - TURN_HISTORY_MS]
+            speakers = SpeakerIndex(self.turns)
+            for kind, batch in (("final", finals), ("partial", partials)):
+                for segment in batch:
+                    self.emit({
+                        "type": kind,
+                        "start": segment.start,
+                        "end": segment.end,
+                        "speaker": speakers.speaker_at(segment.start, segment.end),
+                        "text": segment.text,
+                    })
+            if final:
+                self.flushed.set()
+            elif self.flushing or self.since_step >= self.step_bytes:
+                self._submit()
+
+    def _on_turn(self, start, end, speaker):
+        with self.lock:
+            if self.turns and self.turns[-1][2] == speaker and start <= self.turns[-1][1]:
+                self.turns[-1] = (self.turns[-1][0], max(end, self.turns[-1][1]), speaker)
+            else:
+                self.turns.append((start, end, speaker))
+            self.emit({"type": "speaker", "start": start, "end": end, "speaker": speaker})
+
+    def _diarize(self, pipeline):
+        try:
+            pipeline.reset()
+            inference = RealTimeInference(pipeline, self.source, do_plot=False, do_profile=False, show_progress=False)
+            inference.attach_observers(TurnObserver(self._on_turn))
+            inference()
+        except Exception as e:
+            logger.error("Live diarization of %s failed: %s", self.id, e)
+            self.emit({"type": "error", "error": f"diarization failed: {e}"})
+            # stop taking frames and drop what is queued
+            self.source.close()
+            self.source.drain()
+        finally:
+            self.diarization_engine.release(pipeline)
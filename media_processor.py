@@ -3,12 +3,20 @@ import shutil
 import subprocess
 import uuid
 from abc import ABC, abstractmethod
+from contextlib import nullcontext
 
 from config import *
-from speaker_diff import StandardizeOutput
-from whisperlog import setup_logger
-
-logger = setup_logger("PODV2T", LOG_FILE)
+from fetcher import get_fetcher, url_media_info
+from probe import is_whisper_pcm, is_whisper_wav, probe
+from result_cache import ResultCache, get_result_cache, pcm_digest
+from search_index import index_writer
+from segment_store import SegmentStore, SegmentWriter, iter_csv_segments, store_paths
+from speaker_diff import StandardizeOutput, get_diarization_engine
+from storage import get_storage
+from streaming import ChunkedTranscriber, PCMPipeline, seek_args, tee_to_wav
+from utils import logger, window_duration
+from vad import silence_chunks
+from whisper_pool import get_pool
 
 
 class MediaSource(ABC):
@@ -26,111 +34,353 @@ class URLMediaSource(MediaSource):
 
 
 class FileMediaSource(MediaSource):
-    def __init__(self, file_path):
+    def __init__(self, file_path, temporary=False, audio_info=None):
         self.file_path = file_path
+        # the file is an upload spooled for this job, removed once the job is done
+        self.temporary = temporary
+        # probe.AudioInfo, when the caller already probed the file
+        self.audio_info = audio_info
 
     def get_media(self):
         return self.file_path
 
 
 class MediaProcessor:
-    def __init__(self, media_source):
+    def __init__(self, media_source, start=None, end=None):
         self.media_source = media_source
+        # only [start, end) seconds of the media are decoded, transcribed and
+        # diarized; output timestamps stay relative to the start of the media
+        self.start_seconds = start
+        self.end_seconds = end
         self.temp_dir = os.path.join(os.getcwd(), "media")
         self.uuid_str = str(uuid.uuid4())
         self.base_file_name = f"{self.temp_dir}/{self.uuid_str}"
+        # source media and decoded PCM go to scratch space (tmpfs) when enabled,
+        # only the transcripts meant for download are written under media/
+        self.scratch_dir = SCRATCH_PATH if IN_MEMORY_AUDIO else self.temp_dir
+        self.source_file_path = f"{self.scratch_dir}/{self.uuid_str}"
+        self.wav_file_path = f"{self.source_file_path}.wav"
+        self.audio_info = getattr(media_source, "audio_info", None)
+        self.probed = False
+        # set when the source is used as the WAV as it is and isn't ours to delete
+        self.wav_is_source = False
 
     def download_media(self):
         media = self.media_source.get_media()
         if isinstance(self.media_source, URLMediaSource):
-            subprocess.run(
-                [
-                    "yt-dlp",
-                    "-f",
-                    "bestaudio[ext=m4a]/best[ext=mp4]/best",
-                    "--xattrs",
-                    f"{media}",
-                    "-o",
-                    f"{self.base_file_name}",
-                ]
-            )
+            get_fetcher().submit(media, self.source_file_path).result()
         elif isinstance(self.media_source, FileMediaSource):
-            # Copy the file to the temp directory
-            shutil.copy2(media, f"{self.base_file_name}")
+            if IN_MEMORY_AUDIO:
+                # ffmpeg reads the spooled upload where it is
+                self.source_file_path = media
+            else:
+                # Copy the file to the temp directory
+                shutil.copy2(media, f"{self.source_file_path}")
         else:
             raise ValueError("Unsupported media source")
 
+    def probe_media(self):
+        """Probe the downloaded source once; later stages reuse `audio_info`."""
+        if not self.probed:
+            self.audio_info = self.audio_info or probe(self.source_file_path)
+            self.probed = True
+        return self.audio_info
+
+    @property
+    def ranged(self):
+        return self.start_seconds is not None or self.end_seconds is not None
+
+    @property
+    def start_ms(self):
+        return round((self.start_seconds or 0) * 1000)
+
+    def owns_source(self):
+        if isinstance(self.media_source, FileMediaSource) and IN_MEMORY_AUDIO:
+            return self.media_source.temporary
+        return True
+
+    def release_source(self):
+        """Remove the downloaded or copied source once the WAV has been extracted from it."""
+        if self.wav_is_source or not self.owns_source():
+            return
+        if os.path.exists(self.source_file_path):
+            os.remove(self.source_file_path)
+
     def extract_audio_and_resample(self):
+        info = self.probe_media()
+        if is_whisper_wav(info) and not self.ranged:
+            logger.info(f"{self.uuid_str} is already 16 kHz mono PCM, skipping resampling")
+            if self.owns_source():
+                os.replace(self.source_file_path, self.wav_file_path)
+            else:
+                self.wav_file_path = self.source_file_path
+                self.wav_is_source = True
+            return
+        if is_whisper_pcm(info):
+            # right samples in another container, rewrap them without decoding
+            codec_args = ["-c:a", "copy"]
+        else:
+            codec_args = ["-ar", "16000", "-ac", "1", "-c:a", "pcm_s16le"]
+        input_args, output_args = seek_args(self.start_seconds, self.end_seconds)
         subprocess.run(
             [
                 "ffmpeg",
+                *input_args,
                 "-i",
-                f"{self.base_file_name}",
+                f"{self.source_file_path}",
                 "-hide_banner",
                 "-loglevel",
                 "error",
-                "-ar",
-                "16000",
-                "-ac",
-                "1",
-                "-c:a",
-                "pcm_s16le",
+                "-vn",
+                *output_args,
+                *codec_args,
                 "-y",
-                f"{self.base_file_name}.wav",
+                f"{self.wav_file_path}",
             ]
         )
 
     def transcribe_audio(self):
         logger.info(f"transcribing audio for {self.uuid_str}")
-        proc = subprocess.Popen(
-            [
-                WHISPER_BINARY,
-                "-m",
-                MODEL_PATH,
-                "-ocsv",
-                "-f",
-                f"{self.base_file_name}.wav",
-                "-t",
-                "8",
-                "-of",
-                f"media/{self.uuid_str}.csv",
-            ],
-            stdout=subprocess.PIPE,
-        )
-        transcript_file = open(f"{self.temp_dir}/transcript_{self.uuid_str}.txt", "a", encoding="utf-8")
-        for line in iter(proc.stdout.readline, ""):
-            if not line:
-                logger.info("finished processing")
-                yield (
-                    f"<br/><br/><a class='download_csv_a' href='http://localhost:8833/download/c/{self.uuid_str}.csv'"
-                    " target='_blank'>Download CSV </a><br/><br/>"
-                )
-                break
-            if line.startswith(b"["):
-                line = line.decode("utf8").strip()
-                transcript_file.write(line)
+        wav_file_path = self.wav_file_path
+        if PARALLEL_TRANSCRIPTION:
+            chunks = silence_chunks(wav_file_path, start_ms=self.start_ms)
+            lines = ChunkedTranscriber().transcribe(chunks, f"{self.base_file_name}.csv")
+        else:
+            lines = get_pool().transcribe(wav_file_path, f"{self.base_file_name}.csv", offset=self.start_ms)
+        with open(f"{self.temp_dir}/transcript_{self.uuid_str}.txt", "a", encoding="utf-8") as transcript_file:
+            for line in lines:
+                transcript_file.write(f"{line}\n")
                 yield f"<br>{line}"
+        logger.info("finished processing")
+        yield (
+            f"<br/><br/><a class='download_csv_a' href='http://localhost:8833/download/c/{self.uuid_str}'"
+            " target='_blank'>Download CSV </a><br/><br/>"
+        )
+
+    def stream_transcribe(self):
+        """
+        Download, decode and transcribe in one overlapping pipeline.
+
+        PCM chunks go to the worker pool while yt-dlp and ffmpeg are still
+        running; the full WAV is written alongside for diarization.
+        """
+        logger.info(f"streaming transcription for {self.uuid_str}")
+        media = self.media_source.get_media()
+        window = {"start": self.start_seconds, "end": self.end_seconds}
+        host_slot = nullcontext()
+        if isinstance(self.media_source, URLMediaSource):
+            cached = get_fetcher().cached_path(media)
+            if cached:
+                logger.info(f"Download cache hit for {media}")
+                pipeline = PCMPipeline(file_path=cached, **window)
             else:
-                logger.info("Not a line")
-                continue
+                # the download is kept on its way through, so the next job for this media hits the cache
+                pipeline = PCMPipeline(url=media, download_path=self.source_file_path, **window)
+                host_slot = get_fetcher().limiter.slot(media)
+        elif isinstance(self.media_source, FileMediaSource):
+            pipeline = PCMPipeline(file_path=media, **window)
+        else:
+            raise ValueError("Unsupported media source")
+        with host_slot:
+            chunks = tee_to_wav(pipeline.start().chunks(), self.wav_file_path)
+            with open(f"{self.temp_dir}/transcript_{self.uuid_str}.txt", "a", encoding="utf-8") as transcript_file:
+                for line in ChunkedTranscriber().transcribe(chunks, f"{self.base_file_name}.csv"):
+                    transcript_file.write(f"{line}\n")
+                    yield f"<br>{line}"
+        if pipeline.downloaded:
+            get_fetcher().store(media, self.source_file_path)
+        logger.info("finished processing")
+        yield (
+            f"<br/><br/><a class='download_csv_a' href='http://localhost:8833/download/c/{self.uuid_str}'"
+            " target='_blank'>Download CSV </a><br/><br/>"
+        )
+
+    def artifacts(self, diarize=False):
+        """Paths of the files a finished job leaves in media/, by cache name."""
+        artifacts = {
+            "transcript.txt": f"{self.temp_dir}/transcript_{self.uuid_str}.txt",
+            "result.csv": f"{self.base_file_name}.csv",
+        }
+        if diarize:
+            artifacts["result.rttm"] = f"{self.base_file_name}.rttm"
+            artifacts["result.fo.txt"] = f"{self.base_file_name}.fo.txt"
+        for name, path in store_paths(self.base_file_name).items():
+            artifacts[f"result.seg.{name}"] = path
+        return artifacts
+
+    def replay_transcript(self):
+        with open(f"{self.temp_dir}/transcript_{self.uuid_str}.txt", encoding="utf-8") as transcript_file:
+            for line in transcript_file:
+                yield f"<br>{line.rstrip()}"
+        yield (
+            f"<br/><br/><a class='download_csv_a' href='http://localhost:8833/download/c/{self.uuid_str}'"
+            " target='_blank'>Download CSV </a><br/><br/>"
+        )
+
+    def diarize_alongside(self, slot):
+        """Diarize the WAV in the background if `slot` is free; see DiarizationEngine.alongside."""
+        return get_diarization_engine().alongside(
+            slot, self.wav_file_path, f"{self.base_file_name}.rttm", offset=self.start_seconds or 0.0
+        )
 
     def run_speaker_diff(self):
-        wav_file_path = f"{self.base_file_name}.wav"
+        wav_file_path = self.wav_file_path
         csv_file_path = f"{self.base_file_name}.csv"
-        speaker_diar = StandardizeOutput(wav_file_path=wav_file_path, csv_file_path=csv_file_path)
-        speaker_diar.get_standardized_output()
+        speaker_diar = StandardizeOutput(
+            wav_file_path=wav_file_path, csv_file_path=csv_file_path, offset=self.start_seconds or 0.0
+        )
+        for line in speaker_diar.iter_standardized_output():
+            yield f"<br>{line}"
+
+    def write_segment_store(self):
+        """
+        Segment store and search index entries of a transcript without
+        speakers; StandardizeOutput writes those of a diarized one.
+        """
+        with SegmentWriter(self.base_file_name) as store, index_writer(self.uuid_str) as index:
+            for start, end, text in iter_csv_segments(f"{self.base_file_name}.csv"):
+                store.append(start, end, None, text)
+                index.append(start, end, None, text)
+
+    def index_segment_store(self):
+        """Add an existing segment store, e.g. restored from the result cache, to the search index."""
+        with SegmentStore(self.base_file_name) as store, index_writer(self.uuid_str) as index:
+            for segment in store.iter_range():
+                index.append(*segment)
+
+    def cleanup(self):
+        """Remove the job's intermediate audio: source, WAV and spooled upload."""
+        paths = [f"{self.scratch_dir}/{self.uuid_str}"]
+        if not self.wav_is_source:
+            paths.append(self.wav_file_path)
+        if isinstance(self.media_source, FileMediaSource) and self.media_source.temporary:
+            paths.append(self.media_source.get_media())
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
 
 
 class MediaTranscriptionFacade:
-    def __init__(self, media_source):
-        self.media_processor = MediaProcessor(media_source)
+    def __init__(self, media_source, job=None, start=None, end=None):
+        self.media_processor = MediaProcessor(media_source, start=start, end=end)
+        self.job = job
+
+    def stage(self, name, blocking=True, timed=True):
+        if self.job is None:
+            return nullcontext(True)
+        return self.job.stage_slot(name, blocking, timed)
+
+    def span(self, name):
+        if self.job is None:
+            return nullcontext()
+        return self.job.span(name)
 
-    def transcribe_media(self):
+    def transcribe_media(self, diarize=False, streaming=False):
+        diarization = None
+        get_storage().open(self.media_processor.uuid_str)
         try:
-            self.media_processor.download_media()
-            self.media_processor.extract_audio_and_resample()
-            transcription = self.media_processor.transcribe_audio()
-            return transcription
+            params = {"diarize": diarize}
+            if diarize:
+                params["diarization_mode"] = DIARIZATION_MODE
+            if streaming:
+                params["stream_chunk_seconds"] = STREAM_CHUNK_SECONDS
+            elif PARALLEL_TRANSCRIPTION:
+                params["parallel_chunk_seconds"] = PARALLEL_CHUNK_SECONDS
+            if self.media_processor.ranged:
+                params["start"] = self.media_processor.start_seconds
+                params["end"] = self.media_processor.end_seconds
+
+            cache_key = None
+            if isinstance(self.media_processor.media_source, URLMediaSource):
+                # a yt-dlp request to the host, so it queues like a download; the download and
+                # streaming paths reuse the answer
+                with self.stage("download"):
+                    media_id, duration = url_media_info(self.media_processor.media_source.get_media())
+                self._set_duration(duration)
+                if RESULT_CACHE_ENABLED and media_id:
+                    cache_key = ResultCache.key(media_id, **params)
+                    if self._restore_cached(cache_key, diarize):
+                        yield from self._replay_cached(diarize)
+                        return
+
+            if streaming:
+                # every stage runs at once, so hold all their slots for the duration and time
+                # them as one "stream" span; per-stage times would each be the whole run
+                with self.stage("download", timed=False), self.stage("resample", timed=False):
+                    with self.stage("transcribe", timed=False), self.span("stream"):
+                        yield "Streaming media into transcription...<br>"
+                        yield from self.media_processor.stream_transcribe()
+            else:
+                with self.stage("download"):
+                    yield "Downloading media...<br>"
+                    self.media_processor.download_media()
+                with self.span("probe"):
+                    info = self.media_processor.probe_media()
+                if info is not None:
+                    self._set_duration(info.duration)
+                with self.stage("resample"):
+                    yield "Extracting audio and resampling...<br>"
+                    self.media_processor.extract_audio_and_resample()
+                self.media_processor.release_source()
+                if RESULT_CACHE_ENABLED and cache_key is None:
+                    cache_key = ResultCache.key(pcm_digest(self.media_processor.wav_file_path), **params)
+                    if self._restore_cached(cache_key, diarize):
+                        yield from self._replay_cached(diarize)
+                        return
+                # diarization only needs the WAV, so it runs alongside whisper when a slot is
+                # free right away; otherwise it waits its turn once transcription is done
+                slot = self.stage("diarize", blocking=False) if diarize else nullcontext(False)
+                with self.media_processor.diarize_alongside(slot) as diarization:
+                    with self.stage("transcribe"):
+                        yield from self.media_processor.transcribe_audio()
+                    if diarization is not None:
+                        yield "Waiting for speaker diarization...<br>"
+                        diarization.result()
+            if diarize:
+                if diarization is not None:
+                    with self.span("merge"):
+                        yield from self.media_processor.run_speaker_diff()
+                else:
+                    with self.stage("diarize"):
+                        yield "Running speaker diarization...<br>"
+                        yield from self.media_processor.run_speaker_diff()
+                yield self._diarization_link()
+            else:
+                self.media_processor.write_segment_store()
+            if cache_key is not None:
+                get_result_cache().put(cache_key, self.media_processor.artifacts(diarize))
         except Exception as e:
             logger.error("An error occurred during media transcription: %s", e)
-            return None
+            raise
+        finally:
+            self.media_processor.cleanup()
+            get_storage().close(self.media_processor.uuid_str, self.media_processor.artifacts(diarize).values())
+
+    def _set_duration(self, duration):
+        """Give the job the length of its window of the media once known; its priority follows."""
+        if self.job is not None and duration is not None:
+            self.job.duration = window_duration(
+                duration, self.media_processor.start_seconds, self.media_processor.end_seconds
+            )
+
+    def _restore_cached(self, cache_key, diarize):
+        restored = get_result_cache().restore(cache_key, self.media_processor.artifacts(diarize))
+        if restored:
+            logger.info("Result cache hit for %s", self.media_processor.uuid_str)
+            self.media_processor.index_segment_store()
+        return restored
+
+    def _replay_cached(self, diarize):
+        yield "Found a cached result for this media<br>"
+        yield from self.media_processor.replay_transcript()
+        if diarize:
+            with open(f"{self.media_processor.base_file_name}.fo.txt", encoding="utf-8") as final_doc:
+                for line in final_doc:
+                    yield f"<br>{line.rstrip()}"
+            yield self._diarization_link()
+
+    def _diarization_link(self):
+        return (
+            f"<a href='/download/x/{self.media_processor.uuid_str}' target='_blank'>"
+            "Download speaker-labelled transcript</a><br/>"
+        )
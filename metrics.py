@@ -0,0 +1,166 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from config import JOB_LOG_FILE, LOG_FLUSH_INTERVAL, LOG_QUEUED
+from whisperlog import setup_json_logger
+
+SECONDS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+RTF_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5)
+
+job_logger = setup_json_logger('PODV2T.jobs', JOB_LOG_FILE, queued=LOG_QUEUED, flush_interval=LOG_FLUSH_INTERVAL)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """A value read from `getter` at scrape time, e.g. a queue length."""
+
+    def __init__(self, name, help, getter=None):
+        self.name = name
+        self.help = help
+        self.getter = getter
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        if self.getter is not None:
+            lines.append(f"{self.name} {self.getter()}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            counts, total, count = self.values.get(labels) or ([0] * (len(self.buckets) + 1), 0.0, 0)
+            counts[bisect_left(self.buckets, value)] += 1
+            self.values[labels] = (counts, total + value, count + 1)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self.lock:
+            for labels, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+JOBS = Counter("podv2t_jobs_total", "Finished jobs by final status.", ["status"])
+AUDIO_SECONDS = Counter("podv2t_audio_seconds_total", "Seconds of audio in finished jobs.")
+QUEUE_WAIT = Histogram("podv2t_queue_wait_seconds", "Time jobs spent queued before a worker picked them up.")
+STAGE_WAIT = Histogram("podv2t_stage_wait_seconds", "Time spent waiting for a stage slot.", ["stage"])
+STAGE_SECONDS = Histogram("podv2t_stage_seconds", "Wall time of each job stage.", ["stage"])
+STAGE_RTF = Histogram(
+    "podv2t_stage_real_time_factor", "Stage wall time divided by audio duration.", ["stage"], RTF_BUCKETS
+)
+QUEUE_DEPTH = Gauge("podv2t_queue_depth", "Jobs waiting for a worker.")
+REGISTRY = [JOBS, AUDIO_SECONDS, QUEUE_WAIT, STAGE_WAIT, STAGE_SECONDS, STAGE_RTF, QUEUE_DEPTH]
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+class Timings:
+    """
+    Per-job timing spans. Time spent inside spans of the same name adds up,
+    so a stage entered more than once reports its total.
+    """
+
+    def __init__(self):
+        self.spans = {}
+        self.waits = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, seconds, waited=0.0):
+        """Add `seconds` to the span `name` (None records only the wait) and `waited` to its wait."""
+        with self.lock:
+            if seconds is not None:
+                self.spans[name] = self.spans.get(name, 0.0) + seconds
+            if waited:
+                self.waits[name] = self.waits.get(name, 0.0) + waited
+
+    @contextmanager
+    def span(self, name):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - start)
+
+
+def record_job(job):
+    """Export a finished job's timings as metrics and one JSON log line."""
+    queue_wait = (job.started_at or job.finished_at) - job.created_at
+    JOBS.inc(job.status)
+    QUEUE_WAIT.observe(queue_wait)
+    if job.duration:
+        AUDIO_SECONDS.inc(amount=job.duration)
+    with job.timings.lock:
+        spans = dict(job.timings.spans)
+        waits = dict(job.timings.waits)
+    rtf = {}
+    for stage, seconds in spans.items():
+        STAGE_SECONDS.observe(seconds, stage)
+        if job.duration:
+            rtf[stage] = seconds / job.duration
+            STAGE_RTF.observe(rtf[stage], stage)
+    for stage, seconds in waits.items():
+        STAGE_WAIT.observe(seconds, stage)
+    job_logger.info(
+        "job finished",
+        extra={
+            "job": {
+                "id": job.id,
+                "description": job.description,
+                "status": job.status,
+                "error": job.error,
+                "audio_seconds": job.duration,
+                "queue_wait_seconds": queue_wait,
+                "total_seconds": job.finished_at - job.created_at,
+                "stage_seconds": spans,
+                "stage_wait_seconds": waits,
+                "real_time_factor": rtf,
+            }
+        },
+    )
@@ -0,0 +1,58 @@
+import json
+import subprocess
+from collections import namedtuple
+
+from config import SAMPLE_RATE
+from utils import logger
+
+# what ffprobe reports for the first audio stream; duration in seconds, None if unknown
+AudioInfo = namedtuple('AudioInfo', ['container', 'codec', 'sample_rate', 'channels', 'duration'])
+
+
+def probe(media_file_path, timeout=30):
+    """Read container, codec, sample rate, channels and duration with one ffprobe call."""
+    try:
+        result = subprocess.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-select_streams",
+                "a:0",
+                "-show_entries",
+                "stream=codec_name,sample_rate,channels,duration:format=format_name,duration",
+                "-of",
+                "json",
+                media_file_path,
+            ],
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        logger.warning("Could not probe %s: %s", media_file_path, e)
+        return None
+    if result.returncode != 0:
+        logger.warning("ffprobe failed for %s: %s", media_file_path, result.stderr.strip())
+        return None
+    info = json.loads(result.stdout or '{}')
+    streams = info.get('streams') or [{}]
+    stream, container = streams[0], info.get('format', {})
+    duration = stream.get('duration') or container.get('duration')
+    return AudioInfo(
+        container=container.get('format_name'),
+        codec=stream.get('codec_name'),
+        sample_rate=int(stream['sample_rate']) if stream.get('sample_rate') else None,
+        channels=stream.get('channels'),
+        duration=float(duration) if duration else None,
+    )
+
+
+def is_whisper_pcm(info):
+    """True if the audio stream is already 16 kHz mono s16le, whatever the container."""
+    return info is not None and (info.codec, info.sample_rate, info.channels) == ('pcm_s16le', SAMPLE_RATE, 1)
+
+
+def is_whisper_wav(info):
+    """True if the file can be handed to whisper and diart as it is."""
+    return is_whisper_pcm(info) and info.container == 'wav'
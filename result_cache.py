@@ -0,0 +1,136 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+
+from config import MODEL_PATH, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_PATH
+from utils import logger
+from vad import wav_data_offset
+
+
+class DiskLRUCache:
+    """
+    Directory-per-entry cache under `root`, bounded to `max_bytes` on disk.
+
+    Entries are written to a temporary directory and renamed into place, so a
+    reader never sees a half-written entry. Reads refresh the entry's mtime,
+    and eviction removes the least recently used entries first.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """Return the entry directory for `key`, or None on a miss."""
+        entry = self.path(key)
+        try:
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return entry
+
+    def put(self, key, files):
+        """Store `files` ({name: source path}) under `key` and evict as needed."""
+        tmp = os.path.join(self.root, f".tmp-{uuid.uuid4()}")
+        os.makedirs(tmp)
+        try:
+            for name, src in files.items():
+                shutil.copyfile(src, os.path.join(tmp, name))
+            with self.lock:
+                if os.path.exists(self.path(key)):
+                    shutil.rmtree(self.path(key))
+                os.rename(tmp, self.path(key))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+        return self.path(key)
+
+    def evict(self):
+        with self.lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.root):
+                entry = os.path.join(self.root, name)
+                if name.startswith('.tmp-') or not os.path.isdir(entry):
+                    continue
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                entries.append((os.path.getmtime(entry), size, entry))
+                total += size
+            for _, size, entry in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                logger.info("Evicting cache entry %s (%d bytes)", entry, size)
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+
+def pcm_digest(wav_file_path, block_size=1 << 20):
+    """sha256 of the decoded PCM samples, ignoring WAV header differences."""
+    offset, size = wav_data_offset(wav_file_path)
+    digest = hashlib.sha256()
+    with open(wav_file_path, 'rb') as f:
+        f.seek(offset)
+        remaining = size
+        while remaining:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return f"pcm:{digest.hexdigest()}"
+
+
+class ResultCache(DiskLRUCache):
+    """
+    Finished job artifacts (CSV, RTTM, final output, transcript) keyed by what
+    produced them: the audio identity plus the model name and parameters.
+    """
+
+    def __init__(self, root=RESULT_CACHE_PATH, max_bytes=RESULT_CACHE_MAX_BYTES):
+        super().__init__(root, max_bytes)
+
+    @staticmethod
+    def key(identity, **params):
+        payload = json.dumps(
+            {"identity": identity, "model": os.path.basename(MODEL_PATH), "params": params}, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def restore(self, key, artifacts):
+        """
+        Copy a cached entry's files to the paths in `artifacts` ({name: path}).
+        Returns False on a miss or if the entry lacks any requested artifact.
+        The copy holds the lock so eviction can't remove the entry midway; an
+        entry removed by another process reads as a miss.
+        """
+        with self.lock:
+            entry = self.get(key)
+            if entry is None:
+                return False
+            try:
+                for name, dst in artifacts.items():
+                    shutil.copyfile(os.path.join(entry, name), dst)
+            except OSError as e:
+                logger.warning("Cache entry %s is incomplete: %s", key, e)
+                return False
+        return True
+
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
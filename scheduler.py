@@ -0,0 +1,497 @@
+import asyncio
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from config import (
+    JOB_BATCH_AGING_SECONDS,
+    JOB_EVENT_BUFFER,
+    JOB_INTERACTIVE_SECONDS,
+    JOB_QUEUE_SIZE,
+    JOB_RETENTION_SECONDS,
+    JOB_UNKNOWN_COST_SECONDS,
+    JOB_WORKERS,
+    STAGE_LIMITS,
+)
+from metrics import QUEUE_DEPTH, Timings, record_job
+from utils import logger
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class EventBuffer:
+    """
+    Ring buffer of a job's progress events, each tagged with an increasing id.
+
+    Only the last `maxlen` events are kept, so a client reconnecting with the
+    last id it saw gets everything after it that is still buffered. Readers can
+    wait from a thread (`wait`) or from any event loop (`wait_async`).
+    """
+
+    def __init__(self, maxlen=JOB_EVENT_BUFFER):
+        self.events = deque(maxlen=maxlen)
+        self.last_id = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.async_waiters = []
+
+    def append(self, message):
+        with self.condition:
+            self.last_id += 1
+            self.events.append((self.last_id, message))
+            self._notify()
+            return self.last_id
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self._notify()
+
+    def _notify(self):
+        self.condition.notify_all()
+        waiters, self.async_waiters = self.async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_wake, future)
+
+    def since(self, last_id):
+        """Buffered (id, message) pairs newer than `last_id`."""
+        return self.snapshot(last_id)[0]
+
+    def snapshot(self, last_id):
+        """`since(last_id)` and whether the buffer is closed, read together so no event slips in between."""
+        with self.condition:
+            if last_id >= self.last_id:
+                return [], self.closed
+            first_id = self.last_id - len(self.events) + 1
+            return list(self.events)[max(0, last_id + 1 - first_id):], self.closed
+
+    def wait(self, last_id, timeout=None):
+        with self.condition:
+            if self.last_id <= last_id and not self.closed:
+                self.condition.wait(timeout)
+
+    async def wait_async(self, last_id):
+        loop = asyncio.get_running_loop()
+        with self.condition:
+            if self.last_id > last_id or self.closed:
+                return
+            future = loop.create_future()
+            self.async_waiters.append((loop, future))
+        await future
+
+    def iter_since(self, last_id, timeout=15, heartbeat=False):
+        """
+        Yield (id, message) after `last_id` until the buffer is closed. With
+        `heartbeat`, yields None whenever `timeout` passes without an event.
+        """
+        while True:
+            pending, closed = self.snapshot(last_id)
+            for event in pending:
+                last_id = event[0]
+                yield event
+            if pending:
+                continue
+            if closed:
+                return
+            self.wait(last_id, timeout)
+            if heartbeat and not self.since(last_id) and not self.closed:
+                yield None
+
+    async def aiter_since(self, last_id, heartbeat=None):
+        """Async counterpart of `iter_since`; `heartbeat` is a timeout in seconds."""
+        while True:
+            pending, closed = self.snapshot(last_id)
+            for event in pending:
+                last_id = event[0]
+                yield event
+            if pending:
+                continue
+            if closed:
+                return
+            try:
+                await asyncio.wait_for(self.wait_async(last_id), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+
+PRIORITIES = ("interactive", "batch")
+
+
+def job_priority(duration, requested=None):
+    """
+    Priority class of a job with `duration` seconds of audio: interactive for
+    short clips, batch for long or unknown media or when the client asks
+    for batch. A long job can't ask to be interactive. The servers look a
+    URL's duration up before submitting; jobs whose lookup failed are
+    reclassed when the job itself learns it.
+    """
+    if requested == "batch" or duration is None or duration > JOB_INTERACTIVE_SECONDS:
+        return "batch"
+    return "interactive"
+
+
+def job_cost(duration):
+    """Seconds of audio a job is charged to its client for."""
+    return JOB_UNKNOWN_COST_SECONDS if duration is None else duration
+
+
+def job_rank(job, now=None):
+    """
+    Sort key of a waiting job, lowest first: priority class, then fair-share
+    tag, then age. Batch jobs that have waited JOB_BATCH_AGING_SECONDS rank
+    as interactive, so long jobs keep making progress under a stream of
+    short ones.
+    """
+    now = time.time() if now is None else now
+    priority = PRIORITIES.index(job.priority)
+    if now - job.created_at >= JOB_BATCH_AGING_SECONDS:
+        priority = 0
+    return priority, job.tag, job.created_at
+
+
+class FairShare:
+    """
+    Start-time fair queueing of jobs across clients. A job is tagged on
+    arrival with the later of the virtual clock and its client's last finish
+    tag, and moves that finish tag on by its cost. The clock is the lowest
+    tag of the jobs not finished yet, so a client with hours of audio queued
+    or running gets tags far ahead of a client submitting its first clip,
+    and the clip goes first. Once every job has finished the history is
+    forgotten.
+    """
+
+    def __init__(self):
+        self.finish = {}
+        self.tags = []
+        self.lock = threading.Lock()
+
+    def tag(self, client, cost):
+        with self.lock:
+            start = max(min(self.tags, default=0.0), self.finish.get(client, 0.0))
+            self.finish[client] = start + cost
+            self.tags.append(start)
+            return start
+
+    def recost(self, client, old_cost, new_cost):
+        """Charge `client` `new_cost` instead of `old_cost` for a job tagged earlier, once its length is known."""
+        with self.lock:
+            if client in self.finish:
+                self.finish[client] += new_cost - old_cost
+
+    def finished(self, tag):
+        with self.lock:
+            self.tags.remove(tag)
+            if not self.tags:
+                self.finish.clear()
+
+
+class FairQueue:
+    """
+    Bounded job queue that tags jobs with their fair share as they are put
+    and whose `get` returns the best-ranked job (see `job_rank`) instead of
+    the oldest. Queues are a few dozen jobs deep, so a scan per `get` is
+    cheaper than keeping a heap in order while ranks age.
+    """
+
+    def __init__(self, maxsize, share):
+        self.maxsize = maxsize
+        self.share = share
+        self.jobs = []
+        self.condition = threading.Condition()
+
+    def put_nowait(self, job):
+        with self.condition:
+            if len(self.jobs) >= self.maxsize:
+                raise queue.Full
+            job.share = self.share
+            job.tag = self.share.tag(job.client, job_cost(job.duration))
+            self.jobs.append(job)
+            self.condition.notify()
+
+    def get(self):
+        with self.condition:
+            while not self.jobs:
+                self.condition.wait()
+            now = time.time()
+            job = min(self.jobs, key=lambda j: job_rank(j, now))
+            self.jobs.remove(job)
+        return job
+
+    def qsize(self):
+        with self.condition:
+            return len(self.jobs)
+
+
+class FairSemaphore:
+    """
+    Counting semaphore for stage slots that hands a freed slot to the
+    best-ranked waiting job rather than the one that asked first.
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.waiters = []
+        self.condition = threading.Condition()
+
+    def acquire(self, job, blocking=True):
+        with self.condition:
+            if self.value:
+                self.value -= 1
+                return True
+            if not blocking:
+                return False
+            waiter = [job, False]
+            self.waiters.append(waiter)
+            while not waiter[1]:
+                self.condition.wait()
+            return True
+
+    def release(self):
+        with self.condition:
+            if not self.waiters:
+                self.value += 1
+                return
+            now = time.time()
+            waiter = min(self.waiters, key=lambda w: job_rank(w[0], now))
+            self.waiters.remove(waiter)
+            waiter[1] = True
+            self.condition.notify_all()
+
+
+def sse_event(event_id, message, event=None):
+    """Format one Server-Sent Events frame."""
+    lines = [f"id: {event_id}"]
+    if event:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in str(message).split("\n"))
+    return "\n".join(lines) + "\n\n"
+
+
+class Job:
+    """
+    A unit of work submitted to the JobScheduler.
+
+    The runner's output is appended to `events`, so any number of clients can
+    poll, stream or resume the job's progress independently of the thread
+    running it; a client going away never stops the job.
+    """
+
+    def __init__(self, runner, description="", stage_semaphores=None, duration=None, client=None, priority=None):
+        self.id = str(uuid.uuid4())
+        self.runner = runner
+        self.description = description
+        self.client = client
+        self.requested_priority = priority
+        # fair share the job is charged to and its start tag, set when the job is queued
+        self.share = None
+        self.tag = 0.0
+        self._duration = duration
+        self.priority = job_priority(duration, priority)
+        self.status = "queued"
+        self.stages = []
+        self.error = None
+        self.events = EventBuffer()
+        self.timings = Timings()
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stage_semaphores = stage_semaphores or {}
+
+    @property
+    def duration(self):
+        """Seconds of audio, from probing the media; None until known."""
+        return self._duration
+
+    @duration.setter
+    def duration(self, duration):
+        # URLs are queued before their length is known; once it is, rank and charge the job by it
+        previous, self._duration = self._duration, duration
+        self.priority = job_priority(duration, self.requested_priority)
+        if self.share is not None:
+            self.share.recost(self.client, job_cost(previous), job_cost(duration))
+
+    @property
+    def stage(self):
+        """The most recently entered stage that is still running."""
+        return self.stages[-1] if self.stages else None
+
+    @property
+    def done(self):
+        return self.status in ("done", "failed")
+
+    def publish(self, message):
+        return self.events.append(message)
+
+    @contextmanager
+    def stage_slot(self, name, blocking=True, timed=True):
+        """
+        Hold one of the scheduler's slots for `name` while the stage runs, and
+        yield True. Stages may overlap, e.g. diarization running on another
+        thread during transcription, but slots are entered and left on the
+        job's own thread. With `blocking=False`, yields False right away
+        instead of waiting when no slot is free. With `timed=False` only the
+        wait for the slot is recorded, for stages timed together under a span.
+        """
+        semaphore = self.stage_semaphores.get(name)
+        requested = time.monotonic()
+        if semaphore is not None and not semaphore.acquire(self, blocking):
+            yield False
+            return
+        started = time.monotonic()
+        self.stages.append(name)
+        try:
+            yield True
+        finally:
+            self.stages.remove(name)
+            if semaphore is not None:
+                semaphore.release()
+            self.timings.add(name, time.monotonic() - started if timed else None, waited=started - requested)
+
+    def span(self, name):
+        """Time a step that has no stage slot of its own, e.g. probing or merging."""
+        return self.timings.span(name)
+
+    def iter_events(self, last_event_id=0):
+        """Yield event messages after `last_event_id` until the job finishes."""
+        for _, message in self.events.iter_since(last_event_id):
+            yield message
+
+    def iter_sse(self, last_event_id=0, heartbeat=15):
+        """Yield the job's events as Server-Sent Events, ending with a `done` event."""
+        for event in self.events.iter_since(last_event_id, timeout=heartbeat, heartbeat=True):
+            if event is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield sse_event(*event)
+        yield sse_event(self.events.last_id, self.status, event="done")
+
+    def run(self):
+        """Run the runner on the calling thread, publishing its messages, until it finishes or fails."""
+        self.status = "running"
+        self.started_at = time.time()
+        try:
+            for message in self.runner(self):
+                self.publish(message)
+        except Exception as e:
+            logger.error("Job %s failed: %s", self.id, e)
+            self.publish(f"An error occurred: {e}")
+            self._finish("failed", str(e))
+        else:
+            self._finish("done")
+
+    def _finish(self, status, error=None):
+        self.status = status
+        self.error = error
+        self.finished_at = time.time()
+        record_job(self)
+        self.events.close()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "description": self.description,
+            "duration": self.duration,
+            "priority": self.priority,
+            "status": self.status,
+            "stage": self.stage,
+            "stages": list(self.stages),
+            "error": self.error,
+            "events": self.events.last_id,
+            "timings": dict(self.timings.spans),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobScheduler:
+    """
+    Runs jobs on a fixed set of worker threads behind a bounded queue.
+
+    `submit` returns immediately with a Job, or raises QueueFullError when the
+    queue is at capacity. Inside a job each stage (download, resample,
+    transcribe, diarize) is further limited by its own semaphore, so adding
+    load queues work instead of oversubscribing the machine. Both the queue
+    and the stage slots serve waiting jobs by priority class and per-client
+    fair share rather than in arrival order.
+    """
+
+    def __init__(self, max_queue=JOB_QUEUE_SIZE, workers=JOB_WORKERS, stage_limits=None):
+        self.share = FairShare()
+        self.queue = FairQueue(max_queue, self.share)
+        self.jobs = {}
+        self.jobs_lock = threading.Lock()
+        limits = STAGE_LIMITS if stage_limits is None else stage_limits
+        self.stage_semaphores = {name: FairSemaphore(limit) for name, limit in limits.items()}
+        QUEUE_DEPTH.getter = self.queued
+        self.workers = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self.workers.append(thread)
+
+    def submit(self, runner, description="", duration=None, client=None, priority=None):
+        """
+        Queue `runner(job)`, an iterable of progress messages, as a new job of
+        `client`. `priority` may ask for "batch"; otherwise short jobs are
+        interactive.
+        """
+        job = Job(runner, description, self.stage_semaphores, duration, client, priority)
+        self._prune()
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFullError(f"job queue is full ({self.queue.maxsize} jobs waiting)") from None
+        with self.jobs_lock:
+            self.jobs[job.id] = job
+        logger.info("Queued %s job %s for %s: %s", job.priority, job.id, client, description)
+        return job
+
+    def get(self, job_id):
+        with self.jobs_lock:
+            return self.jobs.get(job_id)
+
+    def queued(self):
+        return self.queue.qsize()
+
+    def backlog_seconds(self):
+        """Seconds of audio known to be waiting or running, for wait estimates."""
+        with self.jobs_lock:
+            return sum(job.duration or 0 for job in self.jobs.values() if not job.done)
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        with self.jobs_lock:
+            for job_id in [j.id for j in self.jobs.values() if j.done and j.finished_at < cutoff]:
+                del self.jobs[job_id]
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                job.run()
+            finally:
+                self.share.finished(job.tag)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide job scheduler, creating it on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = JobScheduler()
+        return _scheduler
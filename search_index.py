@@ -0,0 +1,160 @@
+import re
+import sqlite3
+import threading
+
+from config import SEARCH_INDEX_BATCH, SEARCH_INDEX_ENABLED, SEARCH_INDEX_PATH
+from utils import logger
+
+# a quoted phrase or a bare word
+QUERY_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def fts_query(query):
+    """
+    FTS5 MATCH expression for a user query: every bare word and every
+    "quoted phrase" must appear. Terms are quoted, so FTS5 operators and
+    punctuation in the query are searched for literally.
+    """
+    terms = []
+    for phrase, word in QUERY_TERM.findall(query):
+        term = (phrase or word).strip()
+        if term:
+            terms.append('"' + term.replace('"', '""') + '"')
+    if not terms:
+        raise ValueError("empty query")
+    return " ".join(terms)
+
+
+class SearchIndex:
+    """
+    Inverted index over finished transcripts in sqlite: segment rows in a
+    plain table indexed by job, and an FTS5 table over their text kept in
+    step by triggers. Rows are added in batches while the final output is
+    written. Hits come newest first, which lets a query stop after `limit`
+    matches however common its words are; ranking by bm25 instead has to
+    score every match.
+    """
+
+    def __init__(self, path=SEARCH_INDEX_PATH):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS segments (
+                id INTEGER PRIMARY KEY, job TEXT, start INTEGER, end INTEGER, speaker TEXT, text TEXT
+            );
+            CREATE INDEX IF NOT EXISTS segments_job ON segments (job);
+            CREATE VIRTUAL TABLE IF NOT EXISTS segments_text USING fts5(
+                text, content='segments', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS segments_insert AFTER INSERT ON segments BEGIN
+                INSERT INTO segments_text (rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS segments_delete AFTER DELETE ON segments BEGIN
+                INSERT INTO segments_text (segments_text, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+            """
+        )
+
+    def add(self, job_id, rows):
+        """Index (start_ms, end_ms, speaker, text) rows of `job_id`."""
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "INSERT INTO segments (job, start, end, speaker, text) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, start, end, speaker, text) for start, end, speaker, text in rows],
+            )
+            self.db.execute("COMMIT")
+
+    def remove(self, job_id):
+        with self.lock:
+            self.db.execute("DELETE FROM segments WHERE job = ?", (job_id,))
+
+    def writer(self, job_id):
+        return IndexWriter(self, job_id)
+
+    def search(self, query, limit=50, job_id=None, ranked=False):
+        """Segments matching `query`, as dicts with job_id, start, end, speaker and text."""
+        sql = (
+            "SELECT s.job, s.start, s.end, s.speaker, s.text FROM segments_text"
+            " JOIN segments s ON s.id = segments_text.rowid WHERE segments_text MATCH ?"
+        )
+        params = [fts_query(query)]
+        if job_id is not None:
+            sql += " AND s.job = ?"
+            params.append(job_id)
+        sql += " ORDER BY segments_text.rank LIMIT ?" if ranked else " ORDER BY segments_text.rowid DESC LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return [
+            {"job_id": job, "start": start, "end": end, "speaker": speaker, "text": text}
+            for job, start, end, speaker, text in rows
+        ]
+
+
+class IndexWriter:
+    """
+    Buffer one job's rows and add them `batch_size` at a time, replacing
+    anything indexed for the job before. Used as a context manager.
+    """
+
+    def __init__(self, index, job_id, batch_size=SEARCH_INDEX_BATCH):
+        self.index = index
+        self.job_id = job_id
+        self.batch_size = batch_size
+        self.rows = []
+
+    def __enter__(self):
+        self.index.remove(self.job_id)
+        return self
+
+    def append(self, start, end, speaker, text):
+        self.rows.append((start, end, speaker, text))
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.rows:
+            self.index.add(self.job_id, self.rows)
+            self.rows = []
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.index.remove(self.job_id)
+
+
+class NullIndexWriter:
+    """Stand-in writer when the search index is disabled."""
+
+    def __enter__(self):
+        return self
+
+    def append(self, start, end, speaker, text):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_search_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = SearchIndex()
+            logger.info("Opened search index %s", SEARCH_INDEX_PATH)
+        return _index
+
+
+def index_writer(job_id):
+    """Writer adding `job_id`'s segments to the search index, or a no-op one when it is disabled."""
+    if not SEARCH_INDEX_ENABLED:
+        return NullIndexWriter()
+    return get_search_index().writer(job_id)
@@ -0,0 +1,204 @@
+"""
+Columnar transcript storage with random access by time.
+
+A transcript is three files next to the job's other outputs:
+
+    <base>.seg.npy   one fixed-width record per segment: start and end (ms),
+                     speaker id, running maximum of end, and the byte range of
+                     its text in the blob
+    <base>.seg.bin   the segments' UTF-8 text, back to back
+    <base>.seg.json  speaker names (indexed by speaker id) and segment count
+
+The records are sorted by start and memory-mapped on open, so selecting a
+time range is two binary searches and reading it touches only the records
+and text bytes inside the range.
+"""
+import csv
+import io
+import json
+import mmap
+import os
+import re
+from array import array
+
+import numpy as np
+
+SEGMENT_DTYPE = np.dtype(
+    [
+        ('start', '<i8'),
+        ('end', '<i8'),
+        ('speaker', '<i4'),
+        ('end_max', '<i8'),
+        ('text_start', '<i8'),
+        ('text_end', '<i8'),
+    ]
+)
+NO_SPEAKER = -1
+
+
+def store_paths(base_file_name):
+    return {
+        "columns": f"{base_file_name}.seg.npy",
+        "text": f"{base_file_name}.seg.bin",
+        "meta": f"{base_file_name}.seg.json",
+    }
+
+
+# a whisper -ocsv row: start,end,"text" with quotes and backslashes in the text backslash-escaped
+CSV_ROW = re.compile(r'(\d+),(\d+),(.*)')
+CSV_ESCAPE = re.compile(r'\\(.)')
+
+
+def iter_csv_rows(f):
+    """
+    Yield (start_ms, end_ms, raw) for the rows of an open whisper -ocsv file,
+    where `raw` is the text field as written. The one parser for these files;
+    a header or malformed line is skipped.
+    """
+    for line in f:
+        match = CSV_ROW.match(line.rstrip('\r\n'))
+        if match:
+            yield int(match[1]), int(match[2]), match[3]
+
+
+def csv_text(raw):
+    """Segment text of a raw -ocsv text field: quotes stripped and escapes undone (see whisper_pool.write_csv)."""
+    text = raw.strip()
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        text = text[1:-1]
+    return CSV_ESCAPE.sub(r'\1', text).strip()
+
+
+def iter_csv_segments(csv_file_path):
+    """Yield (start_ms, end_ms, text) from a whisper -ocsv file."""
+    with open(csv_file_path, encoding='utf-8') as f:
+        for start, end, raw in iter_csv_rows(f):
+            yield start, end, csv_text(raw)
+
+
+class SegmentWriter:
+    """
+    Append segments, then `close` to write the columns. The text blob is
+    streamed to disk as segments arrive; the numeric columns are kept in
+    compact arrays until the end, when they are sorted by start if the
+    segments didn't arrive in timeline order.
+    """
+
+    def __init__(self, base_file_name):
+        self.paths = store_paths(base_file_name)
+        self.text_file = open(self.paths["text"], 'wb')
+        self.columns = {name: array('q') for name in ('start', 'end', 'speaker', 'end_max', 'text_start', 'text_end')}
+        self.speakers = {}
+        self.text_offset = 0
+        self.in_order = True
+
+    def append(self, start, end, speaker, text):
+        if speaker is None:
+            speaker_id = NO_SPEAKER
+        else:
+            speaker_id = self.speakers.setdefault(speaker, len(self.speakers))
+        if self.columns['start'] and start < self.columns['start'][-1]:
+            self.in_order = False
+        encoded = text.encode('utf-8')
+        self.text_file.write(encoded)
+        for name, value in (
+            ('start', start),
+            ('end', end),
+            ('speaker', speaker_id),
+            ('end_max', 0),
+            ('text_start', self.text_offset),
+            ('text_end', self.text_offset + len(encoded)),
+        ):
+            self.columns[name].append(value)
+        self.text_offset += len(encoded)
+
+    def close(self):
+        self.text_file.close()
+        records = np.empty(len(self.columns['start']), dtype=SEGMENT_DTYPE)
+        for name, values in self.columns.items():
+            records[name] = np.frombuffer(values, dtype='<i8')
+        if not self.in_order:
+            # range lookups binary-search start; the text ranges travel with their records
+            records = records[np.argsort(records['start'], kind='stable')]
+        np.maximum.accumulate(records['end'], out=records['end_max'])
+        np.save(self.paths["columns"], records)
+        with open(self.paths["meta"], 'w', encoding='utf-8') as f:
+            json.dump({"segments": len(records), "speakers": list(self.speakers)}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            # without the columns and metadata the partial store never counts as written
+            self.text_file.close()
+
+
+def write_segments(base_file_name, segments):
+    """Write (start_ms, end_ms, speaker or None, text) tuples as a segment store."""
+    with SegmentWriter(base_file_name) as writer:
+        for start, end, speaker, text in segments:
+            writer.append(start, end, speaker, text)
+
+
+class SegmentStore:
+    """Read-only, memory-mapped view of a segment store."""
+
+    def __init__(self, base_file_name):
+        paths = store_paths(base_file_name)
+        with open(paths["meta"], encoding='utf-8') as f:
+            meta = json.load(f)
+        self.speakers = meta["speakers"]
+        self.records = np.load(paths["columns"], mmap_mode='r') if meta["segments"] else np.empty(0, SEGMENT_DTYPE)
+        self.text_file = open(paths["text"], 'rb')
+        self.text = b""
+        # mmap can't map an empty file
+        if os.path.getsize(paths["text"]):
+            self.text = mmap.mmap(self.text_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def exists(cls, base_file_name):
+        return all(os.path.exists(path) for path in store_paths(base_file_name).values())
+
+    def __len__(self):
+        return len(self.records)
+
+    def range(self, start=None, end=None):
+        """Index bounds (i, j) of the records that may overlap [start, end) ms."""
+        i = 0 if start is None else int(np.searchsorted(self.records['end_max'], start, side='right'))
+        j = len(self.records) if end is None else int(np.searchsorted(self.records['start'], end, side='left'))
+        return i, max(i, j)
+
+    def iter_range(self, start=None, end=None):
+        """Yield (start_ms, end_ms, speaker, text) of the segments overlapping [start, end) ms."""
+        i, j = self.range(start, end)
+        window = self.records[i:j]
+        for seg_start, seg_end, speaker, _, text_start, text_end in window.tolist():
+            if start is not None and seg_end <= start:
+                continue
+            name = self.speakers[speaker] if speaker != NO_SPEAKER else None
+            yield seg_start, seg_end, name, self.text[text_start:text_end].decode('utf-8')
+
+    def close(self):
+        if isinstance(self.text, mmap.mmap):
+            self.text.close()
+        self.text_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def format_segments(segments, as_csv=False):
+    """Render (start_ms, end_ms, speaker, text) tuples as JSON lines or CSV rows, one string each."""
+    for start, end, speaker, text in segments:
+        if as_csv:
+            row = io.StringIO()
+            csv.writer(row).writerow([start, end, speaker or "", text])
+            yield row.getvalue()
+        else:
+            yield json.dumps({"start": start, "end": end, "speaker": speaker, "text": text}) + "\n"
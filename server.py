@@ -3,14 +3,20 @@ import os
 import re
 import subprocess
 import uuid
-from asyncio.subprocess import PIPE
 from datetime import timedelta
 
 from flask import (Flask, Response, redirect, render_template, request,
                    send_file, stream_with_context)
 from flask_cors import CORS
 
-from speaker_diff import StandardizeOutput
+from config import JOB_CLIENT_HEADER
+from fetcher import get_fetcher
+from metrics import render as render_metrics
+from probe import is_whisper_pcm, is_whisper_wav, probe
+from scheduler import QueueFullError, get_scheduler
+from speaker_diff import StandardizeOutput, get_diarization_engine
+from storage import get_storage
+from whisper_pool import get_pool
 from whisperlog import setup_logger
 
 app = Flask("PODV2T")
@@ -19,9 +25,6 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=60)
 CORS(app, send_wildcard=True, resources={r"/": {"origins": ""}})
 
 BASE_PATH = os.getcwd()
-MODELS_PATH = os.path.join(BASE_PATH, 'models')
-MODEL_PATH = os.path.join(MODELS_PATH, 'ggml-model-whisper-base.en.bin')
-WHISPER_BINARY = os.path.join(BASE_PATH, 'bin', 'main')
 MEDIA_PATH = os.path.join(BASE_PATH, 'media')
 
 log_file = os.path.join(os.getcwd(), 'app.log')
@@ -32,36 +35,15 @@ if not os.path.exists(MEDIA_PATH):
     os.makedirs(MEDIA_PATH)
 
 
-def run_subprocess(args, tempfile):
+def transcribe_audio(wav_file, csv_file, transcript_file):
     try:
-        logger.info("Running subprocess %s", args)
-        proc = subprocess.Popen(args, stdout=subprocess.PIPE)
-        for line in iter(proc.stdout.readline, ''):
-            if not line:
-                break
-            if line.startswith(b"["):
-                line = line.decode("utf8").strip().split("]")[1]
+        with open(transcript_file, "a", encoding="utf-8") as tmp_file:
+            logger.info(f"Transcribing {wav_file} to {csv_file}")
+            for line in get_pool().transcribe(wav_file, csv_file):
+                line = line.split("]", 1)[1]
                 logger.info("line: %s", line)
-                tempfile.write(line)
+                tmp_file.write(line)
                 yield f"{line}"
-            else:
-                continue
-    except Exception as e:
-        logger.error("An error occurred while running subprocess %s: %s", args, e)
-    finally:
-        if proc:
-            logger.info("Terminating subprocess")
-            proc.terminate()
-
-
-def transcribe_audio(wav_file, csv_file):
-    args = [WHISPER_BINARY, "-m", MODEL_PATH, "-ocsv", "-f", wav_file, "-of", csv_file]
-    try:
-        with open(os.path.join(MEDIA_PATH, f'transcript_{uuid.uuid4()}.txt'), "a", encoding="utf-8") as tmp_file:
-            logger.info(f"Transcribing {wav_file} to {csv_file}")
-            logger.debug(f"Running command: {' '.join(args)}")
-            logger.debug("Command output:")
-            yield from run_subprocess(args, tmp_file)
     except Exception as e:
         logger.error("An error occurred while transcribing audio for file %s: %s", wav_file, e)
         raise  # This will raise the exception to the calling function
@@ -69,19 +51,46 @@ def transcribe_audio(wav_file, csv_file):
         logger.info("Transcription complete")
 
 
-def transcript_generator(uuid_str):
+def job_outputs(uuid_str):
+    return [
+        f"{MEDIA_PATH}/{name}"
+        for name in (f"transcript_{uuid_str}.txt", f"{uuid_str}.csv", f"{uuid_str}.rttm", f"{uuid_str}.fo.txt")
+    ]
+
+
+def transcribe_and_diarize(job, wav_file_path, csv_file_path, transcript_file_path, rttm_file_path):
+    """
+    Transcribe the WAV, diarizing it alongside when a diarize slot is free and
+    after transcription otherwise; returns the StandardizeOutput to merge.
+    """
+    slot = job.stage_slot("diarize", blocking=False)
+    with get_diarization_engine().alongside(slot, wav_file_path, rttm_file_path) as diarization:
+        with job.stage_slot("transcribe"):
+            yield from transcribe_audio(wav_file_path, csv_file_path, transcript_file_path)
+        if diarization is not None:
+            diarization.result()
+            return StandardizeOutput(wav_file_path=wav_file_path, csv_file_path=csv_file_path)
+    # no RTTM yet, so StandardizeOutput diarizes now
+    with job.stage_slot("diarize"):
+        return StandardizeOutput(wav_file_path=wav_file_path, csv_file_path=csv_file_path)
+
+
+def transcript_generator(uuid_str, job):
     temp_dir = "media"
     base_file_name = f"{temp_dir}/{uuid_str}"
     wav_file_path = f"{base_file_name}.wav"
     csv_file_path = f"{MEDIA_PATH}/{uuid_str}.csv"
+    transcript_file_path = f"{MEDIA_PATH}/transcript_{uuid_str}.txt"
 
+    get_storage().open(uuid_str)
     try:
         yield "Transcribing audio...\n"
-        with open(os.path.join(temp_dir, f'transcript_{uuid.uuid4()}.txt'), "a", encoding="utf-8") as tmp_file:
-            yield from transcribe_audio(wav_file_path, csv_file_path)
-        speaker_diar = StandardizeOutput(wav_file_path=wav_file_path, csv_file_path=csv_file_path)
-        speaker_diar.get_standardized_output()
-        yield f"Speaker diff output:\n{speaker_diar.final_output}\n"
+        speaker_diar = yield from transcribe_and_diarize(
+            job, wav_file_path, csv_file_path, transcript_file_path, f"{base_file_name}.rttm"
+        )
+        yield "Speaker diff output:\n"
+        for line in speaker_diar.iter_standardized_output():
+            yield f"{line}\n"
     except Exception as e:
         logger.error("An error occurred while transcribing audio for file %s: %s", uuid_str, e)
         raise  # This will raise the exception to the calling function
@@ -90,17 +99,25 @@ def transcript_generator(uuid_str):
     finally:
         if os.path.exists(wav_file_path):
             os.remove(wav_file_path)
-        if os.path.exists(csv_file_path):
-            os.remove(csv_file_path)
-        with open(os.path.join(temp_dir, f'transcript_{uuid.uuid4()}.txt'), "a", encoding="utf-8") as tmp_file:
-            tmp_file.write("\n")
+        get_storage().close(uuid_str, job_outputs(uuid_str))
+
+
+def submit_and_stream(runner, description):
+    try:
+        job = get_scheduler().submit(
+            runner, description, client=(JOB_CLIENT_HEADER and request.headers.get(JOB_CLIENT_HEADER)) or request.remote_addr
+        )
+    except QueueFullError as e:
+        logger.warning("Rejecting job %s: %s", description, e)
+        return Response(f"Server busy, try again later: {e}", status=429)
+    return Response(stream_with_context(job.iter_events()), headers={'X-Job-Id': job.id})
 
 
 @app.route('/transcribe', methods=["GET", "POST"])
 def transcription():
     gen_uuid_str = request.query_string.split(b'=')[1].decode('utf-8').split('.')[0]
     logger.info(f"gen_uuid_str: {gen_uuid_str}")
-    return Response(stream_with_context(transcript_generator(gen_uuid_str)))
+    return submit_and_stream(lambda job: transcript_generator(gen_uuid_str, job), gen_uuid_str)
 
 
 @app.route('/', methods=["GET", "POST"])
@@ -117,29 +134,22 @@ async def upload_file():
             file_name = file.filename
             ext = re.search(r'\.([a-zA-Z0-9]+)$', file_name).group(1)
             uuid_str = str(uuid.uuid4())
-            file_new = f"{uuid_str}.{ext}"
+            # keep the upload's name apart from the .wav it is converted to
+            file_new = f"{uuid_str}.src.{ext}"
             file_converted = f"{uuid_str}.wav"
             file.save(os.path.join('media', file_new))
             logger.info("\033[43mSAVED %s to %s!\033[0m", file_name, file_new)
 
-            p1 = await asyncio.create_subprocess_exec(
-                "ffprobe",
-                "-v",
-                "error",
-                "-select_streams",
-                "a:0",
-                "-show_entries",
-                "stream=codec_name:stream_tags=language",
-                "-of",
-                "default=noprint_wrappers=1:nokey=1",
-                f'media/{file_new}',
-                stdout=PIPE,
-            )
-            codec = await p1.stdout.read()
-            codec = codec.decode("utf8").strip()
-            logger.info("codec is %s", codec)
-            if codec != 'pcm_mulaw':
+            info = await asyncio.to_thread(probe, f'media/{file_new}')
+            logger.info("probed %s", info)
+            if is_whisper_wav(info):
+                os.rename(f"media/{file_new}", f"media/{file_converted}")
+            else:
                 logger.info('CONVERTING FILE TO WAV....')
+                if is_whisper_pcm(info):
+                    codec_args = ["-acodec", "copy"]
+                else:
+                    codec_args = ["-ar", "16000", "-ac", "1", "-acodec", "pcm_s16le"]
                 process_convert = await asyncio.create_subprocess_exec(
                     "ffmpeg",
                     "-loglevel",
@@ -147,14 +157,7 @@ async def upload_file():
                     "-i",
                     f"media/{file_new}",
                     "-y",
-                    "-probesize",
-                    "32",
-                    "-ar",
-                    "16000",
-                    "-ac",
-                    "1",
-                    "-acodec",
-                    "pcm_s16le",
+                    *codec_args,
                     f"media/{file_converted}",
                 )
                 await process_convert.communicate()
@@ -169,90 +172,72 @@ async def upload_file():
 
 @app.route('/url', methods=["GET", "POST"])
 def tr_url():
-    def gen():
-        source_url = request.form.get('url')
+    source_url = request.form.get('url')
+
+    def gen(job):
         temp_dir = os.path.join(os.getcwd(), 'media')
         if not os.path.exists(temp_dir):
             os.mkdir(temp_dir)
 
         uuid_str = str(uuid.uuid4())
         base_file_name = f"{temp_dir}/{uuid_str}"
-        yield f"Downloading media.... {source_url}"
-        subprocess.run(
-            [
-                "yt-dlp",
-                "-f",
-                "bestaudio[ext=m4a]/best[ext=mp4]/best",
-                "--xattrs",
-                f"{source_url}",
-                "-o",
-                f"{base_file_name}.mp4",
-            ]
-        )
-        yield "Extracting Audio and Resampling..."
-        logger.info("Extracting audio and resampling...")
-        subprocess.run(
-            [
-                "ffmpeg",
-                "-i",
-                f"{base_file_name}.mp4",
-                "-hide_banner",
-                "-loglevel",
-                "error",
-                "-ar",
-                "16000",
-                "-ac",
-                "1",
-                "-c:a",
-                "pcm_s16le",
-                "-y",
-                f"{base_file_name}.wav",
-            ]
-        )
-        logger.info("Transcribing...")
-        yield "Transcribing audio..."
-        proc = subprocess.Popen(
-            [
-                WHISPER_BINARY,
-                "-m",
-                MODEL_PATH,
-                "-ocsv",
-                "-f",
-                f"{base_file_name}.wav",
-                "-t",
-                "8",
-                "-of",
-                f"media/{uuid_str}",
-            ],
-            stdout=subprocess.PIPE,
-        )
-        transcript_file = open(f"{temp_dir}/transcript_{uuid_str}.txt", "a", encoding="utf-8")
-
-        # Generator for the transcript
-        for line in iter(proc.stdout.readline, ''):
-            if not line:
-                yield f"{uuid_str}.csv"
-                break
-            if line.startswith(b"["):
-                line = line.decode("utf8").strip().split("]")[1]
-                transcript_file.write(line)
-                yield f"{line}"
-            else:
-                continue
-        # Run speaker_diff
         wav_file_path = f"{base_file_name}.wav"
         csv_file_path = f"{base_file_name}.csv"
-        speaker_diar = StandardizeOutput(wav_file_path=wav_file_path, csv_file_path=csv_file_path)
-        speaker_diar.get_standardized_output()
+        get_storage().open(uuid_str)
+        try:
+            yield f"Downloading media.... {source_url}"
+            with job.stage_slot("download"):
+                get_fetcher().submit(source_url, f"{base_file_name}.mp4").result()
+            yield "Extracting Audio and Resampling..."
+            logger.info("Extracting audio and resampling...")
+            with job.stage_slot("resample"):
+                subprocess.run(
+                    [
+                        "ffmpeg",
+                        "-i",
+                        f"{base_file_name}.mp4",
+                        "-hide_banner",
+                        "-loglevel",
+                        "error",
+                        "-ar",
+                        "16000",
+                        "-ac",
+                        "1",
+                        "-c:a",
+                        "pcm_s16le",
+                        "-y",
+                        wav_file_path,
+                    ]
+                )
+            # the download is only needed to produce the WAV
+            os.remove(f"{base_file_name}.mp4")
+            logger.info("Transcribing...")
+            yield "Transcribing audio..."
+            speaker_diar = yield from transcribe_and_diarize(
+                job, wav_file_path, csv_file_path, f"{temp_dir}/transcript_{uuid_str}.txt",
+                f"{base_file_name}.rttm",
+            )
+            yield f"{uuid_str}.csv"
+            for line in speaker_diar.iter_standardized_output():
+                yield f"{line}\n"
+        finally:
+            for path in (f"{base_file_name}.mp4", wav_file_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            get_storage().close(uuid_str, job_outputs(uuid_str))
+
+    return submit_and_stream(gen, source_url)
+
 
-    return Response(stream_with_context(gen()))
+@app.route('/metrics', methods=["GET"])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain')
 
 
 @app.route('/download/<transcription_type>/<uuid_str>', methods=["GET"])
 def download_file(uuid_str, transcription_type):
     temp_dir = os.path.join(os.getcwd(), 'media')
-    if transcription_type == "w":
-        return send_file(f"{temp_dir}/{uuid_str}.wav", as_attachment=True)
+    get_storage().touch(uuid_str)
     if transcription_type == "f":
         return send_file(f"{temp_dir}/transcript_{uuid_str}.txt", as_attachment=True)
     if transcription_type == "x":
@@ -270,6 +255,8 @@ def styles():
 
 if __name__ == '__main__':
     logger.info('Starting server...')
+    get_pool()
+    get_diarization_engine().warm_up()
     port = int(os.environ.get('PORT') if os.environ.get('PORT') is not None else 8833)
     app.run(debug=False, port=port)
 
@@ -1,12 +1,137 @@
-import csv
-import math
 import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 from diart import OnlineSpeakerDiarization
 from diart.inference import RealTimeInference, RTTMWriter
 from diart.sinks import RTTMWriter
 from diart.sources import FileAudioSource
 
+from config import DIARIZATION_BATCH_SIZE, DIARIZATION_MODE, DIARIZATION_WORKERS, LIVE_MAX_SESSIONS, SAMPLE_RATE
+from search_index import index_writer
+from segment_store import SegmentWriter, csv_text, iter_csv_rows
+from speaker_index import merge_speakers, shift_rttm, sorted_rttm_turns
+from utils import logger
+
+
+class DiarizationEngine:
+		"""
+		Process-wide pool of diart pipelines.
+
+		Loading OnlineSpeakerDiarization pulls in the segmentation and embedding
+		models, so pipelines are built lazily (at most `size` of them) and then
+		handed out to one request at a time and reset between files.
+		"""
+
+		def __init__(self, size=DIARIZATION_WORKERS):
+				self.size = size
+				self.created = 0
+				self.idle = queue.Queue()
+				self.lock = threading.Lock()
+				self.executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="diarization")
+
+		def acquire(self, blocking=True):
+				"""A pipeline for one request; with `blocking=False`, None when all `size` are in use."""
+				with self.lock:
+						if self.idle.empty() and self.created < self.size:
+								self.created += 1
+								return OnlineSpeakerDiarization()
+				try:
+						return self.idle.get(block=blocking)
+				except queue.Empty:
+						return None
+
+		def release(self, pipeline):
+				self.idle.put(pipeline)
+
+		def warm_up(self):
+				"""Load one pipeline now so the first request doesn't pay for it."""
+				self.release(self.acquire())
+
+		def diarize(self, wav_file_path, rttm_file_path, mode=DIARIZATION_MODE, offset=0.0):
+				"""
+				Write the RTTM for a WAV file. In 'offline' mode the file's chunks are fed
+				to the pipeline DIARIZATION_BATCH_SIZE at a time, so segmentation and
+				embeddings run batched; 'realtime' processes one chunk per step as a
+				live source would. Turns are shifted by `offset` seconds, where the WAV
+				starts in the original media.
+				"""
+				if mode not in ("offline", "realtime"):
+						raise ValueError(f"Unknown diarization mode {mode}")
+				pipeline = self.acquire()
+				try:
+						pipeline.reset()
+						source = FileAudioSource(wav_file_path, SAMPLE_RATE)
+						if mode == "offline":
+								inference = RealTimeInference(
+										pipeline,
+										source,
+										batch_size=DIARIZATION_BATCH_SIZE,
+										do_profile=False,
+										do_plot=False,
+										show_progress=False,
+								)
+						else:
+								inference = RealTimeInference(pipeline, source, do_plot=False)
+						inference.attach_observers(RTTMWriter(source.uri, rttm_file_path))
+						prediction = inference()
+				finally:
+						self.release(pipeline)
+				if offset:
+						shift_rttm(rttm_file_path, offset)
+				return prediction
+
+		def submit(self, wav_file_path, rttm_file_path, mode=DIARIZATION_MODE, offset=0.0):
+				"""
+				Diarize on a background thread and return a Future, so diarization can
+				run while whisper is still transcribing the same WAV. Callers take their
+				scheduler slot on their own thread before submitting; the executor runs
+				work in arrival order.
+				"""
+				return self.executor.submit(self.diarize, wav_file_path, rttm_file_path, mode, offset)
+
+		@contextmanager
+		def alongside(self, slot, wav_file_path, rttm_file_path, mode=DIARIZATION_MODE, offset=0.0):
+				"""
+				Diarize in the background while the body runs, e.g. transcribes the same
+				WAV, if `slot` (a non-blocking stage slot, entered on the caller's thread)
+				is free. Yields the Future, or None when no slot was free and diarization
+				has to wait its turn. The slot is held until diart is done with the WAV.
+				"""
+				with slot as acquired:
+						if not acquired:
+								yield None
+								return
+						future = self.submit(wav_file_path, rttm_file_path, mode, offset)
+						try:
+								yield future
+						finally:
+								future.exception()
+
+
+_engine = None
+_live_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_diarization_engine():
+		global _engine
+		with _engine_lock:
+				if _engine is None:
+						_engine = DiarizationEngine()
+				return _engine
+
+
+def get_live_diarization_engine():
+		"""Pipelines for live sessions, one per session, so a session never waits on file jobs or they on it."""
+		global _live_engine
+		with _engine_lock:
+				if _live_engine is None:
+						_live_engine = DiarizationEngine(size=LIVE_MAX_SESSIONS)
+				return _live_engine
+
 
 class StandardizeOutput:
 		"""
@@ -15,57 +140,41 @@ class StandardizeOutput:
 		standardized output rttm file and standard output.
 		"""
 
-		def __init__(self, csv_file_path, wav_file_path):
-				self.rttm_map = []
-				self.rttm_file_path = f"{wav_file_path.split('.')[0]}.rttm"
-				self.final_output = f"{wav_file_path.split('.')[0]}.fo.txt"
+		def __init__(self, csv_file_path, wav_file_path, mode=DIARIZATION_MODE, offset=0.0):
+				# outputs sit next to the csv, the wav may live in scratch space
+				self.rttm_file_path = f"{os.path.splitext(csv_file_path)[0]}.rttm"
+				self.final_output = f"{os.path.splitext(csv_file_path)[0]}.fo.txt"
 				self.csv_file_path = csv_file_path
 				self.wav_file_path = wav_file_path
-				self.speaker_map = {}
-				self.completed_diarization = []
-				self.completed_diarization = []
 				if not os.path.exists(self.rttm_file_path):
-						self.pipeline = OnlineSpeakerDiarization()
-						self.file = FileAudioSource(wav_file_path, 16000)
-						self.inference = RealTimeInference(self.pipeline, self.file, do_plot=False)
-						self.inference.attach_observers(RTTMWriter(self.file.uri, self.rttm_file_path))
-						self.prediction = self.inference()
+						self.prediction = get_diarization_engine().diarize(wav_file_path, self.rttm_file_path, mode, offset)
 				else:
-						print(f"{self.rttm_file_path} already exists, skipping diarization")
+						logger.debug("%s already exists, skipping diarization", self.rttm_file_path)
+
+		def iter_standardized_output(self):
+				"""
+				Merge the whisper CSV with the RTTM in one streaming pass, writing each
+				speaker-labelled line to the final output as it is produced and yielding it.
+				The same segments go to the columnar segment store and the search index.
+				"""
+				base_file_name = os.path.splitext(self.csv_file_path)[0]
+				with open(self.csv_file_path) as f, open(self.final_output, 'w') as final_doc:
+						with SegmentWriter(base_file_name) as store, index_writer(os.path.basename(base_file_name)) as index:
+								segments = iter_csv_rows(f)
+								for start, end, speaker_name, raw in merge_speakers(segments, sorted_rttm_turns(self.rttm_file_path)):
+										line = f"{start},\t{end},\t{speaker_name},\t{' , '.join(raw.split(','))}"
+										final_doc.write(f"{line}\n")
+										text = csv_text(raw)
+										store.append(start, end, speaker_name, text)
+										index.append(start, end, speaker_name, text)
+										yield line
 
 		def get_standardized_output(self):
 				"""
 				This method returns the standardized output of the diarization system.
 				"""
-				with open(self.rttm_file_path) as f:
-						rttm_lines = f.readlines()
-						for rttm_line in rttm_lines:
-								parts = rttm_line.strip().split()
-								self.speaker_map[float(parts[3]), float(parts[4])] = parts[7]
-
-				for time_range, name in self.speaker_map.items():
-						st_rttm = math.ceil(time_range[0] * 1000)
-						et_rttm = math.ceil(time_range[1] * 1000 + st_rttm)
-						self.rttm_map.append([st_rttm, et_rttm, name])
-
-				with open(self.final_output, 'a+') as final_doc:
-						with open(self.csv_file_path) as f:
-								reader = csv.reader(f, quoting=csv.QUOTE_NONE)
-								for z in reader:
-										st_csv = int(z[0])
-										min_diff = float('inf')
-										speaker_name = None
-										for rttm_entry in self.rttm_map:
-												st_rttm = rttm_entry[0]
-												diff = abs(st_csv - st_rttm)
-												if diff < min_diff:
-														min_diff = diff
-														speaker_name = rttm_entry[2]
-										self.completed_diarization.append([z[0], z[0], speaker_name, ' , '.join(z[2:])])
-										final_doc.write(f"{z[0]},\t{z[1]},\t{speaker_name},\t{' , '.join(z[2:])}\n")
-										print(f"{z[0]},\t{z[1]},\t{speaker_name},\t{' , '.join(z[2:])}\n")
-										# final_doc.write(f"[{z[0]} - {z[0]}]\t{speaker_name}\t{' , '.join(z[2:])}\n")
-				# print(self.completed_diarization)
+				for _ in self.iter_standardized_output():
+						pass
 				return f"File {self.final_output}"
 
 
@@ -0,0 +1,136 @@
+import math
+import os
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+class SpeakerIndex:
+    """
+    Sorted, array-backed index over RTTM speaker turns.
+
+    Turns are stored as parallel arrays of start/end times (ms) sorted by start,
+    together with a running maximum of end times. A lookup bisects both arrays to
+    find the window of turns that can overlap a segment, so assigning a speaker is
+    O(log n + k) where k is the number of turns overlapping the segment.
+    """
+
+    def __init__(self, turns):
+        turns = sorted(turns, key=lambda turn: turn[0])
+        self.starts = array('q', (turn[0] for turn in turns))
+        self.ends = array('q', (turn[1] for turn in turns))
+        self.speakers = [turn[2] for turn in turns]
+        self.max_ends = array('q')
+        running_max = -1
+        for end in self.ends:
+            running_max = max(running_max, end)
+            self.max_ends.append(running_max)
+
+    @classmethod
+    def from_rttm(cls, rttm_file_path):
+        return cls(iter_rttm_turns(rttm_file_path))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def speaker_at(self, start, end):
+        """
+        Return the speaker whose turns overlap [start, end) the most.
+
+        Falls back to the turn with the nearest start time when no turn overlaps
+        the segment, which matches the previous nearest-start behaviour.
+        """
+        if not self.starts:
+            return None
+        lo = bisect_right(self.max_ends, start)
+        hi = bisect_left(self.starts, max(end, start + 1))
+        overlaps = {}
+        for i in range(lo, hi):
+            overlap = min(end, self.ends[i]) - max(start, self.starts[i])
+            if overlap > 0:
+                overlaps[self.speakers[i]] = overlaps.get(self.speakers[i], 0) + overlap
+        if overlaps:
+            return max(overlaps, key=overlaps.get)
+        return self.nearest_speaker(start)
+
+    def nearest_speaker(self, start):
+        i = bisect_left(self.starts, start)
+        candidates = [j for j in (i - 1, i) if 0 <= j < len(self.starts)]
+        best = min(candidates, key=lambda j: abs(self.starts[j] - start))
+        return self.speakers[best]
+
+
+def iter_rttm_turns(rttm_file_path):
+    """Yield (start_ms, end_ms, speaker) for each RTTM line, in file order."""
+    with open(rttm_file_path) as f:
+        for rttm_line in f:
+            parts = rttm_line.strip().split()
+            if len(parts) < 8:
+                continue
+            st_rttm = math.ceil(float(parts[3]) * 1000)
+            et_rttm = math.ceil(float(parts[4]) * 1000 + st_rttm)
+            yield st_rttm, et_rttm, parts[7]
+
+
+def sorted_rttm_turns(rttm_file_path):
+    """
+    Turns of an RTTM sorted by start, as `merge_speakers` needs them. diart
+    writes them in order, so this normally streams the file after one pass
+    checking the order; an unsorted file is read into memory and sorted.
+    """
+    previous = None
+    for start, _, _ in iter_rttm_turns(rttm_file_path):
+        if previous is not None and start < previous:
+            return iter(sorted(iter_rttm_turns(rttm_file_path), key=lambda turn: turn[0]))
+        previous = start
+    return iter_rttm_turns(rttm_file_path)
+
+
+def shift_rttm(rttm_file_path, seconds):
+    """Rewrite an RTTM in place with every turn onset moved by `seconds`."""
+    shifted_file_path = f"{rttm_file_path}.shifted"
+    with open(rttm_file_path) as src, open(shifted_file_path, 'w') as dst:
+        for rttm_line in src:
+            parts = rttm_line.split()
+            if len(parts) >= 8:
+                parts[3] = f"{float(parts[3]) + seconds:.3f}"
+                rttm_line = " ".join(parts) + "\n"
+            dst.write(rttm_line)
+    os.replace(shifted_file_path, rttm_file_path)
+
+
+def merge_speakers(segments, turns):
+    """
+    Single-pass merge of time-sorted segments with time-sorted speaker turns.
+
+    `segments` yields (start_ms, end_ms, payload) and `turns` yields
+    (start_ms, end_ms, speaker); yields (start_ms, end_ms, speaker, payload).
+    Only the turns that can still overlap upcoming segments are kept, so memory
+    stays constant however long the recording is. Speakers are chosen by
+    overlap, falling back to the nearest turn start like SpeakerIndex.
+    Turns out of order would silently get the wrong speakers, so they raise
+    ValueError; `sorted_rttm_turns` reads an RTTM in the required order.
+    """
+    turns = iter(turns)
+    pending = next(turns, None)
+    active = []
+    last_started = None
+    for start, end, payload in segments:
+        while pending is not None and pending[0] < max(end, start + 1):
+            active.append(pending)
+            last_started = pending
+            pending = next(turns, None)
+            if pending is not None and pending[0] < last_started[0]:
+                raise ValueError(f"speaker turns out of order: {pending[0]} ms after {last_started[0]} ms")
+        active = [turn for turn in active if turn[1] > start]
+
+        overlaps = {}
+        for turn_start, turn_end, speaker in active:
+            overlap = min(end, turn_end) - max(start, turn_start)
+            if overlap > 0:
+                overlaps[speaker] = overlaps.get(speaker, 0) + overlap
+        if overlaps:
+            speaker = max(overlaps, key=overlaps.get)
+        else:
+            candidates = [turn for turn in (last_started, pending) if turn is not None]
+            speaker = min(candidates, key=lambda turn: abs(turn[0] - start))[2] if candidates else None
+        yield start, end, speaker, payload
@@ -0,0 +1,166 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from config import MEDIA_MAX_BYTES, MEDIA_PATH, MEDIA_TTL_SECONDS, SEARCH_INDEX_ENABLED, STORAGE_INDEX_PATH
+from search_index import get_search_index
+from utils import logger
+
+# job outputs: media/<uuid>.csv, media/transcript_<uuid>.txt, media/batch_<uuid>.jsonl, ...
+OUTPUT_PATTERN = re.compile(
+    r"^(?:transcript_|batch_)?([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})"
+    r"\.(?:csv|rttm|fo\.txt|txt|jsonl|seg\.npy|seg\.bin|seg\.json)$"
+)
+
+
+class StorageManager:
+    """
+    Index of the files each job leaves in media/, kept in sqlite.
+
+    A job is opened when it starts and closed with the paths of its outputs;
+    while open it is never evicted. Opens nest, so a caller that still reads
+    a job's outputs can keep it pinned past the job's own close. Closing a job (and `enforce`) removes the
+    jobs not accessed for `ttl` seconds, then the least recently accessed ones
+    until the indexed files fit in `max_bytes`. Downloads `touch` their job.
+    Callers registered with `on_evict` are told which jobs went.
+    """
+
+    def __init__(self, root=MEDIA_PATH, max_bytes=MEDIA_MAX_BYTES, ttl=MEDIA_TTL_SECONDS, index_path=STORAGE_INDEX_PATH):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # job id -> number of opens not closed yet
+        self.active = {}
+        self.evict_listeners = []
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+        self.db = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, accessed REAL, bytes INTEGER)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, job TEXT, bytes INTEGER)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_accessed ON jobs (accessed)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS files_job ON files (job)")
+
+    def open(self, job_id):
+        with self.lock:
+            self.active[job_id] = self.active.get(job_id, 0) + 1
+
+    def add(self, job_id, paths, accessed=None):
+        """Index the existing files among `paths` under `job_id`."""
+        files = [(path, os.path.getsize(path)) for path in paths if os.path.isfile(path)]
+        with self.lock:
+            self.db.execute("BEGIN")
+            self.db.executemany(
+                "INSERT OR REPLACE INTO files (path, job, bytes) VALUES (?, ?, ?)",
+                [(path, job_id, size) for path, size in files],
+            )
+            total = self.db.execute("SELECT COALESCE(SUM(bytes), 0) FROM files WHERE job = ?", (job_id,)).fetchone()[0]
+            self.db.execute(
+                "INSERT OR REPLACE INTO jobs (id, accessed, bytes) VALUES (?, ?, ?)",
+                (job_id, time.time() if accessed is None else accessed, total),
+            )
+            self.db.execute("COMMIT")
+
+    def close(self, job_id, paths=()):
+        """Index a finished job's outputs, make it evictable and enforce the quota."""
+        self.add(job_id, paths)
+        with self.lock:
+            if self.active.get(job_id, 0) > 1:
+                self.active[job_id] -= 1
+            else:
+                self.active.pop(job_id, None)
+        self.enforce()
+
+    def on_evict(self, listener):
+        """Call `listener(job_id)` for every job evicted from now on, outside the lock."""
+        with self.lock:
+            if listener not in self.evict_listeners:
+                self.evict_listeners.append(listener)
+
+    def touch(self, job_id):
+        with self.lock:
+            self.db.execute("UPDATE jobs SET accessed = ? WHERE id = ?", (time.time(), job_id))
+
+    def used_bytes(self):
+        with self.lock:
+            return self.db.execute("SELECT COALESCE(SUM(bytes), 0) FROM jobs").fetchone()[0]
+
+    def enforce(self):
+        with self.lock:
+            expired = []
+            if self.ttl:
+                expired = [
+                    job_id
+                    for job_id, in self.db.execute("SELECT id FROM jobs WHERE accessed < ?", (time.time() - self.ttl,))
+                    if job_id not in self.active
+                ]
+            total = self.db.execute("SELECT COALESCE(SUM(bytes), 0) FROM jobs").fetchone()[0]
+            victims = []
+            if total > self.max_bytes:
+                for job_id, size in self.db.execute("SELECT id, bytes FROM jobs ORDER BY accessed"):
+                    if total <= self.max_bytes:
+                        break
+                    if job_id in self.active:
+                        continue
+                    victims.append(job_id)
+                    total -= size
+            evicted = list(dict.fromkeys(expired + victims))
+            for job_id in evicted:
+                self._evict(job_id)
+            listeners = list(self.evict_listeners)
+        # the search index has its own lock and database; don't hold ours while it writes
+        if SEARCH_INDEX_ENABLED:
+            for job_id in evicted:
+                get_search_index().remove(job_id)
+        for listener in listeners:
+            for job_id in evicted:
+                listener(job_id)
+
+    def _evict(self, job_id):
+        """Remove a job's files and rows, with self.lock held; `enforce` drops it from the search index after."""
+        paths = [path for path, in self.db.execute("SELECT path FROM files WHERE job = ?", (job_id,))]
+        logger.info("Evicting %d files of job %s from %s", len(paths), job_id, self.root)
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.db.execute("BEGIN")
+        self.db.execute("DELETE FROM files WHERE job = ?", (job_id,))
+        self.db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        self.db.execute("COMMIT")
+
+    def adopt(self):
+        """
+        Index job outputs in the media directory that aren't tracked yet, e.g.
+        left by older versions, grouped by their job's uuid. In-flight audio
+        is left alone.
+        """
+        with self.lock:
+            known = {path for path, in self.db.execute("SELECT path FROM files")}
+        owners = {}
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                match = OUTPUT_PATTERN.match(entry.name)
+                if match and entry.is_file() and entry.path not in known:
+                    owners.setdefault(match.group(1), []).append(entry)
+        for job_id, entries in owners.items():
+            self.add(job_id, [entry.path for entry in entries], accessed=max(e.stat().st_mtime for e in entries))
+        if owners:
+            logger.info("Indexed untracked files of %d jobs in %s", len(owners), self.root)
+        self.enforce()
+
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            _storage = StorageManager()
+            _storage.adopt()
+        return _storage
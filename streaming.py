@@ -0,0 +1,219 @@
+import io
+import subprocess
+import threading
+import wave
+from collections import deque
+
+from config import SAMPLE_RATE, STREAM_CHUNK_SECONDS
+from fetcher import format_args
+from utils import logger
+from whisper_pool import get_pool, segment_line, write_csv
+
+# 16-bit mono PCM
+BYTES_PER_SECOND = SAMPLE_RATE * 2
+# bytes per read when copying a download to a file on its way to ffmpeg
+TEE_BLOCK = 1 << 16
+
+
+def wav_bytes(pcm):
+    """Wrap raw s16le mono PCM in a WAV header."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def read_exact(stream, size):
+    """Read `size` bytes from a pipe, returning fewer only at EOF."""
+    parts = []
+    remaining = size
+    while remaining:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+def seek_args(start=None, end=None):
+    """
+    ffmpeg (input, output) arguments limiting decoding to [start, end) seconds.
+    `-ss` goes before `-i` so ffmpeg seeks in the input instead of decoding up
+    to `start`.
+    """
+    input_args = ["-ss", f"{start:.3f}"] if start else []
+    output_args = ["-t", f"{end - (start or 0.0):.3f}"] if end is not None else []
+    return input_args, output_args
+
+
+class PCMPipeline:
+    """
+    Decode a media source to 16 kHz mono PCM on a pipe.
+
+    URL sources are fetched with `yt-dlp -o -` straight into ffmpeg's stdin, so
+    decoding starts with the first downloaded bytes instead of after the whole
+    file has landed in media/. With `download_path`, the downloaded bytes are
+    also written there on their way to ffmpeg, and `downloaded` is set once
+    the whole file has arrived, e.g. for the download cache. `start` and `end`
+    (seconds) limit decoding to that window; chunk offsets stay relative to
+    the start of the media.
+    """
+
+    def __init__(self, url=None, file_path=None, start=None, end=None, download_path=None):
+        if (url is None) == (file_path is None):
+            raise ValueError("PCMPipeline needs exactly one of url or file_path")
+        self.url = url
+        self.file_path = file_path
+        self.start_seconds = start
+        self.end_seconds = end
+        self.download_path = download_path
+        self.downloaded = False
+        self.procs = []
+        self.tee = None
+
+    def start(self):
+        input_args, output_args = seek_args(self.start_seconds, self.end_seconds)
+        decode_args = [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            *input_args,
+            "-i",
+            "pipe:0" if self.url else self.file_path,
+            *output_args,
+            "-f",
+            "s16le",
+            "-ar",
+            str(SAMPLE_RATE),
+            "-ac",
+            "1",
+            "pipe:1",
+        ]
+        if self.url:
+            # m4a/mp4 often keep their index at the end of the file, which a pipe
+            # can't seek to, so take whatever audio stream streams best
+            download = subprocess.Popen(
+                ["yt-dlp", *format_args(), "--no-playlist", "--quiet", "-o", "-", self.url],
+                stdout=subprocess.PIPE,
+            )
+            if self.download_path:
+                decode = subprocess.Popen(decode_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+                self.tee = threading.Thread(
+                    target=self._tee, args=(download.stdout, decode.stdin), name="stream-tee", daemon=True
+                )
+                self.tee.start()
+            else:
+                decode = subprocess.Popen(decode_args, stdin=download.stdout, stdout=subprocess.PIPE)
+                download.stdout.close()
+            self.procs = [download, decode]
+        else:
+            self.procs = [subprocess.Popen(decode_args, stdout=subprocess.PIPE)]
+        return self
+
+    def chunks(self, chunk_seconds=STREAM_CHUNK_SECONDS):
+        """Yield (offset_ms, pcm) chunks of `chunk_seconds` as ffmpeg produces them."""
+        chunk_bytes = chunk_seconds * BYTES_PER_SECOND
+        stdout = self.procs[-1].stdout
+        start_ms = round((self.start_seconds or 0) * 1000)
+        offset = 0
+        try:
+            while True:
+                pcm = read_exact(stdout, chunk_bytes)
+                if not pcm:
+                    break
+                yield start_ms + offset * 1000 // BYTES_PER_SECOND, pcm
+                offset += len(pcm)
+            self.close(check=True)
+        finally:
+            self.close()
+
+    def _tee(self, src, dst):
+        """Copy the download to ffmpeg and `download_path`; stops early if ffmpeg is done with its window."""
+        complete = True
+        with src, open(self.download_path, 'wb') as f:
+            while block := src.read(TEE_BLOCK):
+                f.write(block)
+                try:
+                    dst.write(block)
+                except (BrokenPipeError, ValueError):
+                    complete = False
+                    break
+        try:
+            dst.close()
+        except BrokenPipeError:
+            pass
+        self.downloaded = complete
+
+    def close(self, check=False):
+        cut_off = []
+        if check and self.url and self.end_seconds is not None and self.procs[-1].wait() == 0:
+            # ffmpeg stops reading once the window is decoded, so yt-dlp is cut off mid-download
+            # (or dies on the closed pipe); that isn't a failure, but the download is partial
+            cut_off = self.procs[:-1]
+        for proc in self.procs:
+            if check and proc not in cut_off:
+                proc.wait()
+            elif proc.poll() is None:
+                proc.terminate()
+                proc.wait()
+        if self.tee is not None:
+            self.tee.join()
+            self.tee = None
+        failed = [proc.args[0] for proc in self.procs if proc.returncode != 0 and proc not in cut_off]
+        if failed or cut_off:
+            self.downloaded = False
+        self.procs = []
+        if check and failed:
+            raise RuntimeError(f"{', '.join(failed)} failed while streaming audio")
+
+
+class ChunkedTranscriber:
+    """
+    Transcribe a stream of PCM chunks on the worker pool.
+
+    Chunks are submitted as soon as they arrive and at most `max_in_flight` are
+    outstanding, so several chunks of one source are transcribed in parallel
+    while results are still yielded in timeline order.
+    """
+
+    def __init__(self, pool=None, max_in_flight=None):
+        self.pool = pool or get_pool()
+        self.max_in_flight = max_in_flight or self.pool.size * 2
+
+    def transcribe(self, chunks, csv_file_path=None):
+        """Yield whisper-style lines for `chunks` of (offset_ms, raw PCM bytes or WAV path)."""
+        if csv_file_path:
+            open(csv_file_path, 'w').close()
+        in_flight = deque()
+        for offset, audio in chunks:
+            if isinstance(audio, (bytes, bytearray, memoryview)):
+                audio = wav_bytes(audio)
+            in_flight.append(self.pool.submit(audio, offset=offset))
+            while in_flight and (in_flight[0].done() or len(in_flight) >= self.max_in_flight):
+                yield from self._drain(in_flight.popleft(), csv_file_path)
+        while in_flight:
+            yield from self._drain(in_flight.popleft(), csv_file_path)
+
+    def _drain(self, future, csv_file_path):
+        segments = future.result()
+        if csv_file_path:
+            write_csv(segments, csv_file_path, mode='a')
+        for segment in segments:
+            yield segment_line(segment)
+
+
+def tee_to_wav(chunks, wav_file_path):
+    """Pass chunks through while also writing them to a WAV for diarization."""
+    with wave.open(wav_file_path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        for offset, pcm in chunks:
+            w.writeframes(pcm)
+            yield offset, pcm
+    logger.info("Wrote %s", wav_file_path)
@@ -0,0 +1,192 @@
+"""
+Replay a WAV into a LiveSession as a live stream, against a fake whisper pool
+and, for diarization, a fake diart pipeline fed through the session's real
+QueueAudioSource.
+
+    python -m unittest discover tests
+"""
+import io
+import os
+import queue
+import unittest
+import wave
+from concurrent.futures import Future
+from types import SimpleNamespace
+from unittest import mock
+
+import live
+from live import LiveSession, QueueAudioSource
+from streaming import BYTES_PER_SECOND
+from whisper_pool import Segment
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "live.wav")
+FIXTURE_SECONDS = 6
+FRAME_MS = 100
+# the fake pipeline's speakers: the first half of the fixture is one, the rest another
+SPEAKER_CHANGE_MS = 3000
+
+
+def read_fixture():
+    with wave.open(FIXTURE, 'rb') as wav:
+        return wav.readframes(wav.getnframes())
+
+
+class FakePool:
+    """Answers right away with one segment per whole second of the WAV, named after its position."""
+
+    def __init__(self):
+        self.requests = []
+
+    def submit(self, audio, offset=0):
+        with wave.open(io.BytesIO(audio), 'rb') as wav:
+            duration_ms = wav.getnframes() * 1000 // wav.getframerate()
+        self.requests.append((offset, duration_ms))
+        segments = [
+            Segment(offset + start, offset + min(start + 1000, duration_ms), f"second {(offset + start) // 1000}")
+            for start in range(0, duration_ms, 1000)
+        ]
+        future = Future()
+        future.set_result(segments)
+        return future
+
+
+class FakeAnnotation:
+    def __init__(self, tracks):
+        self.tracks = tracks
+
+    def itertracks(self, yield_label=False):
+        for start, end, speaker in self.tracks:
+            yield SimpleNamespace(start=start, end=end), None, speaker
+
+
+class FakeInference:
+    """
+    Stands in for diart's RealTimeInference: reads the session's source and
+    labels each chunk it receives with the fake speaker for its position.
+    """
+
+    def __init__(self, pipeline, source, **kwargs):
+        self.pipeline = pipeline
+        self.source = source
+        self.observers = []
+        self.position_ms = 0
+
+    def attach_observers(self, *observers):
+        self.observers.extend(observers)
+
+    def __call__(self):
+        self.source.stream = self
+        self.source.read()
+
+    def on_next(self, samples):
+        start = self.position_ms
+        self.position_ms += samples.shape[1] * 1000 // self.source.sample_rate
+        cut = min(max(start, SPEAKER_CHANGE_MS), self.position_ms)
+        tracks = [(a / 1000, b / 1000, speaker) for a, b, speaker in (
+            (start, cut, "speaker0"), (cut, self.position_ms, "speaker1")
+        ) if b > a]
+        for observer in self.observers:
+            observer.on_next(FakeAnnotation(tracks))
+
+    def on_completed(self):
+        for observer in self.observers:
+            observer.on_completed()
+
+
+class FakeEngine:
+    """Hands out `size` fake pipelines, like DiarizationEngine."""
+
+    def __init__(self, size=1):
+        self.idle = queue.Queue()
+        for _ in range(size):
+            self.idle.put(mock.Mock(name="pipeline"))
+
+    def acquire(self, blocking=True):
+        try:
+            return self.idle.get(block=blocking)
+        except queue.Empty:
+            return None
+
+    def release(self, pipeline):
+        self.idle.put(pipeline)
+
+
+class LiveSessionReplayTest(unittest.TestCase):
+    def replay(self, pcm=None, **kwargs):
+        events = []
+        pool = FakePool()
+        kwargs.setdefault("diarize", False)
+        session = LiveSession(events.append, pool=pool, step_seconds=1, **kwargs)
+        pcm = read_fixture() if pcm is None else pcm
+        frame_bytes = BYTES_PER_SECOND * FRAME_MS // 1000
+        for offset in range(0, len(pcm), frame_bytes):
+            session.feed(pcm[offset:offset + frame_bytes])
+        session.finish()
+        return events, pool
+
+    def test_partials_then_finals_then_done(self):
+        events, pool = self.replay(window_seconds=3)
+        kinds = [event["type"] for event in events]
+
+        self.assertEqual(kinds[0], "partial")
+        self.assertEqual(kinds[-1], "done")
+        self.assertEqual(kinds.count("done"), 1)
+        self.assertNotIn("error", kinds)
+        self.assertLess(kinds.index("partial"), kinds.index("final"))
+        # the flush commits what is left: only finals follow the last partial
+        last_partial = len(kinds) - 1 - kinds[::-1].index("partial")
+        self.assertEqual(set(kinds[last_partial + 1:]), {"final", "done"})
+
+        finals = [event for event in events if event["type"] == "final"]
+        seconds = range(FIXTURE_SECONDS)
+        self.assertEqual([(e["start"], e["end"]) for e in finals], [(s * 1000, s * 1000 + 1000) for s in seconds])
+        self.assertEqual([e["text"] for e in finals], [f"second {s}" for s in seconds])
+        # every final segment was shown as a partial first
+        partials = {(e["start"], e["text"]) for e in events if e["type"] == "partial"}
+        self.assertTrue(all((e["start"], e["text"]) in partials for e in finals[:-1]))
+        # each request starts at the committed position, which only moves forward
+        self.assertEqual(sorted(offset for offset, _ in pool.requests), [offset for offset, _ in pool.requests])
+
+    def test_finish_flushes_a_short_stream(self):
+        events, _ = self.replay(pcm=read_fixture()[:BYTES_PER_SECOND])
+        self.assertEqual([event["type"] for event in events], ["partial", "final", "done"])
+
+    @mock.patch.object(live, "RealTimeInference", FakeInference)
+    def test_speakers_reach_final_segments(self):
+        engine = FakeEngine()
+        # a window longer than the stream, so every final comes from the flush, after diarization has caught up
+        events, _ = self.replay(diarize=True, diarization_engine=engine, window_seconds=FIXTURE_SECONDS * 2)
+        kinds = [event["type"] for event in events]
+
+        self.assertNotIn("error", kinds)
+        self.assertIn("speaker", kinds)
+        self.assertLess(kinds.index("partial"), kinds.index("final"))
+        self.assertEqual(kinds[-1], "done")
+        finals = [event for event in events if event["type"] == "final"]
+        self.assertEqual(
+            [(e["start"], e["speaker"]) for e in finals],
+            [(s * 1000, "speaker0" if s * 1000 < SPEAKER_CHANGE_MS else "speaker1") for s in range(FIXTURE_SECONDS)],
+        )
+        # the pipeline goes back to the engine when the session ends
+        self.assertEqual(engine.idle.qsize(), 1)
+
+    def test_no_free_pipeline_falls_back_to_no_speakers(self):
+        events, _ = self.replay(diarize=True, diarization_engine=FakeEngine(size=0), window_seconds=3)
+        self.assertEqual(events[0]["type"], "error")
+        self.assertEqual(events[-1]["type"], "done")
+        self.assertTrue(all(e["speaker"] is None for e in events if e["type"] == "final"))
+
+
+class QueueAudioSourceTest(unittest.TestCase):
+    def test_backlog_is_bounded(self):
+        source = QueueAudioSource("test", max_seconds=1)
+        second = read_fixture()[:BYTES_PER_SECOND]
+        self.assertTrue(source.push(second[:BYTES_PER_SECOND // 2]))
+        self.assertTrue(source.push(second[BYTES_PER_SECOND // 2:]))
+        self.assertFalse(source.push(second[:2]))
+        source.close()
+        self.assertFalse(source.push(second[:2]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+URL sources through PCMPipeline with a stand-in yt-dlp that writes a WAV to
+stdout like `yt-dlp -o -`, and dies on a closed pipe as the real one does.
+Needs ffmpeg on PATH.
+
+    python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from streaming import BYTES_PER_SECOND, PCMPipeline, wav_bytes
+
+SECONDS = 30
+
+FAKE_YT_DLP = """#!{python}
+import sys
+try:
+    with open({wav!r}, 'rb') as f:
+        while block := f.read(4096):
+            sys.stdout.buffer.write(block)
+    sys.stdout.buffer.flush()
+except BrokenPipeError:
+    sys.exit(1)
+"""
+
+
+@unittest.skipIf(shutil.which("ffmpeg") is None, "needs ffmpeg")
+class URLPipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.wav = os.path.join(self.tmp, "episode.wav")
+        with open(self.wav, 'wb') as f:
+            f.write(wav_bytes(bytes(SECONDS * BYTES_PER_SECOND)))
+        bin_dir = os.path.join(self.tmp, "bin")
+        os.mkdir(bin_dir)
+        yt_dlp = os.path.join(bin_dir, "yt-dlp")
+        with open(yt_dlp, 'w') as f:
+            f.write(FAKE_YT_DLP.format(python=sys.executable, wav=self.wav))
+        os.chmod(yt_dlp, 0o755)
+        path = os.environ["PATH"]
+        os.environ["PATH"] = f"{bin_dir}{os.pathsep}{path}"
+        self.addCleanup(os.environ.__setitem__, "PATH", path)
+
+    def stream(self, **kwargs):
+        pipeline = PCMPipeline(url="https://example.com/episode", **kwargs).start()
+        chunks = list(pipeline.chunks(chunk_seconds=1))
+        return pipeline, chunks
+
+    def test_ranged_window_cuts_the_download_off(self):
+        for download_path in (None, os.path.join(self.tmp, "download")):
+            with self.subTest(tee=download_path is not None):
+                pipeline, chunks = self.stream(start=2, end=5, download_path=download_path)
+                self.assertEqual(chunks[0][0], 2000)
+                self.assertEqual(sum(len(pcm) for _, pcm in chunks), 3 * BYTES_PER_SECOND)
+                # the partial download must never reach the download cache
+                self.assertFalse(pipeline.downloaded)
+
+    def test_whole_stream_is_downloaded(self):
+        download_path = os.path.join(self.tmp, "download")
+        pipeline, chunks = self.stream(download_path=download_path)
+        self.assertEqual(sum(len(pcm) for _, pcm in chunks), SECONDS * BYTES_PER_SECOND)
+        self.assertTrue(pipeline.downloaded)
+        with open(download_path, 'rb') as downloaded, open(self.wav, 'rb') as source:
+            self.assertEqual(downloaded.read(), source.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
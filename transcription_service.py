@@ -1,5 +1,4 @@
-from config import MODEL_PATH, WHISPER_BINARY
-from utils import run_subprocess
+from whisper_pool import get_pool
 
 
 class TranscriptionService:
@@ -8,16 +7,6 @@ class TranscriptionService:
         self.csv_file = csv_file
 
     def transcribe_audio(self):
-        args = [
-            WHISPER_BINARY,
-            "-m",
-            MODEL_PATH,
-            "-ocsv",
-            "-f",
-            f"{self.wav_file}",
-            "-t",
-            "8",
-            "-of",
-            f"media/{self.csv_file}",
-        ]  # ,[WHISPER_BINARY, "-m", MODEL_PATH, "-ocsv", "-f", self.wav_file, "-of", self.csv_file]
-        yield from run_subprocess(args)
+        for line in get_pool().transcribe(self.wav_file, f"media/{self.csv_file}"):
+            yield line.split("]", 1)[1].strip()
+        yield "\nEnd of transcript\n"
@@ -1,27 +1,30 @@
+import math
 import os
 import subprocess
 
-from config import LOG_FILE, MEDIA_PATH
+from config import IN_MEMORY_AUDIO, LOG_DEBUG_SAMPLE, LOG_FILE, LOG_FLUSH_INTERVAL, LOG_QUEUED, MEDIA_PATH, SCRATCH_PATH
 from whisperlog import setup_logger
 
-logger = setup_logger('PODV2T', LOG_FILE)
+logger = setup_logger(
+    'PODV2T', LOG_FILE, queued=LOG_QUEUED, flush_interval=LOG_FLUSH_INTERVAL, debug_sample=LOG_DEBUG_SAMPLE
+)
 
 
 def run_subprocess(args):
+    proc = None
     try:
         proc = subprocess.Popen(args, stdout=subprocess.PIPE)
         for line in iter(proc.stdout.readline, b''):
-            logger.info(f"Line: {line}")
             if not line:
                 logger.info("End of transcript")
                 yield "\nEnd of transcript\n"
                 break
             if line.startswith(b"["):
                 line = line.decode("utf8").strip().split("]")[1].strip()
-                logger.info(f"{line}")
+                logger.debug("%s", line)
                 yield f"{line}"
             else:
-                logger.info(f"Skipping line: {line}")
+                logger.debug("Skipping line: %s", line)
                 continue
     except OSError as e:
         # Handle this error, e.g. by logging the failure.
@@ -31,17 +34,57 @@ def run_subprocess(args):
         yield f"Error: {e}"
         return
 
+    except GeneratorExit:
+        # The caller stopped reading before the output ended; stop the process.
+        if proc is not None:
+            proc.terminate()
+        raise
     except Exception as e:
         logger.error(f"Error: {e}")
         yield f"Error: {e}"
     finally:
-        proc.terminate()
-        logger.info(f"Process terminated: {args}, {proc.returncode}")
+        if proc is not None:
+            proc.wait()
+            logger.info(f"Process finished: {args}, {proc.returncode}")
 
 
 def create_media_directory():
     if not os.path.exists(MEDIA_PATH):
         os.makedirs(MEDIA_PATH)
+    if IN_MEMORY_AUDIO:
+        os.makedirs(SCRATCH_PATH, exist_ok=True)
 
 
 create_media_directory()
+
+
+def parse_timestamp(value):
+    """Seconds from '90', '90.5', '1:30' or '01:01:30.5'; None for an empty value."""
+    if value is None or str(value).strip() == "":
+        return None
+    seconds = 0.0
+    for part in str(value).strip().split(":"):
+        seconds = seconds * 60 + float(part)
+    if seconds < 0 or not math.isfinite(seconds):
+        raise ValueError(f"invalid timestamp: {value}")
+    return seconds
+
+
+def parse_time_range(start, end):
+    """
+    Parse optional start/end request values into (start, end) seconds, either
+    of which may be None. Raises ValueError for an empty or inverted range.
+    """
+    start, end = parse_timestamp(start), parse_timestamp(end)
+    if start is not None and end is not None and end <= start:
+        raise ValueError(f"end ({end}) must be after start ({start})")
+    return start, end
+
+
+def window_duration(duration, start=None, end=None):
+    """Seconds of `duration` inside the [start, end) window, or None if unknown."""
+    if end is None and duration is None:
+        return None
+    if duration is not None:
+        end = duration if end is None else min(end, duration)
+    return max(0.0, end - (start or 0.0))
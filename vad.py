@@ -0,0 +1,90 @@
+import struct
+
+import numpy as np
+
+from config import PARALLEL_CHUNK_SECONDS, SAMPLE_RATE
+
+FRAME_MS = 30
+# how far either side of the target boundary to look for a pause
+SEARCH_SECONDS = 10
+# smoothing window, so a split lands inside a pause rather than between two syllables
+SMOOTH_MS = 300
+# frames per block when computing energies, keeps the float copy small for long files
+ENERGY_BLOCK_FRAMES = 2000
+
+
+def wav_data_offset(wav_file_path):
+    """Return (byte offset, byte length) of the PCM data chunk in a WAV file."""
+    with open(wav_file_path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError(f"{wav_file_path} is not a WAV file")
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{wav_file_path} has no data chunk")
+            chunk_id, size = struct.unpack('<4sI', header)
+            if chunk_id == b'data':
+                return f.tell(), size
+            f.seek(size + (size & 1), 1)
+
+
+def map_pcm(wav_file_path):
+    """Memory-map the s16le samples of a 16 kHz mono WAV without reading it."""
+    offset, size = wav_data_offset(wav_file_path)
+    return np.memmap(wav_file_path, dtype='<i2', mode='r', offset=offset, shape=(size // 2,))
+
+
+def frame_energies(samples, frame_ms=FRAME_MS):
+    """Mean-square energy per frame, computed block by block over the memmap."""
+    frame = SAMPLE_RATE * frame_ms // 1000
+    frames = len(samples) // frame
+    energies = np.empty(frames, dtype=np.float32)
+    for start in range(0, frames, ENERGY_BLOCK_FRAMES):
+        stop = min(start + ENERGY_BLOCK_FRAMES, frames)
+        block = np.asarray(samples[start * frame:stop * frame], dtype=np.float32).reshape(-1, frame)
+        energies[start:stop] = np.mean(block * block, axis=1)
+    return energies
+
+
+def silence_split_points(samples, target_seconds=PARALLEL_CHUNK_SECONDS, frame_ms=FRAME_MS):
+    """
+    Choose sample offsets to cut `samples` at roughly every `target_seconds`.
+
+    Each cut is moved to the quietest stretch (smoothed frame energy) within
+    SEARCH_SECONDS of the target, or half a chunk when chunks are shorter,
+    so words are not split across chunks.
+    """
+    if target_seconds <= 0:
+        raise ValueError(f"chunk length must be positive, got {target_seconds} s")
+    frame = SAMPLE_RATE * frame_ms // 1000
+    energies = frame_energies(samples, frame_ms)
+    smooth = max(1, SMOOTH_MS // frame_ms)
+    if len(energies) >= smooth:
+        energies = np.convolve(energies, np.ones(smooth, dtype=np.float32) / smooth, mode='same')
+
+    frames_per_chunk = max(1, int(target_seconds * 1000 // frame_ms))
+    # never search back past the previous cut
+    search = min(SEARCH_SECONDS * 1000 // frame_ms, frames_per_chunk // 2)
+    points = []
+    target = frames_per_chunk
+    while target < len(energies) - search:
+        window = energies[target - search:target + search + 1]
+        cut = target - search + int(np.argmin(window))
+        points.append(cut * frame)
+        target = cut + frames_per_chunk
+    return points
+
+
+def silence_chunks(wav_file_path, target_seconds=PARALLEL_CHUNK_SECONDS, start_ms=0):
+    """
+    Yield (offset_ms, pcm) chunks of a WAV split at silence boundaries. Each
+    chunk is a byte view into the memory map, so only the chunks in flight
+    are read into memory, when they are wrapped as WAVs for the pool.
+    Offsets count from `start_ms`, where the WAV begins in the original media.
+    """
+    samples = map_pcm(wav_file_path)
+    bounds = [0] + silence_split_points(samples, target_seconds) + [len(samples)]
+    for start, stop in zip(bounds, bounds[1:]):
+        if stop > start:
+            yield start_ms + start * 1000 // SAMPLE_RATE, memoryview(samples[start:stop]).cast('B')
@@ -0,0 +1,257 @@
+import atexit
+import http.client
+import queue
+import re
+import socket
+import subprocess
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import Future
+
+from config import (MODEL_PATH, WHISPER_SERVER_BINARY, WHISPER_THREADS_PER_WORKER, WHISPER_WORKER_STARTUP_TIMEOUT,
+                    WHISPER_WORKERS)
+from utils import logger
+
+# start/end are in milliseconds, the same unit whisper.cpp writes to -ocsv
+Segment = namedtuple('Segment', ['start', 'end', 'text'])
+
+SRT_TIMESTAMP = re.compile(r"(\d+):(\d+):(\d+)[,.](\d+)\s*-->\s*(\d+):(\d+):(\d+)[,.](\d+)")
+
+
+class WhisperWorkerError(Exception):
+    pass
+
+
+def format_timestamp(ms):
+    hours, ms = divmod(int(ms), 3600000)
+    minutes, ms = divmod(ms, 60000)
+    seconds, ms = divmod(ms, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{ms:03d}"
+
+
+def segment_line(segment):
+    """Render a segment the way whisper.cpp's main prints it on stdout."""
+    return f"[{format_timestamp(segment.start)} --> {format_timestamp(segment.end)}]  {segment.text}"
+
+
+def write_csv(segments, csv_file_path, mode='w'):
+    """
+    Write segments in whisper.cpp's -ocsv layout (start,end,"text" in ms),
+    with backslashes and double quotes backslash-escaped as whisper does.
+    """
+    with open(csv_file_path, mode, encoding='utf-8') as f:
+        for segment in segments:
+            text = segment.text.replace('\\', '\\\\').replace('"', '\\"')
+            f.write(f'{segment.start},{segment.end},"{text}"\n')
+
+
+def parse_srt(srt):
+    segments = []
+    for block in re.split(r"\n\s*\n", srt.strip()):
+        lines = block.strip().splitlines()
+        for i, line in enumerate(lines):
+            match = SRT_TIMESTAMP.search(line)
+            if not match:
+                continue
+            h1, m1, s1, ms1, h2, m2, s2, ms2 = (int(g) for g in match.groups())
+            start = ((h1 * 60 + m1) * 60 + s1) * 1000 + ms1
+            end = ((h2 * 60 + m2) * 60 + s2) * 1000 + ms2
+            text = ' '.join(part.strip() for part in lines[i + 1:]).strip()
+            if text:
+                segments.append(Segment(start, end, text))
+            break
+    return segments
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class WhisperWorker:
+    """
+    A long-lived whisper.cpp server process bound to a local port.
+
+    The model is loaded once when the process starts; every job afterwards is a
+    POST to /inference, so short clips no longer pay the model load.
+    """
+
+    def __init__(self, name, binary=WHISPER_SERVER_BINARY, model_path=MODEL_PATH, threads=WHISPER_THREADS_PER_WORKER):
+        self.name = name
+        self.binary = binary
+        self.model_path = model_path
+        self.threads = threads
+        self.port = None
+        self.proc = None
+
+    def start(self, timeout=WHISPER_WORKER_STARTUP_TIMEOUT):
+        self.port = _free_port()
+        args = [
+            self.binary,
+            "-m",
+            self.model_path,
+            "-t",
+            str(self.threads),
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(self.port),
+        ]
+        logger.info("Starting whisper worker %s: %s", self.name, ' '.join(args))
+        self.proc = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise WhisperWorkerError(f"whisper worker {self.name} exited with {self.proc.returncode}")
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                    logger.info("Whisper worker %s ready on port %s", self.name, self.port)
+                    return
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        raise WhisperWorkerError(f"whisper worker {self.name} did not start within {timeout}s")
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.proc = None
+
+    def transcribe(self, audio):
+        """Transcribe a WAV file path (or WAV bytes) and return its segments."""
+        if not self.alive():
+            logger.warning("Whisper worker %s is not running, restarting", self.name)
+            self.start()
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            data = audio
+        else:
+            with open(audio, 'rb') as f:
+                data = f.read()
+
+        boundary = uuid.uuid4().hex
+        fields = {'response_format': 'srt', 'temperature': '0.0'}
+        parts = []
+        for key, value in fields.items():
+            parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode()
+            )
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="audio.wav"\r\n'
+            'Content-Type: audio/wav\r\n\r\n'.encode()
+        )
+        parts.append(data)
+        parts.append(f'\r\n--{boundary}--\r\n'.encode())
+
+        conn = http.client.HTTPConnection('127.0.0.1', self.port)
+        try:
+            conn.request(
+                'POST', '/inference', body=b''.join(parts),
+                headers={'Content-Type': f'multipart/form-data; boundary={boundary}'},
+            )
+            resp = conn.getresponse()
+            body = resp.read().decode('utf8', errors='replace')
+        except (OSError, http.client.HTTPException) as e:
+            raise WhisperWorkerError(f"whisper worker {self.name} failed: {e}") from e
+        finally:
+            conn.close()
+        if resp.status != 200:
+            raise WhisperWorkerError(f"whisper worker {self.name} returned {resp.status}: {body[:200]}")
+        return parse_srt(body)
+
+
+class WhisperWorkerPool:
+    """
+    Fixed-size pool of warm whisper workers fed from a shared job queue.
+
+    At most `size` transcriptions run at once, each with `threads` whisper
+    threads, so load no longer turns into an unbounded number of processes.
+    """
+
+    def __init__(self, size=WHISPER_WORKERS, threads=WHISPER_THREADS_PER_WORKER, binary=WHISPER_SERVER_BINARY,
+                 model_path=MODEL_PATH):
+        self.size = size
+        self.threads = threads
+        self.jobs = queue.Queue()
+        self.workers = [
+            WhisperWorker(f"whisper-{i}", binary=binary, model_path=model_path, threads=threads) for i in range(size)
+        ]
+        self.threads_running = []
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+            thread = threading.Thread(target=self._run, args=(worker,), name=worker.name, daemon=True)
+            thread.start()
+            self.threads_running.append(thread)
+        return self
+
+    def _run(self, worker):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            future, audio, offset = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                segments = worker.transcribe(audio)
+                if offset:
+                    segments = [Segment(s.start + offset, s.end + offset, s.text) for s in segments]
+                future.set_result(segments)
+            except Exception as e:
+                logger.error("Whisper worker %s failed: %s", worker.name, e)
+                future.set_exception(e)
+
+    def submit(self, audio, offset=0):
+        """Queue a WAV for transcription; segments are shifted by `offset` ms."""
+        future = Future()
+        self.jobs.put((future, audio, offset))
+        return future
+
+    def transcribe(self, wav_file_path, csv_file_path=None, offset=0):
+        """
+        Transcribe a WAV on the pool and yield whisper-style `[start --> end]  text`
+        lines, writing the -ocsv equivalent to `csv_file_path` if given.
+        Timestamps are shifted by `offset` ms. Unlike the old CLI, which
+        printed lines while it ran, the worker answers once the whole WAV is
+        done, so lines only arrive at the end; split long audio into chunks
+        (vad.silence_chunks) or stream it for earlier output.
+        """
+        segments = self.submit(wav_file_path, offset).result()
+        if csv_file_path:
+            write_csv(segments, csv_file_path)
+        for segment in segments:
+            yield segment_line(segment)
+
+    def shutdown(self):
+        for _ in self.threads_running:
+            self.jobs.put(None)
+        for thread in self.threads_running:
+            thread.join(timeout=10)
+        for worker in self.workers:
+            worker.stop()
+        self.threads_running = []
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide worker pool, starting it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WhisperWorkerPool().start()
+            atexit.register(_pool.shutdown)
+        return _pool
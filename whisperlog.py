@@ -1,5 +1,12 @@
+import atexit
+import copy
+import itertools
+import json
 import logging
+import queue
 import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
 
 # Terminal escape sequences for colored output
 RESET_SEQ = "\033[0m"
@@ -16,6 +23,24 @@ LEVEL_COLORS = {
 }
 
 
+# attributes every LogRecord has; anything else was passed in `extra`
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per record, with any `extra` fields merged in."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRS)
+        return json.dumps(entry, default=str)
+
+
 class ColoredFormatter(logging.Formatter):
     def __init__(self, msg, use_color=True, custom_colors=None):
         super().__init__(msg)
@@ -54,13 +79,101 @@ class ColoredFormatter(logging.Formatter):
         return result
 
 
-def setup_logger(name, log_file, level=logging.DEBUG, custom_colors=None):
+class BatchedFileHandler(logging.FileHandler):
+    """
+    FileHandler that leaves records in the file buffer and flushes at most
+    every `flush_interval` seconds (and for anything at ERROR or above),
+    instead of issuing a write syscall per record.
+    """
+
+    def __init__(self, filename, flush_interval=1.0, buffer_size=1 << 16):
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.last_flush = time.monotonic()
+        super().__init__(filename)
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.buffer_size, encoding=self.encoding)
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            now = time.monotonic()
+            if record.levelno >= logging.ERROR or now - self.last_flush >= self.flush_interval:
+                self.flush()
+                self.last_flush = now
+        except Exception:
+            self.handleError(record)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that merges the `%` arguments into the message right away,
+    like the stdlib one, since they may change once the call returns, but
+    leaves the handlers' formatting (timestamps, layout) to the listener
+    thread. Records carrying exception info are prepared fully, since
+    tracebacks can't be formatted later.
+    """
+
+    def prepare(self, record):
+        if record.exc_info or record.stack_info:
+            return super().prepare(record)
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Let through one in `rate` records below INFO; everything else passes."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.seen = itertools.count()
+
+    def filter(self, record):
+        return record.levelno >= logging.INFO or next(self.seen) % self.rate == 0
+
+
+def _queue_handler(handlers):
+    """A DeferredQueueHandler feeding `handlers` from a QueueListener thread, stopped at exit."""
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return DeferredQueueHandler(log_queue)
+
+
+# log files each logger already writes to, so repeated calls don't duplicate handlers
+_configured = {}
+
+
+def setup_logger(name, log_file, level=logging.DEBUG, custom_colors=None, queued=False, flush_interval=1.0,
+                 debug_sample=1):
+    """
+    Configure `name` to log to `log_file` and stdout. Calling it again with
+    the same name and file returns the logger as it is; another file is
+    added to it, with the stdout handler only set up the first time.
+
+    With `queued`, the calling thread only puts records on a queue; a
+    QueueListener thread formats them and writes to the file in batches, so
+    logging stays out of streaming loops. `debug_sample` keeps one in N
+    records below INFO, e.g. the per-line whisper output.
+    """
     logger = logging.getLogger(name)
+    files = _configured.setdefault(name, set())
+    if log_file in files:
+        return logger
+    first = not files
+    files.add(log_file)
     logger.setLevel(level)
 
     # File handler
     try:
-        file_handler = logging.FileHandler(log_file)
+        file_handler = BatchedFileHandler(log_file, flush_interval) if queued else logging.FileHandler(log_file)
         file_handler.setLevel(level)
     except Exception as e:
         print(f"Error creating file handler: {e}")
@@ -70,15 +183,37 @@ def setup_logger(name, log_file, level=logging.DEBUG, custom_colors=None):
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setLevel(level)
 
-    # Formatter
-    formatter = ColoredFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s', custom_colors=custom_colors)
+    # Formatter, escape sequences are for the terminal only
+    fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     if file_handler:
-        file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
+        file_handler.setFormatter(logging.Formatter(fmt))
+    console_handler.setFormatter(ColoredFormatter(fmt, custom_colors=custom_colors))
 
-    # Add handlers
-    if file_handler:
-        logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    handlers = [handler for handler in (file_handler, console_handler if first else None) if handler]
+    if queued and handlers:
+        handlers = [_queue_handler(handlers)]
+    for handler in handlers:
+        if debug_sample > 1:
+            handler.addFilter(SamplingFilter(debug_sample))
+        logger.addHandler(handler)
+
+    return logger
 
+
+def setup_json_logger(name, log_file, level=logging.INFO, queued=False, flush_interval=1.0):
+    """
+    A logger writing JSON lines to `log_file` only, for machine consumption.
+    `queued` works as in `setup_logger`.
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+    if not logger.handlers:
+        try:
+            handler = BatchedFileHandler(log_file, flush_interval) if queued else logging.FileHandler(log_file)
+        except Exception as e:
+            print(f"Error creating file handler: {e}")
+            return logger
+        handler.setFormatter(JSONFormatter())
+        logger.addHandler(_queue_handler([handler]) if queued else handler)
     return logger